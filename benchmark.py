@@ -0,0 +1,648 @@
+import json
+import logging
+import math
+import os
+import random
+import re
+import struct
+import time
+from collections import Counter
+from functools import partial
+
+import dotenv
+from telegram import Update
+from telegram.ext import Dispatcher
+from vk_api.exceptions import ApiError
+
+import tg_bot
+import vk_bot
+from common_functions import get_answer_matcher
+from connections import create_redis, wait_for_redis
+from group_games import CLAIM_ROUND_SCRIPT, GroupGame, ReplyCoalescer, handle_group_message
+from question_bank import FETCH_QUESTION_SCRIPT, QuestionBank, create_generation, publish_generation
+from question_cache import QuestionCache
+from redis_base_init import load_questions
+from round_timers import POP_DUE_JOBS_SCRIPT
+from scores import ScoreBoard, get_member
+from tg_persistence import RedisPersistence
+from user_state import REPLACE_IF_EQUAL_SCRIPT
+from vk_dispatcher import create_dispatching_api
+from vk_idempotency import EventDeduplicator
+from webhooks import VkCallbackEvent
+
+logger = logging.getLogger(__name__)
+
+# questions of synthetic bank contain their ids, so simulated users know correct answers
+QUESTION_TEMPLATE = 'Вопрос №{}'
+QUESTION_ID_PATTERN = re.compile(r'Вопрос №(\d+)')
+ANSWER_WORDS = ['Наполеон', 'Бонапарт', 'Кутузов', 'Бородино', 'Москва', 'Пётр', 'Великий', 'Полтава', 'Суворов',
+                'Альпы', 'Екатерина', 'Вторая', 'Ломоносов', 'Пушкин', 'Гагарин', 'Восток', 'Менделеев', 'таблица']
+CATEGORIES = ['история', 'география', 'литература', 'наука', 'искусство']
+
+
+def encode_value(value):
+    """Encode value like redis-py does before sending it to Redis.
+
+    :param value: bytes, str, int or float
+    :return: bytes
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+class FakeRedis:
+    """In-process stand-in of Redis with interface of redis-py.
+
+    Only commands which are used by bots are supported. Lua scripts of bots are emulated by python functions,
+    so every script must be registered in :scripts:. Every command and every round trip is counted.
+    """
+
+    COMMANDS = {'get', 'set', 'exists', 'getset', 'incr', 'expire', 'hget', 'hmget', 'hset', 'hsetnx', 'hmset',
+                'hincrby', 'hdel', 'hgetall', 'hkeys', 'zadd', 'zrem', 'zincrby', 'zscore', 'zrevrank', 'zrevrange',
+                'dbsize', 'evalsha'}
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.scripts = {
+            FETCH_QUESTION_SCRIPT: self.run_fetch_question_script,
+            REPLACE_IF_EQUAL_SCRIPT: self.run_replace_if_equal_script,
+            CLAIM_ROUND_SCRIPT: self.run_claim_round_script,
+            POP_DUE_JOBS_SCRIPT: self.run_pop_due_jobs_script,
+        }
+        self.round_trips = 0
+        self.commands = Counter()
+
+    def __getattr__(self, name):
+        if name not in self.COMMANDS:
+            raise AttributeError(name)
+        return partial(self.call, name)
+
+    def call(self, name, *args, **kwargs):
+        self.round_trips += 1
+        return self.execute_command(name, *args, **kwargs)
+
+    def execute_command(self, name, *args, **kwargs):
+        self.commands[name] += 1
+        return getattr(self, f'do_{name}')(*args, **kwargs)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        if script not in self.scripts:
+            raise NotImplementedError('Script is not emulated')
+        return FakeScript(self, self.scripts[script])
+
+    def hscan_iter(self, name, count=None):
+        self.round_trips += 1
+        self.commands['hscan'] += 1
+        yield from list(self.get_value(name, dict).items())
+
+    def close(self):
+        pass
+
+    def get_value(self, key, value_type, create=False):
+        """Get value of key, expired keys are deleted.
+
+        :param key: name of key
+        :param value_type: type of value, bytes for strings, dict for hashes and sorted sets
+        :param create: bool, create empty value if key doesn't exist
+        :return: value or empty value of type, if key doesn't exist
+        """
+        key = encode_value(key)
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+        value = self.data.get(key)
+        if value is None:
+            value = value_type()
+            if create:
+                self.data[key] = value
+        return value
+
+    def do_get(self, name):
+        return self.data.get(encode_value(name)) if self.get_value(name, bytes) else None
+
+    def do_set(self, name, value, ex=None, nx=False):
+        key = encode_value(name)
+        if nx and self.do_get(name) is not None:
+            return None
+        self.data[key] = encode_value(value)
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.do_expire(name, ex)
+        return True
+
+    def do_exists(self, *names):
+        return sum(1 for name in names if self.get_value(name, bytes) or self.get_value(name, dict))
+
+    def do_getset(self, name, value):
+        old_value = self.do_get(name)
+        self.do_set(name, value)
+        return old_value
+
+    def do_incr(self, name):
+        value = int(self.do_get(name) or 0) + 1
+        self.data[encode_value(name)] = encode_value(value)
+        return value
+
+    def do_expire(self, name, time_seconds):
+        key = encode_value(name)
+        if key not in self.data:
+            return False
+        self.expires[key] = time.monotonic() + time_seconds
+        return True
+
+    def do_hget(self, name, key):
+        return self.get_value(name, dict).get(encode_value(key))
+
+    def do_hmget(self, name, keys, *args):
+        value = self.get_value(name, dict)
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys, *args]
+        return [value.get(encode_value(key)) for key in keys]
+
+    def do_hsetnx(self, name, key, value):
+        hash_value = self.get_value(name, dict, create=True)
+        if encode_value(key) in hash_value:
+            return 0
+        hash_value[encode_value(key)] = encode_value(value)
+        return 1
+
+    def do_hincrby(self, name, key, amount=1):
+        hash_value = self.get_value(name, dict, create=True)
+        new_value = int(hash_value.get(encode_value(key), 0)) + amount
+        hash_value[encode_value(key)] = encode_value(new_value)
+        return new_value
+
+    def do_hset(self, name, key, value):
+        hash_value = self.get_value(name, dict, create=True)
+        is_new = encode_value(key) not in hash_value
+        hash_value[encode_value(key)] = encode_value(value)
+        return int(is_new)
+
+    def do_hmset(self, name, mapping):
+        for key, value in mapping.items():
+            self.do_hset(name, key, value)
+        return True
+
+    def do_hdel(self, name, *keys):
+        hash_value = self.get_value(name, dict)
+        return sum(hash_value.pop(encode_value(key), None) is not None for key in keys)
+
+    def do_hgetall(self, name):
+        return dict(self.get_value(name, dict))
+
+    def do_hkeys(self, name):
+        return list(self.get_value(name, dict))
+
+    def do_zadd(self, name, mapping):
+        sorted_set = self.get_value(name, dict, create=True)
+        added = sum(encode_value(member) not in sorted_set for member in mapping)
+        for member, score in mapping.items():
+            sorted_set[encode_value(member)] = float(score)
+        return added
+
+    def do_zrem(self, name, *values):
+        sorted_set = self.get_value(name, dict)
+        return sum(sorted_set.pop(encode_value(value), None) is not None for value in values)
+
+    def do_zincrby(self, name, amount, value):
+        sorted_set = self.get_value(name, dict, create=True)
+        member = encode_value(value)
+        sorted_set[member] = sorted_set.get(member, 0.0) + amount
+        return sorted_set[member]
+
+    def do_zscore(self, name, value):
+        return self.get_value(name, dict).get(encode_value(value))
+
+    def do_zrevrank(self, name, value):
+        sorted_set = self.get_value(name, dict)
+        member = encode_value(value)
+        if member not in sorted_set:
+            return None
+        return sum(score > sorted_set[member] or (score == sorted_set[member] and other_member > member)
+                   for other_member, score in sorted_set.items())
+
+    def do_zrevrange(self, name, start, end, withscores=False):
+        members = sorted(self.get_value(name, dict).items(), key=lambda item: (item[1], item[0]), reverse=True)
+        members = members[start:end + 1 if end != -1 else None]
+        if withscores:
+            return members
+        return [member for member, _ in members]
+
+    def do_dbsize(self):
+        return len(self.data)
+
+    def do_evalsha(self, script_function, keys, args):
+        return script_function([encode_value(key) for key in keys], [encode_value(arg) for arg in args])
+
+    def run_fetch_question_script(self, keys, args):
+        """Emulation of question_bank.FETCH_QUESTION_SCRIPT."""
+        generation, count = int(args[0]), int(args[1])
+        member, question_filter = args[2], args[5]
+        position = int(args[3]) % count + 1
+        schedule_field = member + b'|' + question_filter if question_filter else member
+
+        if member:
+            schedule = self.do_hget(keys[2], schedule_field)
+            if schedule is not None:
+                schedule = struct.unpack('>IIII', schedule)
+                if schedule[0] != generation or schedule[3] >= count:
+                    schedule = None
+            if schedule is None:
+                step = max(int(args[3]) % count, 1)
+                while math.gcd(step, count) != 1:
+                    step += 1
+                schedule = (generation, step, int(args[4]) % count, 0)
+            _, step, offset, cursor = schedule
+            position = (step * cursor + offset) % count + 1
+
+        question_id = position
+        if question_filter:
+            question_id = self.do_hget(keys[3], position)
+            if question_id is None:
+                return None
+            question_id = int(question_id)
+        question = answer = None
+        if args[9] != b'1':
+            question = self.do_hget(keys[0], question_id)
+            if question is None:
+                return None
+            answer = self.do_hget(keys[1], question_id)
+        if member:
+            self.do_hset(keys[2], schedule_field, struct.pack('>IIII', generation, step, offset, cursor + 1))
+
+        previous_answer = self.do_hget(keys[5], args[8]) if len(keys) > 5 else None
+        if len(keys) > 4:
+            user_info = struct.pack('>BBII', 1, 1, generation, question_id)
+            if args[7]:
+                user_info = struct.pack('>BBII', 2, 1, generation, question_id) + args[7]
+            self.do_hset(keys[4], args[6], user_info)
+        return [question, answer, previous_answer, question_id]
+
+    def run_claim_round_script(self, keys, args):
+        """Emulation of group_games.CLAIM_ROUND_SCRIPT."""
+        if self.do_hget(keys[0], 'round') != args[0]:
+            return 0
+        return self.do_hsetnx(keys[0], 'winner', args[1])
+
+    def run_pop_due_jobs_script(self, keys, args):
+        """Emulation of round_timers.POP_DUE_JOBS_SCRIPT."""
+        due_jobs = sorted((score, member) for member, score in self.get_value(keys[0], dict).items()
+                          if score <= float(args[0]))
+        result = []
+        for _, member in due_jobs[:int(args[1])]:
+            self.do_zrem(keys[0], member)
+            result.extend([member, self.do_hget(keys[1], member)])
+            self.do_hdel(keys[1], member)
+        return result
+
+    def run_replace_if_equal_script(self, keys, args):
+        """Emulation of user_state.REPLACE_IF_EQUAL_SCRIPT."""
+        if self.do_hget(keys[0], args[0]) == args[1]:
+            self.do_hset(keys[0], args[0], args[2])
+            return 1
+        return 0
+
+
+class FakePipeline:
+    """Pipeline of FakeRedis, all queued commands are one round trip."""
+
+    def __init__(self, redis_db):
+        self.redis_db = redis_db
+        self.queue = []
+
+    def __getattr__(self, name):
+        if name not in FakeRedis.COMMANDS:
+            raise AttributeError(name)
+
+        def queue_command(*args, **kwargs):
+            self.queue.append((name, args, kwargs))
+            return self
+
+        return queue_command
+
+    def execute(self):
+        queue, self.queue = self.queue, []
+        self.redis_db.round_trips += 1
+        return [self.redis_db.execute_command(name, *args, **kwargs) for name, args, kwargs in queue]
+
+
+class FakeScript:
+    """Registered script of FakeRedis, it is called like redis-py Script."""
+
+    def __init__(self, redis_db, script_function):
+        self.redis_db = redis_db
+        self.script_function = script_function
+
+    def __call__(self, keys=(), args=(), client=None):
+        client = client or self.redis_db
+        return client.evalsha(self.script_function, keys, args)
+
+
+class FakeTgBot:
+    """Stand-in of telegram bot, messages are only remembered."""
+
+    # CommandHandler checks commands like /start@quiz_bot
+    username = 'quiz_bot'
+
+    def __init__(self):
+        self.sent = 0
+        self.last_messages = {}
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+        self.last_messages[chat_id] = text
+
+
+class FakeVkApi:
+    """Stand-in of VK API method object, messages are only remembered.
+
+    :param failed_destinations: iterable of ids of users and conversations, messages to them fail like in VK
+    """
+
+    EXECUTE_CALL = 'API.messages.send('
+    SEND_ERROR = {'method': 'messages.send', 'error_code': 901,
+                  'error_msg': "Can't send messages for users without permission"}
+
+    def __init__(self, failed_destinations=()):
+        self.messages = self
+        # session of API object, 'execute' is called by session to get execute_errors
+        self._vk = self
+        self.failed_destinations = set(failed_destinations)
+        self.sent = 0
+        self.last_messages = {}
+
+    def send(self, **params):
+        destination = params.get('user_id', params.get('peer_id'))
+        if destination in self.failed_destinations:
+            raise ApiError(self, 'messages.send', params, False, self.SEND_ERROR)
+        self.sent += 1
+        self.last_messages[destination] = params['message']
+        return self.sent
+
+    def execute(self, code):
+        return self.method('execute', {'code': code})
+
+    def method(self, method, values=None, raw=False):
+        """Execute code of vk_dispatcher.get_execute_code, only calls of messages.send are supported."""
+        if method != 'execute':
+            raise NotImplementedError(method)
+        code = values['code']
+        decoder = json.JSONDecoder()
+        results = []
+        execute_errors = []
+        position = code.find(self.EXECUTE_CALL)
+        while position != -1:
+            params, position = decoder.raw_decode(code, position + len(self.EXECUTE_CALL))
+            try:
+                results.append(self.send(**params))
+            except ApiError as e:
+                # failed call of execute returns false, other calls are executed
+                results.append(False)
+                execute_errors.append(e.error)
+            position = code.find(self.EXECUTE_CALL, position)
+        if not raw:
+            return results
+        response = {'response': results}
+        if execute_errors:
+            response['execute_errors'] = execute_errors
+        return response
+
+
+def create_tg_update_data(update_id, user_id, text, chat_id=None):
+    """Create dict of update with text message like telegram sends it.
+
+    :param update_id: int, id of update
+    :param user_id: int, id of sender
+    :param text: str, text of message, commands get entity of command
+    :param chat_id: int or None, id of group chat (negative), private chat of user if None
+    :return: dict
+    """
+    chat_id = user_id if chat_id is None else chat_id
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Игрок'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def iter_synthetic_questions(count, seed=0):
+    """Generate questions with metadata, text of question contains its id.
+
+    :param count: int, count of questions
+    :param seed: int, seed of random generator
+    :return: generator of tuples (question_num, question_answer)
+    """
+    question_random = random.Random(seed)
+    for question_id in range(1, count + 1):
+        yield str(question_id), {
+            'q': QUESTION_TEMPLATE.format(question_id),
+            'a': ' '.join(question_random.sample(ANSWER_WORDS, 2)),
+            'category': question_random.choice(CATEGORIES),
+            'difficulty': question_random.randint(1, 3),
+        }
+
+
+def get_user_text(last_message, answers, user_random):
+    """Choose message of simulated user by last message of bot.
+
+    :param last_message: str or None, last message which user got
+    :param answers: dict, question id -> answer
+    :param user_random: random.Random object
+    :return: str, text of message
+    """
+    found = QUESTION_ID_PATTERN.search(last_message or '')
+    if found is None:
+        return 'Мой счёт' if user_random.random() < 0.05 else 'Новый вопрос'
+
+    dice = user_random.random()
+    if dice < 0.6:
+        return answers[int(found.group(1))]
+    if dice < 0.9:
+        return ' '.join(user_random.sample(ANSWER_WORDS, 2))
+    return 'Сдаться'
+
+
+def get_percentile(sorted_values, percent):
+    """Get percentile of sorted values.
+
+    :param sorted_values: list of numbers, sorted
+    :param percent: number from 0 to 100
+    :return: number
+    """
+    return sorted_values[min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)]
+
+
+def measure(name, redis_db, handle_events):
+    """Run handlers and log latency, count of Redis calls and throughput.
+
+    :param name: str, name of benchmark
+    :param redis_db: FakeRedis object
+    :param handle_events: generator which handles one event per iteration
+    """
+    # commands are counted only by FakeRedis
+    is_counted = isinstance(redis_db, FakeRedis)
+    latencies = []
+    round_trips = redis_db.round_trips if is_counted else 0
+    commands = Counter(redis_db.commands) if is_counted else Counter()
+    started_at = time.perf_counter()
+    event_started_at = started_at
+
+    for _ in handle_events:
+        finished_at = time.perf_counter()
+        latencies.append(finished_at - event_started_at)
+        event_started_at = time.perf_counter()
+
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    events = len(latencies)
+    logger.info(f'{name}: {events} events, {events / elapsed:.0f} events/sec, '
+                f'p50 {get_percentile(latencies, 50) * 1000:.3f} ms, p99 {get_percentile(latencies, 99) * 1000:.3f} ms')
+    if not is_counted:
+        return
+
+    round_trips = redis_db.round_trips - round_trips
+    commands = redis_db.commands - commands
+    logger.info(f'{name}: {round_trips / events:.2f} Redis round trips/event, '
+                f'{sum(commands.values()) / events:.2f} commands/event')
+    logger.info(f'{name} commands: ' + ', '.join(f'{command}={count}' for command, count in commands.most_common()))
+
+
+def run_tg_events(redis_db, question_bank, answers, users, events, seed=0):
+    """Drive dispatcher with handlers and persistence of telegram bot, like polling of tg_bot does.
+
+    :return: generator, one event is handled per iteration
+    """
+    bot = FakeTgBot()
+    answer_matcher = get_answer_matcher('words', limit=0.5)
+    score_board = ScoreBoard(redis_db)
+    dispatcher = Dispatcher(bot, None, workers=0, persistence=RedisPersistence(redis_db))
+    for handler in tg_bot.create_handlers(question_bank, answer_matcher, score_board, persistent=True):
+        dispatcher.add_handler(handler)
+    user_random = random.Random(seed)
+
+    for update_id in range(1, events + 1):
+        user_id = user_random.randint(1, users)
+        last_message = bot.last_messages.get(user_id)
+        # conversation is started by command
+        text = '/start' if last_message is None else get_user_text(last_message, answers, user_random)
+        dispatcher.process_update(Update.de_json(create_tg_update_data(update_id, user_id, text), bot))
+        yield
+
+
+def run_vk_events(redis_db, question_bank, answers, users, events, vk_api_rate=1000, seed=0):
+    """Drive vk_bot.handle_event with synthetic events, messages are sent by dispatcher like in vk_bot.
+
+    Messages are sent by background thread, so simulated users can answer by previous message.
+
+    :return: generator, one event is handled per iteration
+    """
+    fake_vk_api = FakeVkApi()
+    vk_api, dispatcher = create_dispatching_api(fake_vk_api, rate=vk_api_rate)
+    users_db = vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank)
+    answer_matcher = get_answer_matcher('words', limit=0.5)
+    score_board = ScoreBoard(redis_db)
+    deduplicator = EventDeduplicator(redis_db)
+    user_random = random.Random(seed)
+
+    for message_id in range(1, events + 1):
+        user_id = user_random.randint(1, users)
+        text = get_user_text(fake_vk_api.last_messages.get(user_id), answers, user_random)
+        event = VkCallbackEvent({'id': message_id, 'from_id': user_id, 'text': text})
+        vk_bot.handle_event(event, vk_api, users_db, answer_matcher, score_board, deduplicator)
+        yield
+
+    dispatcher.join()
+    logger.info(f'vk: {fake_vk_api.sent} messages were sent for {events} events')
+
+
+def run_group_events(redis_db, question_bank, chats, users, events, replies_interval, seed=0):
+    """Drive group games: many users answer the same question of chat, replies are coalesced.
+
+    Simulated users know answer of current round, so many of them answer correctly at the same time.
+
+    :return: generator, one event is handled per iteration
+    """
+    bot = FakeTgBot()
+    group_game = GroupGame(redis_db, question_bank)
+    group_replies = ReplyCoalescer(interval=replies_interval)
+    answer_matcher = get_answer_matcher('words', limit=0.5)
+    score_board = ScoreBoard(redis_db)
+    user_random = random.Random(seed)
+    awarded = 0
+
+    for _ in range(events):
+        chat_id = -user_random.randint(1, chats)
+        user_id = user_random.randint(1, users)
+        current_round = group_game.get_round(get_member('tg', chat_id))
+        if current_round is None:
+            text = 'Новый вопрос'
+        elif user_random.random() < 0.5:
+            text = current_round[1]
+        else:
+            text = ' '.join(user_random.sample(ANSWER_WORDS, 2))
+
+        msg = handle_group_message('tg', group_game, answer_matcher, score_board, chat_id, user_id, 'Игрок', text)
+        if msg is not None:
+            awarded += msg.startswith('Игрок первым')
+            group_replies.add(get_member('tg', chat_id), msg, partial(bot.send_message, chat_id))
+        yield
+
+    time.sleep(replies_interval * 2)
+    logger.info(f'group: {awarded} rounds were won, {bot.sent} messages were sent for {events} events')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s', level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    dotenv.load_dotenv()
+    benchmark_questions = int(os.getenv('BENCHMARK_QUESTIONS', default=10000))
+    benchmark_users = int(os.getenv('BENCHMARK_USERS', default=1000))
+    benchmark_events = int(os.getenv('BENCHMARK_EVENTS', default=20000))
+    benchmark_seed = int(os.getenv('BENCHMARK_SEED', default=0))
+    benchmark_group_chats = int(os.getenv('BENCHMARK_GROUP_CHATS', default=10))
+    benchmark_group_replies_interval = float(os.getenv('BENCHMARK_GROUP_REPLIES_INTERVAL', default=0.05))
+    benchmark_question_cache = os.getenv('BENCHMARK_QUESTION_CACHE', default='false').lower() in ('1', 'true', 'yes')
+    benchmark_vk_api_rate = float(os.getenv('BENCHMARK_VK_API_RATE', default=1000))
+    benchmark_redis_address = os.getenv('BENCHMARK_REDIS_ADDRESS')
+    benchmark_redis_port = os.getenv('BENCHMARK_REDIS_PORT')
+    benchmark_redis_password = os.getenv('BENCHMARK_REDIS_PASSWORD')
+
+    if benchmark_redis_address:
+        # Lua scripts are executed by Redis, commands are not counted
+        redis_db = create_redis(benchmark_redis_address, benchmark_redis_port, benchmark_redis_password)
+        wait_for_redis(redis_db)
+    else:
+        redis_db = FakeRedis()
+    generation = create_generation(redis_db, 'QuestionBankGeneration')
+    started_at = time.perf_counter()
+    load_questions(redis_db, iter_synthetic_questions(benchmark_questions, benchmark_seed), 'QuestionAnswerHash',
+                   generation)
+    publish_generation(redis_db, 'QuestionBankGeneration', generation, 'QuestionAnswerHash')
+    logger.info(f'{benchmark_questions} questions were loaded for {time.perf_counter() - started_at:.2f} sec')
+
+    answers = {int(question_num): question_answer['a']
+               for question_num, question_answer in iter_synthetic_questions(benchmark_questions, benchmark_seed)}
+    question_cache = QuestionCache(redis_db, 'QuestionAnswerHash') if benchmark_question_cache else None
+    question_bank = QuestionBank(redis_db, 'QuestionAnswerHash', question_cache=question_cache)
+    question_bank.preload()
+
+    measure('telegram', redis_db, run_tg_events(redis_db, question_bank, answers, benchmark_users, benchmark_events,
+                                                benchmark_seed))
+    measure('vk', redis_db, run_vk_events(redis_db, question_bank, answers, benchmark_users, benchmark_events,
+                                          benchmark_vk_api_rate, benchmark_seed))
+    measure('group', redis_db, run_group_events(redis_db, question_bank, benchmark_group_chats, benchmark_users,
+                                                benchmark_events, benchmark_group_replies_interval, benchmark_seed))
@@ -1,3 +1,8 @@
+from functools import lru_cache
+
+from stemming import fold_text, get_edit_distance, get_ngrams, stem_word
+
+
 def normalize_answer(answer):
     """Do manipulations with answer for checking.
 
@@ -10,37 +15,274 @@ def normalize_answer(answer):
     return answer_without_explanation.lower()
 
 
-def is_correct_answer(user_answer, correct_answer, limit, answer_handler=None):
-    """Check if answer correct (more than :limit: of words is ok).
+def get_words(answer, answer_handler=None):
+    """Get set of words of answer.
 
-    :param user_answer: text of user answer
-    :param correct_answer: text of correct answer
-    :param limit: number between 0 and 1, this is percentage of correct answers
+    :param answer: str, text of answer
     :param answer_handler: functions, this functions should do manipulations with answers to normalize them.
     If you don't need to normalize answer, you will set this param 'None'
-    :return: bool, correct or no
+    :return: frozenset of words
     """
-
-    # prepare answers
-    prepared_correct_answer = correct_answer
-    prepared_user_answer = user_answer
     if answer_handler is not None:
-        prepared_correct_answer = answer_handler(correct_answer)
-        prepared_user_answer = answer_handler(user_answer)
+        answer = answer_handler(answer)
+    return frozenset(answer.split())
 
-    # sets of words
-    words_of_correct_answer = set(prepared_correct_answer.split())
-    words_of_user_answer = set(prepared_user_answer.split())
 
-    # correct words - intersection of sets
-    correct_words = words_of_correct_answer.intersection(words_of_user_answer)
+def is_correct_words(user_answer_words, correct_answer_words, limit):
+    """Check if words of answer correct (more than :limit: of words is ok).
+
+    :param user_answer_words: set of words of user answer
+    :param correct_answer_words: set of words of correct answer
+    :param limit: number between 0 and 1, this is percentage of correct answers
+    :return: bool, correct or no. Empty answer is always incorrect
+    """
+    number_of_user_answer_words = len(user_answer_words)
+    if not number_of_user_answer_words:
+        return False
 
-    # calculate len of correct and len of user answer
-    number_of_correct_words = len(correct_words)
-    number_of_user_answer_words = len(words_of_user_answer)
+    # correct words - intersection of sets
+    number_of_correct_words = len(correct_answer_words.intersection(user_answer_words))
 
     # calculate percentage of correct and compare with limit
     percentage_of_correct_words = number_of_correct_words / number_of_user_answer_words
-    correct_words_more_or_equal_than_limit = percentage_of_correct_words >= limit
+    return percentage_of_correct_words >= limit
+
+
+class WordsAnswerMatcher:
+    """Checker of answers by intersection of words (more than :limit: of words is ok).
+
+    Correct answers of loaded generations are prepared at loading (see add_index),
+    other correct answers are prepared at the first check and cached.
+
+    :param limit: number between 0 and 1, this is percentage of correct answers
+    :param answer_handler: functions, see get_words
+    :param cache_size: int, count of cached correct answers
+    """
+
+    def __init__(self, limit, answer_handler=normalize_answer, cache_size=10000):
+        self.limit = limit
+        self.answer_handler = answer_handler
+        self.get_cached_correct_answer = lru_cache(maxsize=cache_size)(self.prepare_correct_answer)
+        # generation -> AnswerIndex, not more than 2 generations
+        self.indexes = {}
+
+    def add_index(self, generation, answer_index):
+        """Use prepared answers of generation, indexes of old generations are dropped.
+
+        :param generation: str, generation of questions bank
+        :param answer_index: AnswerIndex object of this matcher
+        """
+        indexes = dict(self.indexes)
+        indexes[generation] = answer_index
+        for old_generation in sorted(indexes, key=int)[:-2]:
+            del indexes[old_generation]
+        # dict is replaced, so checks in other threads don't see it while it is changed
+        self.indexes = indexes
+
+    def get_prepared_correct_answer(self, correct_answer):
+        """Get prepared correct answer from indexes or from cache.
+
+        :param correct_answer: str, text of correct answer
+        :return: prepared answer
+        """
+        for answer_index in self.indexes.values():
+            prepared_answer = answer_index.get_prepared_answer(correct_answer)
+            if prepared_answer is not None:
+                return prepared_answer
+        return self.get_cached_correct_answer(correct_answer)
+
+    def prepare_correct_answer(self, correct_answer):
+        """Prepare correct answer for checking.
+
+        :param correct_answer: str, text of correct answer
+        :return: prepared answer
+        """
+        return get_words(correct_answer, self.answer_handler)
+
+    def prepare_user_answer(self, user_answer):
+        """Prepare user answer for checking.
+
+        :param user_answer: str, text of user answer
+        :return: prepared answer
+        """
+        return get_words(user_answer, self.answer_handler)
+
+    def is_correct_prepared(self, prepared_user_answer, prepared_correct_answer):
+        """Check prepared answers.
+
+        :param prepared_user_answer: result of prepare_user_answer
+        :param prepared_correct_answer: result of prepare_correct_answer
+        :return: bool, correct or no
+        """
+        return is_correct_words(prepared_user_answer, prepared_correct_answer, self.limit)
+
+    def is_correct(self, user_answer, correct_answer):
+        """Check answer.
+
+        :param user_answer: str, text of user answer
+        :param correct_answer: str, text of correct answer
+        :return: bool, correct or no
+        """
+        return self.is_correct_prepared(self.prepare_user_answer(user_answer),
+                                        self.get_prepared_correct_answer(correct_answer))
+
+
+class FuzzyAnswerMatcher(WordsAnswerMatcher):
+    """Checker of answers which compares stems of words and allows typos.
+
+    'Петра' and 'Пётр' are the same word for this checker, 'Наплеон' is the same as 'Наполеон'.
+    Stems and n-grams of correct answers are prepared when questions cache loads generation (see AnswerIndex).
+
+    :param limit: number between 0 and 1, this is percentage of correct answers
+    :param answer_handler: functions, see get_words
+    :param cache_size: int, count of cached correct answers
+    :param max_distance: int, max count of typos in one word
+    :param min_word_length: int, typos are allowed only in words not shorter than this length
+    """
+
+    def __init__(self, limit, answer_handler=normalize_answer, cache_size=10000, max_distance=1,
+                 min_word_length=5):
+        super().__init__(limit, answer_handler, cache_size)
+        self.max_distance = max_distance
+        self.min_word_length = min_word_length
+
+    def prepare_user_answer(self, user_answer):
+        if self.answer_handler is not None:
+            user_answer = self.answer_handler(user_answer)
+        return frozenset(stem_word(word) for word in fold_text(user_answer).split())
+
+    def prepare_correct_answer(self, correct_answer):
+        stems = self.prepare_user_answer(correct_answer)
+        return stems, [(stem, get_ngrams(stem)) for stem in stems]
+
+    def is_similar_word(self, user_stem, correct_stems_ngrams):
+        """Check if stem of user word is like one of stems of correct answer.
+
+        Two words with k typos have at least (length - 3 * k) common 3-grams,
+        so edit distance is calculated only for suitable words.
+
+        :param user_stem: str, stem of user word
+        :param correct_stems_ngrams: list of tuples (stem, n-grams of stem)
+        :return: bool
+        """
+        if len(user_stem) < self.min_word_length:
+            return False
+
+        user_ngrams = get_ngrams(user_stem)
+        for correct_stem, correct_ngrams in correct_stems_ngrams:
+            if len(correct_stem) < self.min_word_length:
+                continue
+            min_common_ngrams = max(len(user_stem), len(correct_stem)) - 3 * self.max_distance
+            if len(user_ngrams & correct_ngrams) < min_common_ngrams:
+                continue
+            if get_edit_distance(user_stem, correct_stem, self.max_distance) <= self.max_distance:
+                return True
+        return False
+
+    def is_correct_prepared(self, prepared_user_answer, prepared_correct_answer):
+        if not prepared_user_answer:
+            return False
+
+        correct_stems, correct_stems_ngrams = prepared_correct_answer
+        number_of_correct_words = 0
+        for user_stem in prepared_user_answer:
+            if user_stem in correct_stems or self.is_similar_word(user_stem, correct_stems_ngrams):
+                number_of_correct_words += 1
+
+        return number_of_correct_words / len(prepared_user_answer) >= self.limit
+
+
+ANSWER_MATCHERS = {
+    'words': WordsAnswerMatcher,
+    'fuzzy': FuzzyAnswerMatcher,
+}
+
+
+def get_answer_matcher(name, limit):
+    """Create checker of answers by name.
+
+    :param name: str, 'words' - intersection of words, 'fuzzy' - stems of words and typos
+    :param limit: number between 0 and 1, this is percentage of correct answers
+    :return: answer matcher object
+    """
+    return ANSWER_MATCHERS[name](limit)
+
+
+class AnswerIndex:
+    """Correct answers prepared for checking of many answers.
+
+    Usage:
+        1. Load answers (QuestionCache loads answers of every generation)
+        2. Check answers by one or by batches, or give index to matcher (see WordsAnswerMatcher.add_index)
+
+    :param answer_matcher: answer matcher object, for example WordsAnswerMatcher
+    """
+
+    def __init__(self, answer_matcher):
+        self.answer_matcher = answer_matcher
+        self.prepared_answers = {}
+        # text of answer -> prepared answer, the same texts share prepared answer
+        self.prepared_texts = {}
+
+    def add_answer(self, question_id, correct_answer):
+        """Prepare correct answer.
+
+        :param question_id: id of question
+        :param correct_answer: str, text of correct answer
+        """
+        prepared_answer = self.prepared_texts.get(correct_answer)
+        if prepared_answer is None:
+            prepared_answer = self.answer_matcher.prepare_correct_answer(correct_answer)
+            self.prepared_texts[correct_answer] = prepared_answer
+        self.prepared_answers[question_id] = prepared_answer
+
+    def get_prepared_answer(self, correct_answer):
+        """Get prepared correct answer by text.
+
+        :param correct_answer: str, text of correct answer
+        :return: prepared answer or None if answer was not loaded
+        """
+        return self.prepared_texts.get(correct_answer)
+
+    def load_answers(self, answers):
+        """Prepare many correct answers.
+
+        :param answers: iterable of tuples (question_id, correct_answer)
+        :return: int, count of loaded answers
+        """
+        count = 0
+        for question_id, correct_answer in answers:
+            self.add_answer(question_id, correct_answer)
+            count += 1
+        return count
+
+    def is_correct(self, user_answer, question_id):
+        """Check one answer.
+
+        :param user_answer: text of user answer
+        :param question_id: id of question, answer should be loaded
+        :return: bool, correct or no
+        """
+        prepared_user_answer = self.answer_matcher.prepare_user_answer(user_answer)
+        return self.answer_matcher.is_correct_prepared(prepared_user_answer, self.prepared_answers[question_id])
+
+    def check_answers(self, user_answers):
+        """Check many answers.
+
+        The same texts of answers are prepared one time for all batch.
+
+        :param user_answers: iterable of tuples (user_answer, question_id)
+        :return: list of bool, correct or no for every answer
+        """
+        prepared_user_answers = {}
+        results = []
+        for user_answer, question_id in user_answers:
+            prepared_user_answer = prepared_user_answers.get(user_answer)
+            if prepared_user_answer is None:
+                prepared_user_answer = self.answer_matcher.prepare_user_answer(user_answer)
+                prepared_user_answers[user_answer] = prepared_user_answer
+
+            results.append(self.answer_matcher.is_correct_prepared(prepared_user_answer,
+                                                                   self.prepared_answers[question_id]))
 
-    return correct_words_more_or_equal_than_limit
+        return results
@@ -0,0 +1,152 @@
+import logging
+import random
+import socket
+import threading
+import time
+
+import redis
+
+from metrics import InstrumentedRedis
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    """Exponential backoff with jitter, thread-safe.
+
+    Delay after n-th failure in a row is random between half and full of min(:max_delay:, :base_delay: * 2 ** (n - 1)),
+    so many clients which lost connection at the same time don't reconnect at the same time.
+
+    :param base_delay: float, seconds of delay after first failure
+    :param max_delay: float, max seconds of delay
+    """
+
+    def __init__(self, base_delay=0.5, max_delay=30):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.retry_at = 0
+        self.lock = threading.Lock()
+
+    def failed(self):
+        """Register failure and plan time of next attempt.
+
+        :return: float, seconds of delay before next attempt
+        """
+        with self.lock:
+            self.failures += 1
+            delay = min(self.max_delay, self.base_delay * 2 ** min(self.failures - 1, 32))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self.retry_at = time.monotonic() + delay
+            return delay
+
+    def reset(self):
+        """Register success, next failure gets the smallest delay."""
+        if not self.failures:
+            return
+        with self.lock:
+            self.failures = 0
+            self.retry_at = 0
+
+    def get_wait_time(self):
+        """Get seconds which are left before next attempt.
+
+        :return: float
+        """
+        return max(0, self.retry_at - time.monotonic())
+
+    def sleep(self):
+        """Wait until time of next attempt."""
+        wait_time = self.get_wait_time()
+        if wait_time:
+            time.sleep(wait_time)
+
+
+class BackoffConnection(redis.Connection):
+    """Redis connection which doesn't reconnect more often than backoff allows.
+
+    All connections of pool share one backoff, so when Redis is down the pool doesn't make reconnect storm.
+
+    :param backoff: Backoff object
+    """
+
+    def __init__(self, backoff=None, **kwargs):
+        super().__init__(**kwargs)
+        self.backoff = backoff or Backoff()
+
+    def connect(self):
+        if self._sock:
+            return
+
+        self.backoff.sleep()
+        try:
+            super().connect()
+        except (redis.ConnectionError, redis.TimeoutError):
+            delay = self.backoff.failed()
+            logger.warning('Redis connection failed, next attempt in %.1f sec', delay)
+            raise
+        self.backoff.reset()
+
+
+def get_keepalive_options():
+    """Get options of TCP keepalive which detect dead connection in about a minute.
+
+    :return: dict, option -> value, empty if platform doesn't support options
+    """
+    options = {}
+    for name, value in [('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3)]:
+        if hasattr(socket, name):
+            options[getattr(socket, name)] = value
+    return options
+
+
+def create_redis(host=None, port=None, password=None, max_connections=50, socket_timeout=5,
+                 health_check_interval=30, backoff_max_delay=30):
+    """Create Redis client with pool of connections.
+
+    Pool doesn't open more than :max_connections: connections, threads wait free connection.
+    Connections are checked by keepalive and by PING if they were idle longer than :health_check_interval:.
+
+    :param host: str, host of Redis
+    :param port: int or str, port of Redis
+    :param password: str or None, password of Redis
+    :param max_connections: int, max count of connections
+    :param socket_timeout: float, seconds of waiting of connection and answer
+    :param health_check_interval: int, seconds of idle after which connection is checked before use
+    :param backoff_max_delay: float, max seconds between reconnects
+    :return: InstrumentedRedis object
+    """
+    connection_pool = redis.BlockingConnectionPool(
+        max_connections=max_connections,
+        timeout=socket_timeout,
+        connection_class=BackoffConnection,
+        backoff=Backoff(max_delay=backoff_max_delay),
+        host=host or 'localhost',
+        port=int(port or 6379),
+        password=password,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=socket_timeout,
+        socket_keepalive=True,
+        socket_keepalive_options=get_keepalive_options(),
+        health_check_interval=health_check_interval,
+    )
+    return InstrumentedRedis(connection_pool=connection_pool)
+
+
+def wait_for_redis(redis_db):
+    """Wait until Redis answers to PING, so bot doesn't crash if it is started before Redis.
+
+    Connections of pool wait backoff between attempts. Errors of configuration (wrong password,
+    error answer of Redis) are raised at once, waiting doesn't fix them.
+
+    :param redis_db: Redis client which is created by create_redis
+    """
+    while True:
+        try:
+            redis_db.ping()
+            return
+        except redis.AuthenticationError:
+            # it is subclass of ConnectionError
+            raise
+        except (redis.ConnectionError, redis.TimeoutError):
+            logger.warning('Redis is not available')
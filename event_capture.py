@@ -0,0 +1,113 @@
+import glob
+import json
+import logging
+import time
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_event(platform, event):
+    """Get payload of event which is enough to replay it.
+
+    :param platform: str, 'vk' or 'tg'
+    :param event: VK event (long poll or callback) or telegram Update
+    :return: dict
+    """
+    if platform == 'tg':
+        return event.to_dict()
+    return {
+        'user_id': event.user_id,
+        'peer_id': getattr(event, 'peer_id', event.user_id),
+        'message_id': getattr(event, 'message_id', None),
+        'text': event.text,
+    }
+
+
+class EventRecorder:
+    """Writer of incoming events to file, one compact JSON per line: {"t": time, "p": platform, "e": payload}.
+
+    File is rotated when it reaches :max_bytes:, only :backup_count: old files are kept (path.1 is the newest),
+    so capture can be left enabled in production. Recorder is thread-safe.
+
+    :param path: str, path to capture file
+    :param max_bytes: int, max size of one file
+    :param backup_count: int, count of old files
+    """
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backup_count=3):
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        # own logger, records don't get to logs of bot
+        self.capture_logger = logging.Logger(f'{__name__}.{path}')
+        self.capture_logger.addHandler(self.handler)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def record(self, platform, event):
+        """Write event, errors of writing don't break handling of event.
+
+        :param platform: str, 'vk' or 'tg'
+        :param event: VK event or telegram Update
+        """
+        try:
+            line = json.dumps({'t': round(time.time(), 3), 'p': platform, 'e': serialize_event(platform, event)},
+                              ensure_ascii=False, separators=(',', ':'))
+        except (TypeError, ValueError, AttributeError):
+            self.logger.exception('Event was not recorded')
+            return
+        self.capture_logger.info(line)
+
+    def wrap(self, platform, handle_event):
+        """Wrap handler of events, every event is recorded before handling.
+
+        :param platform: str, 'vk' or 'tg'
+        :param handle_event: function(event, ...), handler of events
+        :return: function
+        """
+
+        def recorded_handler(event, *args, **kwargs):
+            self.record(platform, event)
+            return handle_event(event, *args, **kwargs)
+
+        return recorded_handler
+
+    def record_update(self, bot, update):
+        """Handler of telegram dispatcher which records every update, add it to group which is before others."""
+        self.record('tg', update)
+
+
+def get_capture_paths(path):
+    """Get capture files from the oldest to the newest.
+
+    :param path: str, path to capture file
+    :return: list of str
+    """
+    backups = []
+    for backup_path in glob.glob(f'{glob.escape(path)}.*'):
+        suffix = backup_path[len(path) + 1:]
+        if suffix.isdigit():
+            backups.append((int(suffix), backup_path))
+    return [backup_path for _, backup_path in sorted(backups, reverse=True)] + [path]
+
+
+def iter_captured_events(path):
+    """Read captured events from all files of capture.
+
+    :param path: str, path to capture file
+    :return: generator of tuples (time, platform, payload)
+    """
+    for capture_path in get_capture_paths(path):
+        try:
+            f = open(capture_path, encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with f:
+            for line_num, line in enumerate(f, start=1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line can be cut if bot was stopped while writing
+                    logger.warning(f'Line {line_num} of {capture_path} was skipped')
+                    continue
+                yield record['t'], record['p'], record['e']
@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import ERRORS, count_answer
+from scores import get_member
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] - hash of game of chat
+# ARGV[1] - number of round, ARGV[2] - winner (member of user or '' if round is closed without winner)
+# Round is won only one time: winner is set only if round is current and it has no winner yet
+CLAIM_ROUND_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'round') ~= ARGV[1] then
+    return 0
+end
+return redis.call('HSETNX', KEYS[1], 'winner', ARGV[2])
+"""
+
+GREETING_MSG = ('Викторина для всего чата! Напишите "Новый вопрос", чтобы получить вопрос. '
+                'Балл получает тот, кто первым ответит правильно. "Сдаться" - узнать ответ, "Мой счёт" - ваши баллы.')
+
+
+class GroupGame:
+    """Games in group chats: one active question per chat, the first correct answer wins.
+
+    Round is kept in Redis hash '<prefix>:<chat>' with fields round, answer, winner.
+    Answers of users are checked locally, winner is chosen atomically by script,
+    so concurrent correct answers (even in different processes) give only one point.
+
+    :param redis_db: object of connection redis db
+    :param question_bank: QuestionBank object
+    :param prefix: str, prefix of names of hashes of games in redis
+    :param ttl: int, seconds while game of inactive chat is kept
+    """
+
+    def __init__(self, redis_db, question_bank, prefix='GroupGames', ttl=7 * 24 * 3600):
+        self.redis_db = redis_db
+        self.question_bank = question_bank
+        self.prefix = prefix
+        self.ttl = ttl
+        self.claim_round_script = redis_db.register_script(CLAIM_ROUND_SCRIPT)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def get_key(self, chat):
+        return f'{self.prefix}:{chat}'
+
+    def start_round(self, chat):
+        """Give new question to chat.
+
+        Questions are not repeated in chat until all questions were given, chat has own schedule.
+
+        :param chat: str, chat (see scores.get_member)
+        :return: tuple, (question, answer of previous round if nobody answered it or None)
+        """
+        fetched_question = self.question_bank.get_random_question(member=chat)
+        key = self.get_key(chat)
+        pipe = self.redis_db.pipeline(transaction=True)
+        pipe.hmget(key, 'answer', 'winner')
+        pipe.hincrby(key, 'round', 1)
+        pipe.hset(key, 'answer', fetched_question.answer)
+        pipe.hdel(key, 'winner')
+        pipe.expire(key, self.ttl)
+        (previous_answer, previous_winner), *_ = pipe.execute()
+
+        if previous_answer is not None and previous_winner is None:
+            previous_answer = previous_answer.decode('utf-8')
+        else:
+            previous_answer = None
+        return fetched_question.question, previous_answer
+
+    def get_round(self, chat):
+        """Get current round of chat.
+
+        :param chat: str, chat (see scores.get_member)
+        :return: tuple (number of round, answer) or None if chat has no question or question was already answered
+        """
+        round_num, answer, winner = self.redis_db.hmget(self.get_key(chat), 'round', 'answer', 'winner')
+        if round_num is None or answer is None or winner is not None:
+            return None
+        return round_num.decode('utf-8'), answer.decode('utf-8')
+
+    def claim(self, chat, round_num, winner=''):
+        """Close round, only the first claim of round succeeds.
+
+        :param chat: str, chat (see scores.get_member)
+        :param round_num: str, number of round
+        :param winner: str, member of user who answered correctly or '' if round is closed without winner
+        :return: bool, True if round was closed by this claim
+        """
+        return bool(self.claim_round_script(keys=[self.get_key(chat)], args=[round_num, winner]))
+
+
+def handle_group_message(platform, group_game, answer_matcher, score_board, chat_id, user_id, name, text):
+    """Logic of bot in group chat.
+
+    Users get question by "Новый вопрос" and answer to it by messages,
+    the first correct answer wins, other messages are answered only while question is active.
+
+    :param platform: str, 'vk' or 'tg'
+    :param group_game: GroupGame object
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param chat_id: id of chat
+    :param user_id: id of author of message
+    :param name: str, name of author which is used in messages
+    :param text: str, text of message
+    :return: str or None, text of reply
+    """
+    chat = get_member(platform, chat_id)
+    member = get_member(platform, user_id)
+
+    if text in ('/start', 'Начать'):
+        return GREETING_MSG
+    if text == 'Новый вопрос':
+        question, previous_answer = group_game.start_round(chat)
+        msg = ''
+        if previous_answer is not None:
+            msg += f'Правильный ответ на прошлый вопрос:\n{previous_answer}\n\n'
+        msg += f'Вопрос для всех:\n{question}'
+        return msg
+    if text == 'Мой счёт':
+        return f'{name}\n' + score_board.get_score_message(member)
+
+    current_round = group_game.get_round(chat)
+    if current_round is None:
+        # chat talks between questions
+        return None
+    round_num, answer = current_round
+
+    if text == 'Сдаться':
+        if not group_game.claim(chat, round_num):
+            return None
+        count_answer(platform, 'give_up')
+        return f'Правильный ответ:\n{answer}\nНапишите "Новый вопрос", чтобы продолжить.'
+
+    if not answer_matcher.is_correct(text, answer):
+        count_answer(platform, 'incorrect')
+        return 'Неверно, попробуйте ещё.'
+    if not group_game.claim(chat, round_num, member):
+        # somebody answered earlier
+        return None
+    count_answer(platform, 'correct')
+    score_board.add_points(member)
+    return f'{name} первым ответил правильно! Полный ответ:\n{answer}\nНапишите "Новый вопрос", чтобы продолжить.'
+
+
+class ReplyCoalescer:
+    """Sender of replies to chats, chat gets not more than one message per :interval:.
+
+    Replies of interval are joined to one message, the same replies are merged with count,
+    so a flood of answers doesn't become a flood of messages. Replies are sent by background thread,
+    thread is started by the first reply, so coalescer can be created before fork of workers.
+
+    :param interval: float, min seconds between messages to one chat
+    """
+
+    def __init__(self, interval=3):
+        self.interval = interval
+        # chat -> [OrderedDict text -> count, function(text) which sends message]
+        self.pending = {}
+        # chat -> time when chat can get next message
+        self.next_send_at = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def add(self, chat, text, send):
+        """Put reply to queue of chat.
+
+        :param chat: str, chat (see scores.get_member)
+        :param text: str, text of reply
+        :param send: function(text), sends message to chat
+        """
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='ReplyCoalescer', daemon=True)
+                self.thread.start()
+            texts, _ = self.pending.setdefault(chat, [OrderedDict(), send])
+            texts[text] = texts.get(text, 0) + 1
+            self.pending[chat][1] = send
+            self.condition.notify()
+
+    def pop_ready(self):
+        """Get replies of chats which can get message now.
+
+        :return: tuple, (list of tuples (chat, text, send), seconds before next ready chat or None)
+        """
+        now = time.monotonic()
+        ready = []
+        wait_time = None
+        for chat in list(self.pending):
+            next_send_at = self.next_send_at.get(chat, 0)
+            if next_send_at > now:
+                wait_time = min(wait_time or self.interval, next_send_at - now)
+                continue
+            texts, send = self.pending.pop(chat)
+            message = '\n\n'.join(text if count == 1 else f'{text} (x{count})' for text, count in texts.items())
+            ready.append((chat, message, send))
+            self.next_send_at[chat] = now + self.interval
+
+        # chats without messages in the last interval don't need to be remembered
+        for chat in [chat for chat, next_send_at in self.next_send_at.items() if next_send_at <= now]:
+            del self.next_send_at[chat]
+        return ready, wait_time
+
+    def run(self):
+        while True:
+            with self.condition:
+                ready, wait_time = self.pop_ready()
+                if not ready:
+                    self.condition.wait(wait_time)
+                    continue
+
+            for chat, message, send in ready:
+                try:
+                    send(message)
+                except Exception:
+                    ERRORS.labels('group_reply').inc()
+                    self.logger.exception('Reply was not sent, chat=%s', chat)
@@ -0,0 +1,131 @@
+import logging
+import time
+from contextlib import contextmanager
+
+import redis
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest, push_to_gateway,
+                               start_http_server)
+from redis.client import Pipeline
+
+logger = logging.getLogger(__name__)
+
+# buckets from 0.5 ms, Redis commands and handlers are fast
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+EVENTS_HANDLED = Counter('quiz_bot_events_total', 'Count of handled events', ['platform'])
+HANDLER_LATENCY = Histogram('quiz_bot_handler_seconds', 'Latency of handling of event', ['platform'],
+                            buckets=LATENCY_BUCKETS)
+ANSWERS = Counter('quiz_bot_answers_total', 'Count of answers of users', ['platform', 'outcome'])
+REDIS_LATENCY = Histogram('quiz_bot_redis_command_seconds', 'Latency of Redis commands and pipelines', ['command'],
+                          buckets=LATENCY_BUCKETS)
+SEND_LATENCY = Histogram('quiz_bot_send_seconds', 'Latency of sending of messages', ['platform'],
+                         buckets=LATENCY_BUCKETS)
+ERRORS = Counter('quiz_bot_errors_total', 'Count of errors', ['component'])
+QUESTIONS_LOADED = Counter('quiz_bot_questions_loaded_total', 'Count of questions which were written by loader')
+
+METRICS_PATH = '/metrics'
+
+
+@contextmanager
+def track_latency(histogram, error_component=None):
+    """Observe duration of block, count error if block raised exception.
+
+    :param histogram: child of histogram with labels
+    :param error_component: str or None, label of errors counter
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if error_component is not None:
+            ERRORS.labels(error_component).inc()
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started_at)
+
+
+@contextmanager
+def track_event(platform):
+    """Count event and observe latency of its handling.
+
+    :param platform: str, 'vk' or 'tg'
+    """
+    EVENTS_HANDLED.labels(platform).inc()
+    with track_latency(HANDLER_LATENCY.labels(platform), f'{platform}_handler'):
+        yield
+
+
+def track_handler(platform, handler):
+    """Wrap handler of events by track_event.
+
+    :param platform: str, 'vk' or 'tg'
+    :param handler: function, handler of event
+    :return: function
+    """
+
+    def tracked_handler(*args, **kwargs):
+        with track_event(platform):
+            return handler(*args, **kwargs)
+
+    return tracked_handler
+
+
+def count_answer(platform, outcome):
+    """Count answer of user.
+
+    :param platform: str, 'vk' or 'tg'
+    :param outcome: str, 'correct', 'incorrect', 'give_up' or 'timeout'
+    """
+    ANSWERS.labels(platform, outcome).inc()
+
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline which observes latency of execution, all commands of pipeline are one observation."""
+
+    def execute(self, raise_on_error=True):
+        with track_latency(REDIS_LATENCY.labels('PIPELINE'), 'redis'):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client which observes latency of every command."""
+
+    def execute_command(self, *args, **options):
+        with track_latency(REDIS_LATENCY.labels(args[0]), 'redis'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def get_metrics():
+    """Get metrics in text format of Prometheus.
+
+    :return: tuple, (bytes, content type)
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port):
+    """Start HTTP server with /metrics in background thread if port is given.
+
+    :param port: int or None, port of server
+    """
+    if not port:
+        return
+    start_http_server(port)
+    logger.info('Metrics server was started on port %s', port)
+
+
+def push_metrics(gateway, job):
+    """Push metrics to Prometheus Pushgateway if it is given.
+
+    :param gateway: str or None, address of Pushgateway
+    :param job: str, name of job
+    """
+    if not gateway:
+        return
+    try:
+        push_to_gateway(gateway, job=job, registry=REGISTRY)
+    except OSError:
+        logger.exception('Metrics were not pushed to %s', gateway)
@@ -0,0 +1,491 @@
+import logging
+import random
+import time
+import zlib
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+FetchedQuestion = namedtuple('FetchedQuestion', ['question', 'answer', 'previous_answer', 'generation', 'question_id'])
+
+# Compressed texts start with this byte, plain utf-8 text never starts with it
+COMPRESSED_MARK = b'\x00'
+
+# KEYS[1] - hash of questions, KEYS[2] - hash of answers, KEYS[3] - hash of schedules of users,
+# KEYS[4] - index of filter: hash of positions of questions in filter,
+# KEYS[5] - hash of users (optional), KEYS[6] - hash of answers of previous question generation (optional)
+# ARGV[1] - generation, ARGV[2] - count of questions in filter, ARGV[3] - member of schedule ('' - question is random),
+# ARGV[4], ARGV[5] - random numbers, ARGV[6] - filter ('' - all questions),
+# ARGV[7] - user id (optional), ARGV[8] - filter of user which is wrote to user info (optional),
+# ARGV[9] - previous question id (optional), ARGV[10] - '1' if texts are taken from local cache
+# Schedule of member is permutation of positions: position = (step * cursor + offset) % count + 1,
+# step is coprime with count, so positions are not repeated until cursor reaches count.
+# Without filter position is id of question, with filter id is read from index.
+# Schedule is packed to 16 bytes: generation, step, offset, cursor. Every filter has own schedule.
+# Info about user is packed like in user_state: version 1 (2 with filter), flag 'got question', generation,
+# question id, filter
+FETCH_QUESTION_SCRIPT = """
+local generation = tonumber(ARGV[1])
+local count = tonumber(ARGV[2])
+local position = tonumber(ARGV[4]) % count + 1
+local schedule_field = ARGV[3]
+if ARGV[6] ~= '' then
+    schedule_field = schedule_field .. '|' .. ARGV[6]
+end
+local schedule = false
+local step, offset, cursor
+if ARGV[3] ~= '' then
+    schedule = redis.call('HGET', KEYS[3], schedule_field)
+    if schedule then
+        local schedule_generation
+        schedule_generation, step, offset, cursor = struct.unpack('>IIII', schedule)
+        if schedule_generation ~= generation or cursor >= count then
+            schedule = false
+        end
+    end
+    if not schedule then
+        -- all questions were given or bank was reloaded, new permutation is started
+        step = math.max(tonumber(ARGV[4]) % count, 1)
+        local a, b = step, count
+        while b ~= 0 do
+            a, b = b, a % b
+        end
+        while a ~= 1 do
+            step = step + 1
+            a, b = step, count
+            while b ~= 0 do
+                a, b = b, a % b
+            end
+        end
+        offset = tonumber(ARGV[5]) % count
+        cursor = 0
+    end
+    position = (step * cursor + offset) % count + 1
+end
+
+local question_id = position
+if ARGV[6] ~= '' then
+    question_id = redis.call('HGET', KEYS[4], position)
+    if not question_id then
+        return nil
+    end
+    question_id = tonumber(question_id)
+end
+local ids_only = ARGV[10] == '1'
+local question = false
+local answer = false
+if not ids_only then
+    question = redis.call('HGET', KEYS[1], question_id)
+    if not question then
+        return nil
+    end
+    answer = redis.call('HGET', KEYS[2], question_id)
+end
+if ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[3], schedule_field, struct.pack('>IIII', generation, step, offset, cursor + 1))
+end
+local previous_answer = false
+if KEYS[6] then
+    previous_answer = redis.call('HGET', KEYS[6], ARGV[9])
+end
+if KEYS[5] then
+    local user_info = struct.pack('>BBII', 1, 1, generation, question_id)
+    if ARGV[8] ~= '' then
+        user_info = struct.pack('>BBII', 2, 1, generation, question_id) .. ARGV[8]
+    end
+    redis.call('HSET', KEYS[5], ARGV[7], user_info)
+end
+return {question, answer, previous_answer, question_id}
+"""
+
+
+def encode_text(text, compress=False):
+    """Prepare text of question or answer for writing to Redis.
+
+    :param text: str, text of question or answer
+    :param compress: bool, compress text if it makes text shorter
+    :return: bytes, encoded text
+    """
+    encoded_text = str(text).encode('utf-8')
+    if not compress:
+        return encoded_text
+
+    compressed_text = COMPRESSED_MARK + zlib.compress(encoded_text, 9)
+    if len(compressed_text) < len(encoded_text):
+        return compressed_text
+    return encoded_text
+
+
+def decode_text(encoded_text):
+    """Decode text of question or answer which was read from Redis.
+
+    :param encoded_text: bytes or None, text from Redis
+    :return: str or None
+    """
+    if encoded_text is None:
+        return None
+    if encoded_text.startswith(COMPRESSED_MARK):
+        encoded_text = zlib.decompress(encoded_text[len(COMPRESSED_MARK):])
+    return encoded_text.decode('utf-8')
+
+
+def get_generation_keys(redis_hash_name, generation):
+    """Get names of keys of questions bank generation.
+
+    Questions have integer ids from 1 to count of questions.
+
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param generation: bytes or str, generation of questions bank
+    :return: tuple, (name of hash of questions, name of hash of answers, name of key with count of questions)
+    """
+    if isinstance(generation, bytes):
+        generation = generation.decode('utf-8')
+    prefix = f'{redis_hash_name}:{generation}'
+    return f'{prefix}:q', f'{prefix}:a', f'{prefix}:count'
+
+
+def get_generation_index_keys(redis_hash_name, generation):
+    """Get names of keys of metadata and indexes of questions bank generation.
+
+    Every filter (category, difficulty or both) has index: hash of positions from 1 to count of questions
+    in filter -> id of question, so random question of filter is got by position without scanning.
+
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param generation: bytes or str, generation of questions bank
+    :return: tuple, (name of hash of metadata of questions, name of hash of counts of questions in filters,
+        prefix of names of indexes)
+    """
+    if isinstance(generation, bytes):
+        generation = generation.decode('utf-8')
+    prefix = f'{redis_hash_name}:{generation}'
+    return f'{prefix}:meta', f'{prefix}:index_counts', f'{prefix}:index'
+
+
+def normalize_filter_value(value):
+    """Normalize category or difficulty: lower case, 'ё' -> 'е', single spaces, without ':' and '|'.
+
+    :param value: str, int or None
+    :return: str, empty if value is not given
+    """
+    if value is None:
+        return ''
+    return ' '.join(str(value).lower().replace('ё', 'е').replace(':', ' ').replace('|', ' ').split())
+
+
+def get_filter_name(category=None, difficulty=None):
+    """Get name of filter of questions.
+
+    :param category: str or None, normalized category
+    :param difficulty: str or None, normalized difficulty
+    :return: str or None, None if filter is empty
+    """
+    parts = []
+    if category:
+        parts.append(f'category:{category}')
+    if difficulty:
+        parts.append(f'difficulty:{difficulty}')
+    return '|'.join(parts) or None
+
+
+def parse_filter_name(question_filter):
+    """Get category and difficulty from name of filter.
+
+    :param question_filter: str or None, name of filter
+    :return: tuple, (category or None, difficulty or None)
+    """
+    fields = {'category': None, 'difficulty': None}
+    for part in (question_filter or '').split('|'):
+        if ':' in part:
+            field, value = part.split(':', 1)
+            fields[field] = value
+    return fields['category'], fields['difficulty']
+
+
+def get_question_filters(question_answer):
+    """Get names of filters which contain question.
+
+    :param question_answer: dict, record of questions file with optional keys 'category' and 'difficulty'
+    :return: list of names of filters
+    """
+    category = normalize_filter_value(question_answer.get('category'))
+    difficulty = normalize_filter_value(question_answer.get('difficulty'))
+    filters = []
+    for question_filter in [get_filter_name(category=category), get_filter_name(difficulty=difficulty),
+                            get_filter_name(category, difficulty)]:
+        if question_filter is not None and question_filter not in filters:
+            filters.append(question_filter)
+    return filters
+
+
+def handle_filter_command(question_bank, text, question_filter):
+    """Change filter of questions of user by command.
+
+    Commands: 'Темы' - list of categories, 'Тема <category>', 'Сложность <difficulty>' - choose filter,
+    'Тема все', 'Сложность все' - reset filter.
+
+    :param question_bank: QuestionBank object
+    :param text: str, message of user
+    :param question_filter: str or None, current filter of user
+    :return: tuple, (new filter, text of answer) or None if message is not command
+    """
+    command, _, value = text.strip().partition(' ')
+    command = command.lower()
+    value = normalize_filter_value(value)
+    category, difficulty = parse_filter_name(question_filter)
+
+    if command == 'темы':
+        categories, difficulties = question_bank.get_filter_values()
+        if not categories and not difficulties:
+            return question_filter, 'Вопросы не разделены на темы.'
+        msg = ''
+        if categories:
+            msg += 'Темы: ' + ', '.join(categories) + '\n'
+        if difficulties:
+            msg += 'Сложность: ' + ', '.join(difficulties) + '\n'
+        msg += 'Напишите "Тема <название>" или "Сложность <значение>", чтобы выбрать, "Тема все" - чтобы сбросить.'
+        return question_filter, msg
+
+    if command not in ('тема', 'сложность') or not value:
+        return None
+
+    if value == 'все':
+        value = None
+    if command == 'тема':
+        category = value
+    else:
+        difficulty = value
+
+    new_filter = get_filter_name(category, difficulty)
+    if new_filter is not None and not question_bank.get_filter_count(new_filter):
+        return question_filter, 'Таких вопросов нет. Напишите "Темы", чтобы узнать темы и сложность вопросов.'
+    if new_filter is None:
+        return None, 'Теперь вопросы будут из всех тем.'
+    parts = []
+    if category:
+        parts.append(f'тема "{category}"')
+    if difficulty:
+        parts.append(f'сложность "{difficulty}"')
+    return new_filter, f'Теперь вопросы будут выбраны так: {", ".join(parts)}.'
+
+
+def create_generation(redis_db, generation_key_name):
+    """Get number of new generation of questions bank.
+
+    :param redis_db: redis database object
+    :param generation_key_name: name of key in redis which points to current generation
+    :return: str, new generation
+    """
+    return str(redis_db.incr(f'{generation_key_name}:counter'))
+
+
+def publish_generation(redis_db, generation_key_name, generation, redis_hash_name, old_generation_ttl=60):
+    """Switch bots to new generation of questions bank.
+
+    Pointer is switched by one command, so bots never see half loaded bank.
+    Old generation is not deleted at once, bots may use it until they notice new pointer.
+
+    :param redis_db: redis database object
+    :param generation_key_name: name of key in redis which points to current generation
+    :param generation: str, new generation
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param old_generation_ttl: int, seconds while old generation will be available
+    :return: bytes or None, previous generation
+    """
+    old_generation = redis_db.getset(generation_key_name, generation)
+    logger.debug(f'Generation {generation} was published')
+
+    if old_generation is not None and old_generation.decode('utf-8') != generation:
+        meta_hash_name, index_counts_hash_name, index_prefix = get_generation_index_keys(redis_hash_name,
+                                                                                         old_generation)
+        pipe = redis_db.pipeline(transaction=False)
+        for key in get_generation_keys(redis_hash_name, old_generation):
+            pipe.expire(key, old_generation_ttl)
+        for question_filter in redis_db.hkeys(index_counts_hash_name):
+            pipe.expire(f'{index_prefix}:{question_filter.decode("utf-8")}', old_generation_ttl)
+        pipe.expire(meta_hash_name, old_generation_ttl)
+        pipe.expire(index_counts_hash_name, old_generation_ttl)
+        pipe.execute()
+        logger.debug(f'Generation {old_generation.decode("utf-8")} will be deleted in {old_generation_ttl} sec')
+
+    return old_generation
+
+
+class QuestionBank:
+    """Questions and answers DB in Redis.
+
+    Bank is versioned: loader writes new generation under new keys and switches pointer.
+    Pointer is read not more often than one time in :refresh_interval: seconds.
+    Questions have integer ids, so random question is chosen without query to Redis.
+    Questions are not repeated for user until all questions of generation were given to him:
+    every user has own permutation of ids, only parameters of permutation and cursor are kept (16 bytes per user).
+    Questions can be filtered by category and difficulty, questions of filter are got by index without scanning.
+    If local cache is given, texts of questions and answers are taken from it, Redis keeps only states.
+
+    :param redis_db: object of connection redis db
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param generation_key_name: name of key in redis which points to current generation
+    :param refresh_interval: float, seconds between checks of pointer
+    :param schedule_hash_name: name of hash of users schedules in redis
+    :param question_cache: QuestionCache object or None, if texts are read from Redis
+    """
+
+    def __init__(self, redis_db, redis_hash_name, generation_key_name='QuestionBankGeneration', refresh_interval=5,
+                 schedule_hash_name='QuestionSchedule', question_cache=None):
+        self.redis_db = redis_db
+        self.redis_hash_name = redis_hash_name
+        self.generation_key_name = generation_key_name
+        self.refresh_interval = refresh_interval
+        self.schedule_hash_name = schedule_hash_name
+        self.question_cache = question_cache
+        self.generation = None
+        self.question_count = 0
+        self.filter_counts = {}
+        self.keys = None
+        self.index_prefix = None
+        self.checked_at = None
+        self.fetch_question_script = redis_db.register_script(FETCH_QUESTION_SCRIPT)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def refresh(self, force=False):
+        """Check pointer to current generation and reread count of questions if generation was changed.
+
+        :param force: bool, check pointer even if :refresh_interval: didn't pass
+        """
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < self.refresh_interval:
+            return
+
+        generation = self.redis_db.get(self.generation_key_name)
+        self.checked_at = now
+        if generation is None:
+            return
+        if self.question_cache is not None:
+            # new generation is loaded in background, loading is retried at the next check if it failed
+            self.question_cache.update(generation.decode('utf-8'))
+        if generation.decode('utf-8') == self.generation:
+            return
+
+        keys = get_generation_keys(self.redis_hash_name, generation)
+        _, index_counts_hash_name, index_prefix = get_generation_index_keys(self.redis_hash_name, generation)
+        pipe = self.redis_db.pipeline(transaction=False)
+        pipe.get(keys[2])
+        pipe.hgetall(index_counts_hash_name)
+        question_count, filter_counts = pipe.execute()
+        self.question_count = int(question_count or 0)
+        self.filter_counts = {question_filter.decode('utf-8'): int(count)
+                              for question_filter, count in filter_counts.items()}
+        self.generation = generation.decode('utf-8')
+        self.keys = keys
+        self.index_prefix = index_prefix
+        self.logger.debug(f'Questions bank generation was changed, generation={self.generation}, '
+                          f'count={self.question_count}, filters={len(self.filter_counts)}')
+
+    def preload(self):
+        """Load current generation to local cache before serving, if cache is given."""
+        self.refresh(force=True)
+        if self.question_cache is not None and self.generation is not None:
+            self.question_cache.update(self.generation, wait=True)
+
+    def get_filter_count(self, question_filter):
+        """Get count of questions in filter.
+
+        :param question_filter: str, name of filter, see get_filter_name
+        :return: int, 0 if filter is unknown
+        """
+        self.refresh()
+        return self.filter_counts.get(question_filter, 0)
+
+    def get_filter_values(self):
+        """Get all categories and difficulties of questions of current generation.
+
+        :return: tuple, (sorted list of categories, sorted list of difficulties)
+        """
+        self.refresh()
+        categories = set()
+        difficulties = set()
+        for question_filter in self.filter_counts:
+            category, difficulty = parse_filter_name(question_filter)
+            if category is not None:
+                categories.add(category)
+            if difficulty is not None:
+                difficulties.add(difficulty)
+        return sorted(categories), sorted(difficulties)
+
+    def get_answer(self, generation, question_id):
+        """Get answer by question id.
+
+        :param generation: str or int, generation of questions bank where question was got
+        :param question_id: int, id of question
+        :return: str or None, None if generation was already deleted
+        """
+        if self.question_cache is not None and self.question_cache.has(generation):
+            return self.question_cache.get_answer(generation, int(question_id))
+
+        _, answers_hash_name, _ = get_generation_keys(self.redis_hash_name, str(generation))
+        return decode_text(self.redis_db.hget(answers_hash_name, question_id))
+
+    def get_random_question(self, users_hash_name=None, user_id=None, previous_question=None, member=None,
+                            question_filter=None):
+        """Get random question with answer.
+
+        Question is got by one script call. If member is given, question is got by his schedule
+        and isn't repeated until all questions were given. If user is given, id of question is wrote to user info
+        in the same call. If previous question is given, its answer is got in the same call too.
+
+        :param users_hash_name: name of hash of users in redis or None, if don't need to write user info
+        :param user_id: id of user
+        :param previous_question: tuple (generation, question id) or None
+        :param member: str or None, member of schedule (see scores.get_member), None - question is random
+        :param question_filter: str or None, name of filter (see get_filter_name), None - all questions
+        :return: FetchedQuestion, previous_answer is None if previous question is not given
+        """
+        self.refresh()
+
+        for attempt in range(2):
+            if not self.question_count:
+                raise LookupError(f'Questions bank is not loaded, pointer={self.generation_key_name}')
+
+            used_filter = question_filter
+            count = self.question_count
+            if used_filter is not None:
+                count = self.filter_counts.get(used_filter, 0)
+                if not count:
+                    # filter could disappear after reload of questions, user keeps it for the next reloads
+                    self.logger.debug('Filter %s is unknown, all questions are used', used_filter)
+                    used_filter = None
+                    count = self.question_count
+
+            # texts are taken from cache, script only chooses id and writes states
+            ids_only = self.question_cache is not None and self.question_cache.has(self.generation)
+            previous_from_cache = (previous_question is not None and self.question_cache is not None
+                                   and self.question_cache.has(previous_question[0]))
+
+            questions_hash_name, answers_hash_name, _ = self.keys
+            keys = [questions_hash_name, answers_hash_name, self.schedule_hash_name,
+                    f'{self.index_prefix}:{used_filter or ""}']
+            args = [self.generation, count, member or '', random.getrandbits(32), random.getrandbits(32),
+                    used_filter or '', '', '', '', '1' if ids_only else '']
+            if users_hash_name is not None:
+                keys.append(users_hash_name)
+                args[6:8] = [user_id, question_filter or '']
+                if previous_question is not None and not previous_from_cache:
+                    previous_generation, previous_question_id = previous_question
+                    keys.append(get_generation_keys(self.redis_hash_name, str(previous_generation))[1])
+                    args[8] = previous_question_id
+
+            question_answer = self.fetch_question_script(keys=keys, args=args)
+            if question_answer is not None:
+                question, answer, previous_answer, question_id = question_answer
+                question, answer = decode_text(question), decode_text(answer)
+                if ids_only:
+                    question, answer = self.question_cache.get_question(self.generation, question_id)
+                previous_answer = decode_text(previous_answer)
+                if previous_from_cache:
+                    previous_answer = self.question_cache.get_answer(*previous_question)
+                return FetchedQuestion(question, answer, previous_answer, int(self.generation), question_id)
+
+            # generation was deleted while pointer was cached
+            self.refresh(force=True)
+
+        raise LookupError(f'Question was not found, generation={self.generation}')
@@ -0,0 +1,284 @@
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from array import array
+from mmap import ACCESS_READ, mmap
+
+from common_functions import AnswerIndex
+from question_bank import decode_text, get_generation_keys
+
+logger = logging.getLogger(__name__)
+
+# Snapshot of generation: header (magic, generation, count of questions), offsets of texts, texts.
+# Texts are stored like in Redis (maybe compressed): question 1, answer 1, question 2, answer 2, ...
+# Offsets are unsigned 64-bit numbers in byte order of platform, snapshot is read on the host where it was written.
+SNAPSHOT_MAGIC = b'QBSNAP01'
+SNAPSHOT_HEADER = struct.Struct('>8sII')
+
+
+class QuestionSnapshot:
+    """Read-only questions and answers of one generation in one buffer.
+
+    Buffer can be memory-mapped file, then texts are read from page cache and are shared by all processes.
+
+    :param buffer: bytes or mmap, content of snapshot
+    """
+
+    def __init__(self, buffer):
+        magic, generation, count = SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('Buffer is not snapshot of questions bank')
+        self.buffer = buffer
+        self.generation = str(generation)
+        self.count = count
+        offsets_end = SNAPSHOT_HEADER.size + (2 * count + 1) * 8
+        self.offsets = memoryview(buffer)[SNAPSHOT_HEADER.size:offsets_end].cast('Q')
+        self.texts_start = offsets_end
+
+    def get_text(self, text_num):
+        start = self.texts_start + self.offsets[text_num]
+        end = self.texts_start + self.offsets[text_num + 1]
+        return decode_text(bytes(self.buffer[start:end]))
+
+    def get_question(self, question_id):
+        """Get question and answer by id.
+
+        :param question_id: int, id of question from 1
+        :return: tuple (question, answer) or None if id is unknown
+        """
+        if not 1 <= question_id <= self.count:
+            return None
+        text_num = 2 * (question_id - 1)
+        return self.get_text(text_num), self.get_text(text_num + 1)
+
+    def get_answer(self, question_id):
+        """Get answer by question id.
+
+        :param question_id: int, id of question from 1
+        :return: str or None if id is unknown
+        """
+        if not 1 <= question_id <= self.count:
+            return None
+        return self.get_text(2 * question_id - 1)
+
+    def iter_answers(self):
+        """Iterate over all answers.
+
+        :return: generator of tuples (question_id, answer)
+        """
+        for question_id in range(1, self.count + 1):
+            yield question_id, self.get_text(2 * question_id - 1)
+
+
+class SnapshotWriter:
+    """Writer of snapshot file, questions must be added in order of ids.
+
+    Texts are written to temporary file and snapshot is assembled by close, so memory keeps only offsets.
+    Snapshot replaces old file atomically, bots never read half written snapshot.
+
+    :param path: str, path to snapshot
+    :param generation: str, generation of questions bank
+    """
+
+    def __init__(self, path, generation):
+        self.path = path
+        self.generation = int(generation)
+        self.offsets = array('Q', [0])
+        self.texts = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+
+    def add(self, question, answer):
+        """Add encoded texts of question with next id.
+
+        :param question: bytes, encoded question, see question_bank.encode_text
+        :param answer: bytes, encoded answer
+        """
+        for text in (question, answer):
+            self.texts.write(text)
+            self.offsets.append(self.offsets[-1] + len(text))
+
+    def close(self):
+        """Write snapshot file."""
+        count = (len(self.offsets) - 1) // 2
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.generation, count))
+            f.write(self.offsets.tobytes())
+            self.texts.seek(0)
+            shutil.copyfileobj(self.texts, f)
+        self.texts.close()
+        os.replace(tmp_path, self.path)
+        logger.info(f'Snapshot of {count} questions was written to {self.path}')
+
+
+def load_snapshot_from_redis(redis_db, redis_hash_name, generation, batch_size=1000):
+    """Read all questions of generation from Redis to snapshot in memory.
+
+    :param redis_db: redis database object
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param generation: str, generation of questions bank
+    :param batch_size: int, count of questions which are read by one pipeline
+    :return: QuestionSnapshot or None if generation was deleted
+    """
+    questions_hash_name, answers_hash_name, count_key_name = get_generation_keys(redis_hash_name, generation)
+    count = redis_db.get(count_key_name)
+    if count is None:
+        return None
+    count = int(count)
+
+    offsets = array('Q', [0])
+    texts = bytearray()
+    for first_id in range(1, count + 1, batch_size):
+        question_ids = list(range(first_id, min(first_id + batch_size, count + 1)))
+        pipe = redis_db.pipeline(transaction=False)
+        pipe.hmget(questions_hash_name, question_ids)
+        pipe.hmget(answers_hash_name, question_ids)
+        questions, answers = pipe.execute()
+        for question, answer in zip(questions, answers):
+            if question is None or answer is None:
+                return None
+            for text in (question, answer):
+                texts += text
+                offsets.append(offsets[-1] + len(text))
+
+    buffer = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, int(generation), count) + offsets.tobytes() + bytes(texts)
+    return QuestionSnapshot(buffer)
+
+
+def load_snapshot_from_file(path, generation):
+    """Map snapshot file to memory if it has given generation.
+
+    :param path: str, path to snapshot
+    :param generation: str, generation of questions bank
+    :return: QuestionSnapshot or None if file doesn't exist or has other generation
+    """
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if len(buffer) < SNAPSHOT_HEADER.size:
+        buffer.close()
+        return None
+
+    magic, snapshot_generation, _ = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or str(snapshot_generation) != generation:
+        buffer.close()
+        logger.debug(f'File {path} is not snapshot of generation {generation}')
+        return None
+    return QuestionSnapshot(buffer)
+
+
+class QuestionCache:
+    """Local copy of questions bank, bots take texts of questions and answers without queries to Redis.
+
+    Generation is loaded from snapshot file which loader wrote or from Redis if file has other generation.
+    New generation is loaded in background thread, bank uses Redis until it is loaded.
+    Current and previous generations are kept, users can answer questions of previous generation.
+    If answer matcher is given, answers of generation are prepared for checking by the same loading
+    and generation is used only after it, so answers are never prepared while users wait.
+
+    :param redis_db: object of connection redis db
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param snapshot_path: str or None, path to snapshot file
+    :param batch_size: int, count of questions which are read from Redis by one pipeline
+    :param answer_matcher: answer matcher object or None, if answers are prepared at the first check
+    """
+
+    def __init__(self, redis_db, redis_hash_name, snapshot_path=None, batch_size=1000, answer_matcher=None):
+        self.redis_db = redis_db
+        self.redis_hash_name = redis_hash_name
+        self.snapshot_path = snapshot_path
+        self.batch_size = batch_size
+        self.answer_matcher = answer_matcher
+        # generation -> QuestionSnapshot, not more than 2 generations
+        self.snapshots = {}
+        # generation -> thread which loads it
+        self.loaders = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def load(self, generation):
+        """Load generation to cache.
+
+        :param generation: str, generation of questions bank
+        """
+        try:
+            snapshot = None
+            if self.snapshot_path:
+                snapshot = load_snapshot_from_file(self.snapshot_path, generation)
+            if snapshot is None:
+                snapshot = load_snapshot_from_redis(self.redis_db, self.redis_hash_name, generation, self.batch_size)
+            if snapshot is None:
+                self.logger.warning('Generation %s was not found', generation)
+                return
+
+            if self.answer_matcher is not None:
+                answer_index = AnswerIndex(self.answer_matcher)
+                answer_index.load_answers(snapshot.iter_answers())
+                self.answer_matcher.add_index(generation, answer_index)
+
+            with self.lock:
+                self.snapshots[generation] = snapshot
+                for old_generation in sorted(self.snapshots, key=int)[:-2]:
+                    del self.snapshots[old_generation]
+            self.logger.info('Generation %s was loaded to cache, %s questions', generation, snapshot.count)
+        except Exception:
+            self.logger.exception('Generation %s was not loaded to cache', generation)
+        finally:
+            with self.lock:
+                self.loaders.pop(generation, None)
+
+    def update(self, generation, wait=False):
+        """Start loading of generation if it is not in cache.
+
+        :param generation: str, generation of questions bank
+        :param wait: bool, wait end of loading
+        """
+        with self.lock:
+            if generation in self.snapshots:
+                return
+            loader = self.loaders.get(generation)
+            # thread of parent is not alive in forked worker
+            if loader is None or not loader.is_alive():
+                loader = threading.Thread(target=self.load, args=(generation,), name='QuestionCache', daemon=True)
+                self.loaders[generation] = loader
+                loader.start()
+        if wait:
+            loader.join()
+
+    def has(self, generation):
+        """Check that generation is loaded.
+
+        :param generation: str or int, generation of questions bank
+        :return: bool
+        """
+        return str(generation) in self.snapshots
+
+    def get_question(self, generation, question_id):
+        """Get question and answer.
+
+        :param generation: str or int, generation of questions bank
+        :param question_id: int, id of question
+        :return: tuple (question, answer) or None if generation is not loaded
+        """
+        snapshot = self.snapshots.get(str(generation))
+        if snapshot is None:
+            return None
+        return snapshot.get_question(question_id)
+
+    def get_answer(self, generation, question_id):
+        """Get answer by question id.
+
+        :param generation: str or int, generation of questions bank
+        :param question_id: int, id of question
+        :return: str or None if generation is not loaded
+        """
+        snapshot = self.snapshots.get(str(generation))
+        if snapshot is None:
+            return None
+        return snapshot.get_answer(question_id)
@@ -0,0 +1,238 @@
+import hashlib
+import logging
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# header of section like "Вопрос 12:" or "Ответ:", text can start on the same line
+SECTION_HEADER_RE = re.compile(r'^\s*([А-ЯЁа-яё]+)(?:\s+\d+)?\s*:\s*(.*)$')
+# sections of dump -> keys of record, other sections (Комментарий, Автор, ...) are skipped
+SECTION_FIELDS = {
+    'вопрос': 'q',
+    'ответ': 'a',
+    'источник': 'source',
+    'тема': 'category',
+}
+SKIPPED_SECTIONS = {'чемпионат', 'тур', 'дата', 'редактор', 'инфо', 'вид', 'зачет', 'зачёт', 'незачет', 'незачёт',
+                    'комментарий', 'комментарии', 'автор', 'авторы', 'копирайт', 'обработан', 'турнир', 'пакет'}
+# one-byte encodings of old dumps, any bytes can be decoded by them, so encoding is chosen by text
+CYRILLIC_ENCODINGS = ('cp1251', 'koi8-r')
+LOWERCASE_CYRILLIC_RE = re.compile('[а-яё]')
+NOT_ALNUM_RE = re.compile(r'[\W_]+')
+
+
+def normalize_text(lines):
+    """Join lines of section, dumps wrap long texts by line breaks.
+
+    :param lines: list of str
+    :return: str
+    """
+    return ' '.join(line.strip() for line in lines if line.strip())
+
+
+def get_content_hash(question):
+    """Get hash of question text, case, punctuation and spaces are ignored.
+
+    :param question: str, text of question
+    :return: bytes
+    """
+    content = NOT_ALNUM_RE.sub('', question.lower().replace('ё', 'е'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+def read_dump(path, encoding=None):
+    """Read text of dump, old dumps are in koi8-r or cp1251.
+
+    koi8-r and cp1251 have lowercase and uppercase letters on places of each other,
+    so text is decoded by encoding which gives more lowercase letters.
+
+    :param path: str, path to dump
+    :param encoding: str or None, encoding of dump, None - utf-8, koi8-r or cp1251 are detected
+    :return: str
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if encoding is not None:
+        return raw.decode(encoding, errors='replace')
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    texts = [raw.decode(encoding) for encoding in CYRILLIC_ENCODINGS]
+    return max(texts, key=lambda text: len(LOWERCASE_CYRILLIC_RE.findall(text)))
+
+
+def parse_dump(path, encoding=None):
+    """Parse dump with "Вопрос:/Ответ:" blocks.
+
+    Record is started by section "Вопрос" and is kept only if it has not empty question and answer.
+    Record with the same section twice (e.g. line "Ответ: ..." inside "Комментарий") is ambiguous, it is rejected.
+    Not empty file without questions is rejected too, so it isn't skipped silently.
+
+    :param path: str, path to dump
+    :param encoding: str or None, encoding of dump, see read_dump
+    :return: tuple, (list of tuples (content hash, record), list of tuples (path, line number, reason of rejecting))
+    """
+    records = []
+    rejected = []
+    record = None
+    record_line = 0
+    # (line number, reason) of the first error of record, record with error is rejected
+    record_error = None
+    field = None
+    lines = []
+
+    def flush_section():
+        if record is not None and field is not None:
+            record[field] = normalize_text(lines)
+
+    def flush_record():
+        if record is None:
+            return
+        if record_error is not None:
+            rejected.append((path, *record_error))
+        elif not record.get('q'):
+            rejected.append((path, record_line, 'empty question'))
+        elif not record.get('a'):
+            rejected.append((path, record_line, 'question without answer'))
+        else:
+            records.append((get_content_hash(record['q']), record))
+
+    text = read_dump(path, encoding)
+    for line_num, line in enumerate(text.splitlines(), start=1):
+        # most lines are text, regex is checked only for lines with colon
+        match = SECTION_HEADER_RE.match(line) if ':' in line else None
+        section = match.group(1).lower() if match else None
+        if section not in SECTION_FIELDS and section not in SKIPPED_SECTIONS:
+            # text of current section
+            lines.append(line)
+            continue
+
+        flush_section()
+        field = SECTION_FIELDS.get(section)
+        lines = [match.group(2)]
+
+        if field == 'q':
+            flush_record()
+            record = {}
+            record_line = line_num
+            record_error = None
+        elif record is None:
+            # sections of file header (Чемпионат, Дата, ...) are before first question
+            if field is not None:
+                rejected.append((path, line_num, f'section "{match.group(1)}" without question'))
+            field = None
+        elif field is not None and field in record:
+            if record_error is None:
+                record_error = (line_num, f'second section "{match.group(1)}" of question')
+            field = None
+
+    flush_section()
+    flush_record()
+    if not records and not rejected and text.strip():
+        rejected.append((path, 1, 'file without questions'))
+    return records, rejected
+
+
+def get_dump_paths(path):
+    """Get paths of dumps.
+
+    :param path: str, path to dump or to directory with dumps (*.txt)
+    :return: list of str
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.txt'))
+
+
+class ImportReport:
+    """Result of import: counts of imported and duplicated records and list of rejected records."""
+
+    def __init__(self):
+        self.parsed = 0
+        self.duplicates = 0
+        self.rejected = []
+
+    def reject(self, path, line_num, reason):
+        """Register malformed record.
+
+        :param path: str, path to file
+        :param line_num: int or str, number of line or key of record
+        :param reason: str, reason of rejecting
+        """
+        self.rejected.append((path, line_num, reason))
+
+    def log_summary(self):
+        """Write counts to log, reasons of rejecting are grouped."""
+        logger.info('%s records were parsed, %s duplicates were skipped, %s records were rejected',
+                    self.parsed, self.duplicates, len(self.rejected))
+        for reason, count in Counter(reason for _, _, reason in self.rejected).most_common():
+            logger.info('Rejected "%s": %s', reason, count)
+
+    def write(self, path):
+        """Write rejected records to file, one record per line "path:line: reason".
+
+        :param path: str, path to report
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            for dump_path, line_num, reason in self.rejected:
+                f.write(f'{dump_path}:{line_num}: {reason}\n')
+
+
+def iter_records_from_dumps(paths, report, processes=None, encoding=None):
+    """Parse dumps by pool of processes.
+
+    Records are yielded in order of files, so result doesn't depend on count of processes.
+
+    :param paths: list of str, paths to dumps
+    :param report: ImportReport object, rejected records are added to it
+    :param processes: int or None, count of processes, None - count of CPUs
+    :param encoding: str or None, encoding of all dumps, None - it is detected for every file
+    :return: generator of tuples (content hash, record)
+    """
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for records, rejected in executor.map(partial(parse_dump, encoding=encoding), paths, chunksize=8):
+            report.rejected.extend(rejected)
+            yield from records
+
+
+def iter_records_from_questions(questions, path, report):
+    """Validate records of JSON file.
+
+    :param questions: iterable of tuples (question_num, question_answer)
+    :param path: str, path to file, it is used in report
+    :param report: ImportReport object, rejected records are added to it
+    :return: generator of tuples (content hash, record)
+    """
+    for question_num, question_answer in questions:
+        question = question_answer.get('q') if isinstance(question_answer, dict) else None
+        answer = question_answer.get('a') if isinstance(question_answer, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            report.reject(path, question_num, 'empty question')
+        elif not isinstance(answer, str) or not answer.strip():
+            report.reject(path, question_num, 'question without answer')
+        else:
+            yield get_content_hash(question), question_answer
+
+
+def deduplicate_records(records, report):
+    """Skip records with the same question text, the first record is kept.
+
+    Only hashes of questions are kept in memory.
+
+    :param records: iterable of tuples (content hash, record)
+    :param report: ImportReport object, counts are written to it
+    :return: generator of tuples (question_num, question_answer) for redis_base_init.load_questions
+    """
+    seen_hashes = set()
+    for content_hash, record in records:
+        report.parsed += 1
+        if content_hash in seen_hashes:
+            report.duplicates += 1
+            continue
+        seen_hashes.add(content_hash)
+        yield len(seen_hashes), record
@@ -1,45 +1,227 @@
 import dotenv
-import redis
 
 import logging
 import os
 import json
+import time
+
+from connections import create_redis, wait_for_redis
+from metrics import QUESTIONS_LOADED, push_metrics
+from question_dumps import (ImportReport, deduplicate_records, get_dump_paths, iter_records_from_dumps,
+                            iter_records_from_questions)
+from question_bank import (create_generation, encode_text, get_generation_index_keys, get_generation_keys,
+                           get_question_filters, publish_generation)
+from question_cache import SnapshotWriter
 
 logger = logging.getLogger(__name__)
 
-if __name__ == '__main__':
-    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s', level=logging.DEBUG)
+JSON_WHITESPACE = ' \t\n\r'
+
+
+def iter_questions_from_json(path, chunk_size=64 * 1024):
+    """Parse questions file incrementally.
+
+    File should be one JSON object like {"1": {"q": "question", "a": "answer"}, ...},
+    records can have optional keys "category", "difficulty" and "source".
+    Only one record and one chunk of file are kept in memory, so file can be bigger than RAM.
+
+    :param path: str, path to file with questions and answers
+    :param chunk_size: int, count of chars which will read from file by one time
+    :return: generator of tuples (question_num, question_answer)
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def skip_whitespace():
+            nonlocal pos
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+
+        def read_more():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            # drop already parsed part of buffer
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        def next_char():
+            skip_whitespace()
+            while pos >= len(buffer):
+                if not read_more():
+                    raise ValueError(f'Unexpected end of file {path}')
+                skip_whitespace()
+            return buffer[pos]
+
+        def decode_value():
+            nonlocal pos
+            next_char()
+            while True:
+                try:
+                    value, pos = decoder.raw_decode(buffer, pos)
+                    return value
+                except json.JSONDecodeError:
+                    # value can be cut by the end of chunk
+                    if not read_more():
+                        raise
+
+        if next_char() != '{':
+            raise ValueError(f'File {path} must contain JSON object')
+        pos += 1
+
+        if next_char() == '}':
+            return
+
+        while True:
+            question_num = decode_value()
+            if next_char() != ':':
+                raise ValueError(f'Expected ":" after key {question_num} in {path}')
+            pos += 1
+            question_answer = decode_value()
+            yield question_num, question_answer
+
+            delimiter = next_char()
+            pos += 1
+            if delimiter == '}':
+                return
+            if delimiter != ',':
+                raise ValueError(f'Expected "," or "}}" after record {question_num} in {path}')
+
+
+def load_questions(redis_db, questions, redis_hash_name, generation, batch_size=1000, record_count=0,
+                   compress=False, snapshot_writer=None):
+    """Write questions to Redis by batches.
 
+    Every batch is one MULTI/EXEC pipeline, so DB is filled with one round trip per batch.
+    Questions get integer ids from 1, texts of questions and answers are stored only one time.
+    Metadata (category, difficulty, source) is stored as JSON, every filter by category and difficulty
+    gets index of positions -> ids, so bots choose question of filter by one query.
+
+    :param redis_db: redis database object
+    :param questions: iterable of tuples (question_num, question_answer)
+    :param redis_hash_name: name of hash in redis, prefix of all keys of questions bank
+    :param generation: str, generation of questions bank
+    :param batch_size: int, count of questions in one pipeline
+    :param record_count: int, max count of questions which will write, 0 - write all questions
+    :param compress: bool, compress texts of questions and answers
+    :param snapshot_writer: SnapshotWriter object or None, texts are written to snapshot file too
+    :return: int, count of written questions
+    """
+    questions_hash_name, answers_hash_name, count_key_name = get_generation_keys(redis_hash_name, generation)
+    meta_hash_name, index_counts_hash_name, index_prefix = get_generation_index_keys(redis_hash_name, generation)
+    filter_counts = {}
+    written = 0
+    started_at = time.monotonic()
+    pipe = redis_db.pipeline(transaction=True)
+
+    for _, question_answer in questions:
+        # all data can be very bigger for DB and maybe you don't want upload all data
+        if record_count and written == record_count:
+            break
+
+        written += 1
+        question = encode_text(question_answer['q'], compress)
+        answer = encode_text(question_answer['a'], compress)
+        pipe.hset(questions_hash_name, written, question)
+        pipe.hset(answers_hash_name, written, answer)
+        if snapshot_writer is not None:
+            snapshot_writer.add(question, answer)
+
+        meta = {field: question_answer[field] for field in ('category', 'difficulty', 'source')
+                if question_answer.get(field) is not None}
+        if meta:
+            pipe.hset(meta_hash_name, written, json.dumps(meta, ensure_ascii=False))
+        for question_filter in get_question_filters(question_answer):
+            filter_counts[question_filter] = filter_counts.get(question_filter, 0) + 1
+            pipe.hset(f'{index_prefix}:{question_filter}', filter_counts[question_filter], written)
+
+        if written % batch_size == 0:
+            pipe.execute()
+            QUESTIONS_LOADED.inc(batch_size)
+            elapsed = time.monotonic() - started_at
+            logger.debug(f'{written} questions were recorded in DB, {written / elapsed:.0f} questions/sec')
+
+    if filter_counts:
+        pipe.hmset(index_counts_hash_name, filter_counts)
+    pipe.set(count_key_name, written)
+    pipe.execute()
+    QUESTIONS_LOADED.inc(written % batch_size)
+    elapsed = time.monotonic() - started_at
+    logger.info(f'{written} questions were recorded in DB for {elapsed:.1f} sec, '
+                f'{written / elapsed if elapsed else written:.0f} questions/sec, {len(filter_counts)} filters')
+
+    return written
+
+
+if __name__ == '__main__':
     dotenv.load_dotenv()
+    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s',
+                        level=os.getenv('LOG_LEVEL', default='DEBUG').upper())
+
     redis_db_address = os.getenv('REDIS_DB_ADDRESS')
     redis_db_port = os.getenv('REDIS_DB_PORT')
     redis_db_password = os.getenv('REDIS_DB_PASSWORD')
+    redis_max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', default=50))
+    redis_socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', default=5))
+    redis_health_check_interval = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', default=30))
+    reconnect_max_delay = float(os.getenv('RECONNECT_MAX_DELAY', default=30))
     questions_db_path = os.getenv('QUESTIONS_DB_PATH', default='data/questions.json')
-    db_record_count = os.getenv('DB_RECORD_COUNT', default=100)
-    redis_set_of_questions_name = os.getenv('REDIS_SET_OF_QUESTIONS_NAME', default='QuestionAnswerSet')
+    db_record_count = int(os.getenv('DB_RECORD_COUNT', default=0))
+    import_processes = int(os.getenv('IMPORT_PROCESSES', default=0)) or None
+    import_report_path = os.getenv('IMPORT_REPORT_PATH')
+    dump_encoding = os.getenv('DUMP_ENCODING')
+    redis_batch_size = int(os.getenv('REDIS_BATCH_SIZE', default=1000))
     redis_hash_of_questions_and_answers_name = os.getenv('REDIS_HASH_OF_QUESTIONS_AND_ANSWERS_NAME',
                                                          default='QuestionAnswerHash')
+    redis_generation_key_name = os.getenv('REDIS_QUESTIONS_GENERATION_KEY_NAME', default='QuestionBankGeneration')
+    old_generation_ttl = int(os.getenv('OLD_GENERATION_TTL', default=60))
+    compress_questions = os.getenv('COMPRESS_QUESTIONS', default='false').lower() in ('1', 'true', 'yes')
+    prometheus_pushgateway = os.getenv('PROMETHEUS_PUSHGATEWAY')
+    questions_snapshot_path = os.getenv('QUESTIONS_SNAPSHOT_PATH')
 
     logger.debug('.env was read')
 
-    with open(db_path, encoding='utf-8') as f:
-        data = json.load(f)
-    logger.debug(f'data was read. Length: {len(data)}')
+    redis_db = create_redis(redis_db_address, redis_db_port, redis_db_password, max_connections=redis_max_connections,
+                            socket_timeout=redis_socket_timeout, health_check_interval=redis_health_check_interval,
+                            backoff_max_delay=reconnect_max_delay)
+    wait_for_redis(redis_db)
 
-    redis_db = redis.Redis(host=redis_db_address, port=redis_db_port, password=redis_db_password)
+    # new bank is written under new keys, bots use old bank until pointer will be switched
+    generation = create_generation(redis_db, redis_generation_key_name)
+    logger.debug(f'Generation {generation} was created')
 
-    for questions_answer_num, question_data in enumerate(data.items()):
-        # all data can be very bigger for DB and maybe you don't want upload all data
-        if questions_answer_num == db_record_count:
-            break
+    # JSON file or dumps with "Вопрос:/Ответ:" blocks (one file or directory of *.txt files)
+    report = ImportReport()
+    if questions_db_path.endswith('.json'):
+        records = iter_records_from_questions(iter_questions_from_json(questions_db_path), questions_db_path, report)
+    else:
+        records = iter_records_from_dumps(get_dump_paths(questions_db_path), report, processes=import_processes,
+                                          encoding=dump_encoding)
+    questions = deduplicate_records(records, report)
+    # bots on this host read texts from snapshot instead of Redis
+    snapshot_writer = SnapshotWriter(questions_snapshot_path, generation) if questions_snapshot_path else None
+    load_questions(redis_db, questions, redis_hash_of_questions_and_answers_name, generation,
+                   batch_size=redis_batch_size, record_count=db_record_count, compress=compress_questions,
+                   snapshot_writer=snapshot_writer)
+    if snapshot_writer is not None:
+        snapshot_writer.close()
+    publish_generation(redis_db, redis_generation_key_name, generation, redis_hash_of_questions_and_answers_name,
+                       old_generation_ttl=old_generation_ttl)
 
-        question_num, question_answer = question_data
-        question = str(question_answer['q']).encode('utf-8')
-        answer = str(question_answer['a']).encode('utf-8')
-
-        redis_db.hset(redis_hash_of_questions_and_answers_name, question, answer)
-        redis_db.sadd(redis_set_of_questions_name, question)
-        logger.debug(f'Question {question_num} was record in DB')
+    report.log_summary()
+    if import_report_path:
+        report.write(import_report_path)
+        logger.info(f'Report of import was written to {import_report_path}')
 
     logger.debug(f'db size {redis_db.dbsize()}')
     redis_db.close()
+
+    # loader works shortly, so metrics are pushed instead of scraping
+    push_metrics(prometheus_pushgateway, 'quiz_bot_loader')
@@ -0,0 +1,308 @@
+import dotenv
+
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import tg_bot
+import vk_bot
+from benchmark import FakeRedis, FakeTgBot, FakeVkApi, get_percentile, iter_synthetic_questions
+from common_functions import get_answer_matcher
+from event_capture import iter_captured_events
+from group_games import GroupGame, ReplyCoalescer
+from question_bank import QuestionBank, create_generation, publish_generation
+from redis_base_init import load_questions
+from scores import ScoreBoard
+from telegram import Update
+from telegram.ext import Dispatcher
+from tg_persistence import RedisPersistence
+from vk_dispatcher import create_dispatching_api
+from vk_idempotency import EventDeduplicator
+from webhooks import VkCallbackEvent
+
+logger = logging.getLogger(__name__)
+
+# texts of buttons and commands -> name of handler in reports
+HANDLER_NAMES = {
+    'Новый вопрос': 'new_question',
+    'Сдаться': 'give_up',
+    'Мой счёт': 'score',
+    '/start': 'start',
+    'Начать': 'start',
+    '/stop': 'stop',
+    'темы': 'filter',
+    'тема': 'filter',
+    'сложность': 'filter',
+}
+
+
+def get_handler_name(platform, text, is_group):
+    """Get name of handler which handles message, it is used to group latencies and profiles.
+
+    :param platform: str, 'vk' or 'tg'
+    :param text: str, text of message
+    :param is_group: bool, message is from group chat
+    :return: str
+    """
+    if is_group:
+        return f'{platform}_group'
+    text = (text or '').split('@', 1)[0]
+    name = HANDLER_NAMES.get(text) or HANDLER_NAMES.get(text.strip().partition(' ')[0].lower(), 'answer')
+    return f'{platform}_{name}'
+
+
+class CProfileProfiler:
+    """Deterministic profiler, every handler has own cProfile.Profile.
+
+    Profiles are written to '<dir>/<handler>.pstats', they can be viewed by pstats, snakeviz or
+    converted to flame graph by flameprof.
+    """
+
+    def __init__(self):
+        self.profiles = {}
+
+    @contextmanager
+    def profile(self, name):
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def dump(self, profile_dir):
+        """Write profiles of handlers.
+
+        :param profile_dir: str, directory for profiles
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        for name, profile in self.profiles.items():
+            path = os.path.join(profile_dir, f'{name}.pstats')
+            profile.dump_stats(path)
+            logger.info(f'Profile of {name} was written to {path}')
+
+
+class SamplingProfiler:
+    """Statistical profiler, stack of replaying thread is sampled by background thread every :interval:.
+
+    Overhead doesn't depend on count of calls, so latencies are close to real ones.
+    Samples are written to '<dir>/<handler>.folded' in folded format ("frame;frame;frame count"),
+    which is read by flamegraph.pl, speedscope and inferno.
+
+    :param interval: float, seconds between samples
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.current_name = None
+        # handler -> Counter of folded stacks
+        self.samples = defaultdict(Counter)
+        # sampler waits GIL not longer than switch interval (5 ms by default)
+        sys.setswitchinterval(min(sys.getswitchinterval(), interval))
+        self.sampler = threading.Thread(target=self.run, name='SamplingProfiler', daemon=True)
+        self.sampler.start()
+
+    @contextmanager
+    def profile(self, name):
+        self.current_name = name
+        try:
+            yield
+        finally:
+            self.current_name = None
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            name = self.current_name
+            frame = sys._current_frames().get(self.thread_id)
+            if name is None or frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.samples[name][';'.join(reversed(stack))] += 1
+
+    def dump(self, profile_dir):
+        """Write samples of handlers.
+
+        :param profile_dir: str, directory for profiles
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        for name, stacks in list(self.samples.items()):
+            path = os.path.join(profile_dir, f'{name}.folded')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            logger.info(f'{sum(stacks.values())} samples of {name} were written to {path}')
+
+
+class NoProfiler:
+    @contextmanager
+    def profile(self, name):
+        yield
+
+    def dump(self, profile_dir):
+        pass
+
+
+def create_profiler(name, sampling_interval=0.001):
+    """Create profiler by name.
+
+    :param name: str, '' - without profiling, 'cprofile' or 'sampling'
+    :param sampling_interval: float, seconds between samples of sampling profiler
+    :return: profiler object
+    """
+    if not name:
+        return NoProfiler()
+    if name == 'cprofile':
+        return CProfileProfiler()
+    if name == 'sampling':
+        return SamplingProfiler(sampling_interval)
+    raise ValueError(f'Unknown profiler "{name}", use "cprofile" or "sampling"')
+
+
+class Replayer:
+    """Stand-ins of bots which handle captured events by the same logic as real bots.
+
+    Redis, VK API and telegram bot are local fakes from benchmark, questions bank is synthetic,
+    so answers of users are incorrect, but handlers go the same way as in production:
+    telegram updates go through dispatcher with persistence, VK messages are sent by dispatcher of messages.
+
+    :param redis_db: FakeRedis object
+    :param question_bank: QuestionBank object
+    :param replies_interval: float, min seconds between replies to one group chat
+    :param vk_api_rate: float, max count of requests to fake VK API per second
+    """
+
+    def __init__(self, redis_db, question_bank, replies_interval=0.05, vk_api_rate=1000):
+        answer_matcher = get_answer_matcher('words', limit=0.5)
+        score_board = ScoreBoard(redis_db)
+        group_game = GroupGame(redis_db, question_bank)
+        group_replies = ReplyCoalescer(interval=replies_interval)
+
+        self.fake_vk_api = FakeVkApi()
+        self.vk_api, self.vk_dispatcher = create_dispatching_api(self.fake_vk_api, rate=vk_api_rate)
+        self.vk_kwargs = {
+            'users_db': vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank),
+            'answer_matcher': answer_matcher,
+            'score_board': score_board,
+            'deduplicator': EventDeduplicator(redis_db),
+            'group_game': group_game,
+            'group_replies': group_replies,
+        }
+
+        self.tg_bot = FakeTgBot()
+        self.dispatcher = Dispatcher(self.tg_bot, None, workers=0, persistence=RedisPersistence(redis_db))
+        for handler in tg_bot.create_handlers(question_bank, answer_matcher, score_board, persistent=True,
+                                              group_game=group_game, group_replies=group_replies):
+            self.dispatcher.add_handler(handler)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def prepare(self, platform, payload):
+        """Restore event from captured payload.
+
+        :param platform: str, 'vk' or 'tg'
+        :param payload: dict, see event_capture.serialize_event
+        :return: tuple, (name of handler, function() which handles event) or None if event can't be replayed
+        """
+        if platform == 'vk':
+            event = VkCallbackEvent({'id': payload['message_id'], 'from_id': payload['user_id'],
+                                     'peer_id': payload['peer_id'], 'text': payload['text']})
+            name = get_handler_name('vk', event.text, event.peer_id > vk_bot.CHAT_PEER_ID_START)
+            return name, lambda: vk_bot.handle_event(event, self.vk_api, **self.vk_kwargs)
+
+        if platform == 'tg':
+            update = Update.de_json(payload, self.tg_bot)
+            if update.message is None or update.message.text is None:
+                return None
+            name = get_handler_name('tg', update.message.text, update.message.chat.type != 'private')
+            return name, lambda: self.dispatcher.process_update(update)
+        return None
+
+
+def replay(path, replayer, profiler, speed=1):
+    """Feed captured events to handlers with original pauses divided by :speed:.
+
+    :param path: str, path to capture file
+    :param replayer: Replayer object
+    :param profiler: profiler object, see create_profiler
+    :param speed: float, speed of replay, 0 - without pauses
+    :return: dict, name of handler -> list of latencies in seconds
+    """
+    latencies = defaultdict(list)
+    first_event_time = None
+    started_at = time.perf_counter()
+
+    for event_time, platform, payload in iter_captured_events(path):
+        prepared = replayer.prepare(platform, payload)
+        if prepared is None:
+            continue
+        name, handle = prepared
+
+        if first_event_time is None:
+            first_event_time = event_time
+        if speed > 0:
+            delay = (event_time - first_event_time) / speed - (time.perf_counter() - started_at)
+            if delay > 0:
+                time.sleep(delay)
+
+        event_started_at = time.perf_counter()
+        try:
+            with profiler.profile(name):
+                handle()
+        except Exception:
+            logger.exception(f'Event of {name} was not handled')
+        latencies[name].append(time.perf_counter() - event_started_at)
+    return latencies
+
+
+def log_latencies(latencies):
+    """Write counts and latencies of handlers to log, the slowest handlers are the first.
+
+    :param latencies: dict, name of handler -> list of latencies in seconds
+    """
+    for name, values in sorted(latencies.items(), key=lambda item: sum(item[1]), reverse=True):
+        values.sort()
+        logger.info(f'{name}: {len(values)} events, total {sum(values) * 1000:.1f} ms, '
+                    f'p50 {get_percentile(values, 50) * 1000:.3f} ms, p99 {get_percentile(values, 99) * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s', level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    dotenv.load_dotenv()
+    replay_path = os.getenv('REPLAY_PATH') or os.getenv('EVENTS_CAPTURE_PATH')
+    replay_speed = float(os.getenv('REPLAY_SPEED', default=1))
+    replay_questions = int(os.getenv('REPLAY_QUESTIONS', default=10000))
+    replay_profiler = os.getenv('REPLAY_PROFILER', default='').lower()
+    replay_profile_dir = os.getenv('REPLAY_PROFILE_DIR', default='profiles')
+    replay_sampling_interval = float(os.getenv('REPLAY_SAMPLING_INTERVAL', default=0.001))
+    if not replay_path:
+        raise SystemExit('Set REPLAY_PATH, path to file of captured events')
+
+    redis_db = FakeRedis()
+    generation = create_generation(redis_db, 'QuestionBankGeneration')
+    load_questions(redis_db, iter_synthetic_questions(replay_questions), 'QuestionAnswerHash', generation)
+    publish_generation(redis_db, 'QuestionBankGeneration', generation, 'QuestionAnswerHash')
+    question_bank = QuestionBank(redis_db, 'QuestionAnswerHash')
+    question_bank.preload()
+
+    replayer = Replayer(redis_db, question_bank)
+    profiler = create_profiler(replay_profiler, replay_sampling_interval)
+    started_at = time.perf_counter()
+    latencies = replay(replay_path, replayer, profiler, replay_speed)
+    replayer.vk_dispatcher.join()
+    logger.info(f'{sum(map(len, latencies.values()))} events were replayed for {time.perf_counter() - started_at:.2f} '
+                f'sec, {replayer.fake_vk_api.sent + replayer.tg_bot.sent} messages were sent')
+    log_latencies(latencies)
+    profiler.dump(replay_profile_dir)
@@ -0,0 +1,128 @@
+import json
+import logging
+import threading
+import time
+
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] - sorted set of timers (score - deadline), KEYS[2] - hash of payloads of timers
+# ARGV[1] - current time, ARGV[2] - max count of timers
+# Due timers are removed and returned by one call, so every timer is fired only by one worker
+POP_DUE_JOBS_SCRIPT = """
+local jobs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #jobs == 0 then
+    return {}
+end
+redis.call('ZREM', KEYS[1], unpack(jobs))
+local payloads = redis.call('HMGET', KEYS[2], unpack(jobs))
+redis.call('HDEL', KEYS[2], unpack(jobs))
+local result = {}
+for job_num, job in ipairs(jobs) do
+    result[#result + 1] = job
+    result[#result + 1] = payloads[job_num]
+end
+return result
+"""
+
+
+class RoundTimerQueue:
+    """Delayed jobs in Redis sorted set, score of job is its deadline.
+
+    One user has not more than one timer: timer is identified by member of user (see scores.get_member)
+    and new timer replaces old one. Timer and answer of user race by removing of timer from sorted set,
+    so only one of them wins.
+
+    :param redis_db: object of connection redis db
+    :param name: str, name of sorted set in redis, payloads are kept in hash '<name>:jobs'
+    :param round_time: float, seconds which user has for answer
+    """
+
+    def __init__(self, redis_db, name, round_time=30):
+        self.redis_db = redis_db
+        self.name = name
+        self.jobs_hash_name = f'{name}:jobs'
+        self.round_time = round_time
+        self.pop_due_jobs_script = redis_db.register_script(POP_DUE_JOBS_SCRIPT)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def schedule(self, member, payload):
+        """Start timer of user by one transaction.
+
+        :param member: str, member of user
+        :param payload: dict which can be dumped to JSON, data for handler of timer
+        :return: float, deadline of answer (unix time), keep it in state of user to know that timer was started
+        """
+        deadline = time.time() + self.round_time
+        pipe = self.redis_db.pipeline(transaction=True)
+        pipe.hset(self.jobs_hash_name, member, json.dumps(payload, ensure_ascii=False))
+        pipe.zadd(self.name, {member: deadline})
+        pipe.execute()
+        return deadline
+
+    def cancel(self, member):
+        """Stop timer of user.
+
+        :param member: str, member of user
+        :return: bool, True if timer was stopped, False if it was already fired or didn't exist
+        """
+        pipe = self.redis_db.pipeline(transaction=True)
+        pipe.zrem(self.name, member)
+        pipe.hdel(self.jobs_hash_name, member)
+        removed, _ = pipe.execute()
+        return bool(removed)
+
+    def pop_due(self, count=100):
+        """Remove and get timers which deadline passed.
+
+        :param count: int, max count of timers
+        :return: list of tuples (member, payload)
+        """
+        result = self.pop_due_jobs_script(keys=[self.name, self.jobs_hash_name], args=[time.time(), count])
+        jobs = []
+        for member, payload in zip(result[::2], result[1::2]):
+            if payload is not None:
+                jobs.append((member.decode('utf-8'), json.loads(payload)))
+        return jobs
+
+
+class RoundTimerWorker:
+    """Background thread which fires timers of queue.
+
+    Timers are popped by batches, thread sleeps only if there are no due timers,
+    so any count of timers is handled by one thread.
+
+    :param timer_queue: RoundTimerQueue object
+    :param handler: function(member, payload), handler of fired timer
+    :param batch_size: int, max count of timers which are popped by one query
+    :param poll_interval: float, seconds between checks of queue if there are no due timers
+    """
+
+    def __init__(self, timer_queue, handler, batch_size=100, poll_interval=0.5):
+        self.timer_queue = timer_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(self.__class__.__name__)
+        threading.Thread(target=self.run, name='RoundTimerWorker', daemon=True).start()
+        self.logger.debug('Class params were initialized')
+
+    def run(self):
+        while True:
+            try:
+                jobs = self.timer_queue.pop_due(self.batch_size)
+            except Exception:
+                self.logger.exception('Timers were not popped')
+                jobs = []
+
+            for member, payload in jobs:
+                try:
+                    self.handler(member, payload)
+                except Exception:
+                    ERRORS.labels('round_timer').inc()
+                    self.logger.exception('Error in handling of timer, member=%s', member)
+
+            if len(jobs) < self.batch_size:
+                time.sleep(self.poll_interval)
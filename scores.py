@@ -0,0 +1,146 @@
+import datetime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PERIOD_NAMES = {
+    'global': 'Всего',
+    'day': 'За сегодня',
+    'week': 'За неделю',
+}
+PLATFORM_NAMES = {
+    'vk': 'VK',
+    'tg': 'Telegram',
+}
+
+
+def get_member(platform, user_id):
+    """Get name of user in leaderboards, users of VK and telegram are in the same leaderboards.
+
+    :param platform: str, 'vk' or 'tg'
+    :param user_id: id of user
+    :return: str, name of member of sorted sets
+    """
+    return f'{platform}:{user_id}'
+
+
+def format_member(member):
+    """Get readable name of member.
+
+    :param member: str, name of member of sorted sets
+    :return: str
+    """
+    platform, user_id = member.split(':', 1)
+    return f'{PLATFORM_NAMES.get(platform, platform)} id{user_id}'
+
+
+class ScoreBoard:
+    """Scores of users in Redis sorted sets: global, daily and weekly.
+
+    Daily and weekly sets are expired automatically. Top of users is cached for :top_cache_ttl: seconds.
+
+    :param redis_db: object of connection redis db
+    :param prefix: str, prefix of names of sorted sets in redis
+    :param top_cache_ttl: float, seconds while top of users is cached
+    """
+
+    def __init__(self, redis_db, prefix='Scores', top_cache_ttl=5):
+        self.redis_db = redis_db
+        self.prefix = prefix
+        self.top_cache_ttl = top_cache_ttl
+        self.top_cache = {}
+        self.top_cache_lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug('Class params were initialized')
+
+    def get_keys(self, now=None):
+        """Get names of sorted sets for current day and week.
+
+        :param now: datetime or None, current UTC time
+        :return: dict, period -> (name of sorted set, TTL in seconds or None)
+        """
+        now = now or datetime.datetime.utcnow()
+        year, week, _ = now.isocalendar()
+        return {
+            'global': (f'{self.prefix}:global', None),
+            'day': (f'{self.prefix}:day:{now:%Y%m%d}', 8 * 24 * 3600),
+            'week': (f'{self.prefix}:week:{year}-{week:02d}', 5 * 7 * 24 * 3600),
+        }
+
+    def add_points(self, member, points=1):
+        """Add points to user in all leaderboards by one transaction.
+
+        :param member: str, see get_member
+        :param points: int, count of points
+        :return: int, new global score
+        """
+        pipe = self.redis_db.pipeline(transaction=True)
+        for key, ttl in self.get_keys().values():
+            pipe.zincrby(key, points, member)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+        global_score = pipe.execute()[0]
+        self.logger.debug('Score was updated, member=%s', member)
+        return int(global_score)
+
+    def get_scores(self, member):
+        """Get scores and places of user in all leaderboards by one query.
+
+        :param member: str, see get_member
+        :return: dict, period -> (score, place or None if user has no points)
+        """
+        keys = self.get_keys()
+        pipe = self.redis_db.pipeline(transaction=False)
+        for key, _ in keys.values():
+            pipe.zscore(key, member)
+            pipe.zrevrank(key, member)
+        results = pipe.execute()
+
+        scores = {}
+        for period_num, period in enumerate(keys):
+            score, rank = results[period_num * 2], results[period_num * 2 + 1]
+            scores[period] = (int(score or 0), None if rank is None else rank + 1)
+        return scores
+
+    def get_top(self, period='global', count=10):
+        """Get top of users.
+
+        :param period: str, 'global', 'day' or 'week'
+        :param count: int, count of users
+        :return: list of tuples (member, score)
+        """
+        key, _ = self.get_keys()[period]
+        now = time.monotonic()
+        with self.top_cache_lock:
+            cached = self.top_cache.get((key, count))
+            if cached is not None and cached[1] > now:
+                return cached[0]
+
+        top = [(member.decode('utf-8'), int(score))
+               for member, score in self.redis_db.zrevrange(key, 0, count - 1, withscores=True)]
+        with self.top_cache_lock:
+            self.top_cache = {cache_key: cached for cache_key, cached in self.top_cache.items() if cached[1] > now}
+            self.top_cache[(key, count)] = (top, now + self.top_cache_ttl)
+        return top
+
+    def get_score_message(self, member, top_count=10):
+        """Get text of message with scores of user and top of users.
+
+        :param member: str, see get_member
+        :param top_count: int, count of users in top
+        :return: str
+        """
+        lines = []
+        for period, (score, place) in self.get_scores(member).items():
+            place_text = f', место {place}' if place is not None else ''
+            lines.append(f'{PERIOD_NAMES[period]}: {score}{place_text}')
+
+        top = self.get_top('week', top_count)
+        if top:
+            lines.append('\nЛучшие игроки недели:')
+            for place, (top_member, score) in enumerate(top, 1):
+                lines.append(f'{place}. {format_member(top_member)} - {score}')
+
+        return '\n'.join(lines)
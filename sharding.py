@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import zlib
+
+from metrics import ERRORS, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard(key, shards):
+    """Get number of worker for key.
+
+    crc32 is used instead of hash(), because hash() of str is different in every process.
+
+    :param key: int or str, key of task, e.g. user id
+    :param shards: int, count of workers
+    :return: int, number of worker from 0
+    """
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+
+def run_worker(shard, tasks, init_worker, metrics_port=0):
+    """Handle tasks of queue until None is got.
+
+    :param shard: int, number of worker
+    :param tasks: queue of tasks
+    :param init_worker: function(shard) -> function(task), creates handler of tasks in worker process
+    :param metrics_port: int, port of metrics server of worker, 0 - don't start it
+    """
+    start_metrics_server(metrics_port)
+    handle_task = init_worker(shard)
+    logger.info('Worker %s was started', shard)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            logger.info('Worker %s was stopped', shard)
+            return
+        try:
+            handle_task(task)
+        except Exception:
+            # error of one task doesn't stop worker
+            ERRORS.labels('worker').inc()
+            logger.exception('Error in handling of task by worker %s', shard)
+
+
+class ShardedWorkers:
+    """Pool of worker processes, every worker has its own queue.
+
+    Tasks with the same key are always put to one worker, so they are handled in order of putting
+    and local caches of worker (e.g. users info) are consistent. Other tasks are handled on other cores.
+
+    Workers are forked, so objects of parent (Redis pool, question bank, handlers) are inherited
+    without pickling. Create workers before start of threads in parent, threads are not copied by fork.
+    Tasks are pickled, so they should be simple objects.
+
+    :param init_worker: function(shard) -> function(task), creates handler of tasks in worker process
+    :param workers: int, count of worker processes
+    :param queue_size: int, max count of tasks in queue of one worker, putting waits if queue is full
+    :param metrics_port: int, port of metrics server of parent, worker N serves metrics on port + N + 1,
+                         0 - workers don't start metrics servers
+    """
+
+    def __init__(self, init_worker, workers=2, queue_size=1000, metrics_port=0):
+        self.context = multiprocessing.get_context('fork')
+        self.init_worker = init_worker
+        self.metrics_port = metrics_port
+        self.queues = [self.context.Queue(queue_size) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        for shard in range(workers):
+            self.start_worker(shard)
+        self.logger.debug('Class params were initialized')
+
+    def start_worker(self, shard):
+        """Start process of worker.
+
+        :param shard: int, number of worker
+        """
+        metrics_port = self.metrics_port + shard + 1 if self.metrics_port else 0
+        process = self.context.Process(target=run_worker, name=f'Worker-{shard}',
+                                       args=(shard, self.queues[shard], self.init_worker, metrics_port), daemon=True)
+        process.start()
+        self.processes[shard] = process
+
+    def put(self, key, task):
+        """Put task to worker of key, worker is restarted if it died.
+
+        :param key: int or str, key of task, e.g. user id
+        :param task: object which can be pickled
+        """
+        shard = get_shard(key, len(self.queues))
+        process = self.processes[shard]
+        if not process.is_alive():
+            # tasks in queue are kept, only task which was being handled is lost
+            ERRORS.labels('worker').inc()
+            self.logger.error('Worker %s died with exit code %s, restart it', shard, process.exitcode)
+            self.start_worker(shard)
+        self.queues[shard].put(task)
+
+    def stop(self):
+        """Stop workers after handling of tasks which were put."""
+        for tasks in self.queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join()
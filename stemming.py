@@ -0,0 +1,161 @@
+import re
+from functools import lru_cache
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND_AFTER_A = ('вшись', 'вши', 'в')
+PERFECTIVE_GERUND = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+             'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE_AFTER_A = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_AFTER_A = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+VERB = ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены', 'ить',
+        'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю')
+NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий', 'ям',
+        'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+NOT_WORD_CHARS = re.compile(r'[^\w]+')
+
+
+def fold_text(text):
+    """Lowercase text, replace 'ё' with 'е' and punctuation with spaces.
+
+    :param text: str, any text
+    :return: str, folded text
+    """
+    return NOT_WORD_CHARS.sub(' ', text.lower().replace('ё', 'е')).replace('_', ' ')
+
+
+def get_regions(word):
+    """Get start positions of RV and R2 regions of word.
+
+    :param word: str, word in lower case
+    :return: tuple, (start of RV, start of R2)
+    """
+    rv = len(word)
+    for pos, char in enumerate(word):
+        if char in VOWELS:
+            rv = pos + 1
+            break
+
+    def next_region(start):
+        for pos in range(start + 1, len(word)):
+            if word[pos] not in VOWELS and word[pos - 1] in VOWELS:
+                return pos + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def remove_ending(word, start, endings, endings_after_a=()):
+    """Remove the longest ending which is placed after :start: position.
+
+    :param word: str, word
+    :param start: int, start of region where ending can be found
+    :param endings: tuple of endings
+    :param endings_after_a: tuple of endings which should follow 'а' or 'я'
+    :return: str or None, word without ending or None if ending wasn't found
+    """
+    region = word[start:]
+    best = None
+    for ending in endings_after_a:
+        if region.endswith(ending) and region[:-len(ending)][-1:] in ('а', 'я'):
+            best = ending
+            break
+    for ending in endings:
+        if region.endswith(ending) and (best is None or len(ending) > len(best)):
+            best = ending
+            break
+
+    if best is None:
+        return None
+    return word[:-len(best)]
+
+
+@lru_cache(maxsize=100000)
+def stem_word(word):
+    """Get stem of russian word by Snowball algorithm.
+
+    :param word: str, word in lower case with 'е' instead of 'ё'
+    :return: str, stem
+    """
+    rv, r2 = get_regions(word)
+    if rv >= len(word):
+        return word
+
+    # step 1
+    stemmed = remove_ending(word, rv, PERFECTIVE_GERUND, PERFECTIVE_GERUND_AFTER_A)
+    if stemmed is None:
+        word = remove_ending(word, rv, REFLEXIVE) or word
+        stemmed = remove_ending(word, rv, ADJECTIVE)
+        if stemmed is not None:
+            stemmed = remove_ending(stemmed, rv, PARTICIPLE, PARTICIPLE_AFTER_A) or stemmed
+        else:
+            stemmed = remove_ending(word, rv, VERB, VERB_AFTER_A)
+            if stemmed is None:
+                stemmed = remove_ending(word, rv, NOUN)
+    word = stemmed if stemmed is not None else word
+
+    # step 2
+    if word[rv:].endswith('и'):
+        word = word[:-1]
+
+    # step 3
+    word = remove_ending(word, r2, DERIVATIONAL) or word
+
+    # step 4
+    if word[rv:].endswith('нн'):
+        return word[:-1]
+    without_superlative = remove_ending(word, rv, SUPERLATIVE)
+    if without_superlative is not None:
+        word = without_superlative
+        if word[rv:].endswith('нн'):
+            word = word[:-1]
+        return word
+    if word[rv:].endswith('ь'):
+        word = word[:-1]
+    return word
+
+
+def get_ngrams(word, n=3):
+    """Get set of character n-grams of word (word is padded by spaces).
+
+    :param word: str, word
+    :param n: int, length of n-gram
+    :return: frozenset of n-grams
+    """
+    padded_word = f' {word} '
+    return frozenset(padded_word[pos:pos + n] for pos in range(max(len(padded_word) - n + 1, 1)))
+
+
+def get_edit_distance(first_word, second_word, max_distance):
+    """Get Levenshtein distance between words, calculation stops when distance is bigger than :max_distance:.
+
+    :param first_word: str, word
+    :param second_word: str, word
+    :param max_distance: int, max interesting distance
+    :return: int, distance or max_distance + 1 if distance is bigger
+    """
+    if abs(len(first_word) - len(second_word)) > max_distance:
+        return max_distance + 1
+
+    previous_row = list(range(len(second_word) + 1))
+    for first_pos, first_char in enumerate(first_word, 1):
+        current_row = [first_pos]
+        for second_pos, second_char in enumerate(second_word, 1):
+            current_row.append(min(
+                previous_row[second_pos] + 1,
+                current_row[second_pos - 1] + 1,
+                previous_row[second_pos - 1] + (first_char != second_char),
+            ))
+        if min(current_row) > max_distance:
+            return max_distance + 1
+        previous_row = current_row
+
+    return min(previous_row[-1], max_distance + 1)
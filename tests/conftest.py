@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+from functools import partial
+
+import pytest
+from telegram import Update
+from telegram.ext import Dispatcher
+
+# modules of bots are in the root of repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tg_bot  # noqa: E402
+import vk_bot  # noqa: E402
+from benchmark import FakeRedis, FakeTgBot, create_tg_update_data, iter_synthetic_questions  # noqa: E402
+from common_functions import get_answer_matcher  # noqa: E402
+from group_games import GroupGame, ReplyCoalescer  # noqa: E402
+from question_bank import QuestionBank, create_generation, publish_generation  # noqa: E402
+from redis_base_init import load_questions  # noqa: E402
+from scores import ScoreBoard  # noqa: E402
+from vk_idempotency import EventDeduplicator  # noqa: E402
+
+
+@pytest.fixture
+def redis_db():
+    """FakeRedis with bank of 100 synthetic questions, question N has text 'Вопрос №N'."""
+    redis_db = FakeRedis()
+    generation = create_generation(redis_db, 'QuestionBankGeneration')
+    load_questions(redis_db, iter_synthetic_questions(100), 'QuestionAnswerHash', generation)
+    publish_generation(redis_db, 'QuestionBankGeneration', generation, 'QuestionAnswerHash')
+    return redis_db
+
+
+@pytest.fixture
+def question_bank(redis_db):
+    question_bank = QuestionBank(redis_db, 'QuestionAnswerHash')
+    question_bank.preload()
+    return question_bank
+
+
+@pytest.fixture
+def answers():
+    """Answers of synthetic questions by id."""
+    return {int(question_num): question_answer['a'] for question_num, question_answer in iter_synthetic_questions(100)}
+
+
+@pytest.fixture
+def make_tg_update():
+    """Factory of dicts of telegram updates with text messages, update ids are increased."""
+    update_ids = iter(range(1, 1000000))
+
+    def make_tg_update(text, user_id=1, chat_id=None):
+        return create_tg_update_data(next(update_ids), user_id, text, chat_id)
+
+    return make_tg_update
+
+
+@pytest.fixture
+def vk_event_handler(redis_db, question_bank):
+    """Handler of events with the same objects as main of vk_bot creates, function(event, vk_api)."""
+    return partial(vk_bot.handle_event, users_db=vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank),
+                   answer_matcher=get_answer_matcher('words', limit=0.5), score_board=ScoreBoard(redis_db),
+                   deduplicator=EventDeduplicator(redis_db), group_game=GroupGame(redis_db, question_bank),
+                   group_replies=ReplyCoalescer(interval=0.01))
+
+
+@pytest.fixture
+def fake_tg_bot():
+    return FakeTgBot()
+
+
+@pytest.fixture
+def create_tg_dispatcher(redis_db, question_bank, fake_tg_bot):
+    """Factory of telegram dispatchers with handlers of quiz, like main of tg_bot creates them."""
+    answer_matcher = get_answer_matcher('words', limit=0.5)
+    score_board = ScoreBoard(redis_db)
+
+    def create_tg_dispatcher(persistence=None, group_game=None, group_replies=None, round_timers=None):
+        dispatcher = Dispatcher(fake_tg_bot, None, workers=0, persistence=persistence)
+        for handler in tg_bot.create_handlers(question_bank, answer_matcher, score_board, round_timers=round_timers,
+                                              persistent=persistence is not None, group_game=group_game,
+                                              group_replies=group_replies):
+            dispatcher.add_handler(handler)
+        return dispatcher
+
+    return create_tg_dispatcher
+
+
+@pytest.fixture
+def process_tg_update(fake_tg_bot):
+    """Function(dispatcher, update_data) which handles update and returns last message to chat of update."""
+
+    def process_tg_update(dispatcher, update_data):
+        dispatcher.process_update(Update.de_json(update_data, fake_tg_bot))
+        return fake_tg_bot.last_messages.get(update_data['message']['chat']['id'])
+
+    return process_tg_update
+
+
+@pytest.fixture
+def wait_for():
+    """Function(condition, timeout) which waits until condition() is true, for results of background threads."""
+
+    def wait_for(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, 'Condition was not met'
+            time.sleep(0.01)
+
+    return wait_for
@@ -0,0 +1,76 @@
+from benchmark import FakeRedis
+from common_functions import AnswerIndex, FuzzyAnswerMatcher, WordsAnswerMatcher
+from question_bank import create_generation, publish_generation
+from question_cache import QuestionCache
+from redis_base_init import load_questions
+
+
+def test_empty_answer_is_incorrect():
+    answer_matcher = WordsAnswerMatcher(limit=0.5)
+
+    assert not answer_matcher.is_correct('', 'Наполеон')
+    assert not answer_matcher.is_correct('   ', 'Наполеон')
+    assert not answer_matcher.is_correct('.', 'Наполеон')
+
+
+def test_limit_of_correct_words():
+    answer_matcher = WordsAnswerMatcher(limit=0.5)
+
+    assert answer_matcher.is_correct('Наполеон', 'Наполеон Бонапарт. Император')
+    assert answer_matcher.is_correct('наполеон кутузов', 'Наполеон Бонапарт')
+    assert not answer_matcher.is_correct('наполеон кутузов суворов', 'Наполеон Бонапарт')
+    # explanation of answer is not required
+    assert not answer_matcher.is_correct('император', 'Наполеон Бонапарт. Император')
+
+
+def test_check_answers_by_batch():
+    answer_index = AnswerIndex(WordsAnswerMatcher(limit=0.5))
+    assert answer_index.load_answers([(1, 'Наполеон Бонапарт'), (2, 'Кутузов (полководец)'), (3, 'Наполеон')]) == 3
+
+    results = answer_index.check_answers([('Наполеон', 1), ('Наполеон', 2), ('кутузов', 2), ('', 3),
+                                          ('Наполеон', 3)])
+
+    assert results == [True, False, True, False, True]
+    assert answer_index.is_correct('бонапарт', 1)
+    # the same texts of answers are prepared one time
+    assert answer_index.prepared_answers[1] is not answer_index.prepared_answers[3]
+    assert answer_index.get_prepared_answer('Наполеон') is answer_index.prepared_answers[3]
+
+
+def test_matcher_uses_prepared_answers_of_index():
+    answer_matcher = WordsAnswerMatcher(limit=0.5)
+    answer_index = AnswerIndex(answer_matcher)
+    answer_index.add_answer(1, 'Наполеон Бонапарт')
+    answer_matcher.add_index('1', answer_index)
+
+    assert answer_matcher.is_correct('Бонапарт', 'Наполеон Бонапарт')
+    assert answer_matcher.get_cached_correct_answer.cache_info().currsize == 0
+    # answers which are not in index are cached
+    assert answer_matcher.is_correct('Кутузов', 'Кутузов')
+    assert answer_matcher.get_cached_correct_answer.cache_info().currsize == 1
+
+
+def test_matcher_keeps_two_generations():
+    answer_matcher = WordsAnswerMatcher(limit=0.5)
+    for generation in ('9', '10', '11'):
+        answer_matcher.add_index(generation, AnswerIndex(answer_matcher))
+
+    assert sorted(answer_matcher.indexes, key=int) == ['10', '11']
+
+
+def test_answers_are_prepared_when_cache_loads_generation():
+    redis_db = FakeRedis()
+    generation = create_generation(redis_db, 'QuestionBankGeneration')
+    questions = [('1', {'q': 'Кто проиграл при Ватерлоо?', 'a': 'Наполеон Бонапарт'}),
+                 ('2', {'q': 'Кто основал Петербург?', 'a': 'Пётр Первый'})]
+    load_questions(redis_db, questions, 'QuestionAnswerHash', generation)
+    publish_generation(redis_db, 'QuestionBankGeneration', generation, 'QuestionAnswerHash')
+
+    answer_matcher = FuzzyAnswerMatcher(limit=0.5)
+    question_cache = QuestionCache(redis_db, 'QuestionAnswerHash', answer_matcher=answer_matcher)
+    question_cache.update(str(generation), wait=True)
+
+    answer_index = answer_matcher.indexes[str(generation)]
+    assert answer_index.check_answers([('Петра', 2), ('Наплеон', 1), ('Кутузов', 1)]) == [True, True, False]
+    assert answer_matcher.is_correct('петр', 'Пётр Первый')
+    assert answer_matcher.get_cached_correct_answer.cache_info().currsize == 0
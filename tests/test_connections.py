@@ -0,0 +1,37 @@
+import pytest
+import redis
+
+from connections import wait_for_redis
+
+
+class FailingRedis:
+    """Client whose PING raises given errors one by one, then answers."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return True
+
+
+def test_connection_errors_are_waited():
+    redis_db = FailingRedis(redis.ConnectionError('Connection refused'), redis.TimeoutError('Timeout'),
+                            redis.BusyLoadingError('Redis is loading the dataset in memory'))
+
+    wait_for_redis(redis_db)
+
+    assert redis_db.pings == 4
+
+
+@pytest.mark.parametrize('error', [redis.AuthenticationError('invalid password'),
+                                   redis.ResponseError('WRONGPASS invalid username-password pair')])
+def test_configuration_errors_are_raised(error):
+    redis_db = FailingRedis(error)
+
+    with pytest.raises(type(error)):
+        wait_for_redis(redis_db)
+    assert redis_db.pings == 1
@@ -0,0 +1,77 @@
+import json
+
+from telegram import Update
+
+from benchmark import FakeTgBot, create_tg_update_data
+from event_capture import EventRecorder, get_capture_paths, iter_captured_events
+from replay import NoProfiler, Replayer, get_handler_name, replay
+from webhooks import VkCallbackEvent
+
+
+def create_vk_event(message_id, text, user_id=1):
+    return VkCallbackEvent({'id': message_id, 'from_id': user_id, 'text': text})
+
+
+def test_capture_is_rotated(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    recorder = EventRecorder(path, max_bytes=500, backup_count=2)
+    for message_id in range(1, 101):
+        recorder.record('vk', create_vk_event(message_id, f'Ответ {message_id}'))
+    recorder.handler.close()
+
+    assert get_capture_paths(path) == [f'{path}.2', f'{path}.1', path]
+    # only the newest events are kept, they are read in order of recording
+    message_ids = [payload['message_id'] for _, _, payload in iter_captured_events(path)]
+    assert message_ids == list(range(message_ids[0], 101))
+    assert message_ids[0] > 1
+
+
+def test_backups_are_sorted_by_number(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    for suffix in ('1', '2', '10', 'old'):
+        (tmp_path / f'events.jsonl.{suffix}').write_text('', encoding='utf-8')
+
+    assert get_capture_paths(path) == [f'{path}.10', f'{path}.2', f'{path}.1', path]
+
+
+def test_cut_line_is_skipped(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    recorder = EventRecorder(path)
+    recorder.record('vk', create_vk_event(1, 'Новый вопрос'))
+    recorder.handler.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"t":1.0,"p":"vk","e":{"user_')
+
+    assert [(platform, payload) for _, platform, payload in iter_captured_events(path)] == [
+        ('vk', {'user_id': 1, 'peer_id': 1, 'message_id': 1, 'text': 'Новый вопрос'})]
+
+
+def test_handler_names():
+    assert get_handler_name('tg', 'Новый вопрос', False) == 'tg_new_question'
+    assert get_handler_name('tg', '/start@QuizBot', False) == 'tg_start'
+    assert get_handler_name('vk', 'Тема история', False) == 'vk_filter'
+    assert get_handler_name('vk', 'Пушкин', False) == 'vk_answer'
+    assert get_handler_name('vk', 'Сдаться', True) == 'vk_group'
+
+
+def test_captured_events_are_replayed(tmp_path, redis_db, question_bank):
+    path = str(tmp_path / 'events.jsonl')
+    recorder = EventRecorder(path)
+    for update_id, text in enumerate(['/start', 'Новый вопрос', 'Новый вопрос', 'Пушкин'], start=1):
+        recorder.record('tg', Update.de_json(create_tg_update_data(update_id, 7, text), FakeTgBot()))
+    recorder.record('vk', create_vk_event(1, 'Новый вопрос'))
+    recorder.record('vk', create_vk_event(2, 'Сдаться'))
+    recorder.handler.close()
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line)['p'] for line in f] == ['tg'] * 4 + ['vk'] * 2
+
+    replayer = Replayer(redis_db, question_bank)
+    latencies = replay(path, replayer, NoProfiler(), speed=0)
+    replayer.vk_dispatcher.join()
+
+    assert {name: len(values) for name, values in latencies.items()} == {
+        'tg_start': 1, 'tg_new_question': 2, 'tg_answer': 1, 'vk_new_question': 1, 'vk_give_up': 1}
+    assert replayer.tg_bot.sent == 3
+    assert replayer.tg_bot.last_messages[7].startswith('К сожалению нет!')
+    # question and answer to one user are merged by dispatcher of messages
+    assert 'Жаль, правильный ответ' in replayer.fake_vk_api.last_messages[1]
@@ -0,0 +1,60 @@
+import pytest
+
+from common_functions import FuzzyAnswerMatcher, WordsAnswerMatcher, get_answer_matcher
+from stemming import fold_text, get_edit_distance, stem_word
+
+
+@pytest.fixture
+def answer_matcher():
+    return FuzzyAnswerMatcher(limit=0.5)
+
+
+@pytest.mark.parametrize('user_answer, correct_answer', [
+    ('елка', 'Ёлка'),
+    ('Ёлка', 'елка'),
+    ('Петра', 'Пётр'),
+    ('петр', 'Пётр I'),
+    ('Наполеона Бонапарта', 'Наполеон Бонапарт'),
+    ('Наполеоном', 'наполеон'),
+    ('Наполеон!', '«Наполеон»'),
+])
+def test_inflections_and_yo_are_ignored(answer_matcher, user_answer, correct_answer):
+    assert answer_matcher.is_correct(user_answer, correct_answer)
+
+
+@pytest.mark.parametrize('user_answer, correct_answer', [
+    ('Наплеон', 'Наполеон'),
+    ('Напалеон', 'Наполеон'),
+    ('Бонопарт', 'Бонапарт'),
+])
+def test_one_typo_is_allowed(answer_matcher, user_answer, correct_answer):
+    assert answer_matcher.is_correct(user_answer, correct_answer)
+
+
+@pytest.mark.parametrize('user_answer, correct_answer', [
+    ('Нплн', 'Наполеон'),
+    # typos are not allowed in short words
+    ('кот', 'кит'),
+    ('Кутузов', 'Наполеон'),
+    ('', 'Наполеон'),
+    ('?!', 'Наполеон'),
+])
+def test_other_answers_are_incorrect(answer_matcher, user_answer, correct_answer):
+    assert not answer_matcher.is_correct(user_answer, correct_answer)
+
+
+def test_words_matcher_doesnt_fold_words():
+    assert not WordsAnswerMatcher(limit=0.5).is_correct('Петра', 'Пётр')
+
+
+def test_matcher_is_chosen_by_name():
+    assert type(get_answer_matcher('words', limit=0.5)) is WordsAnswerMatcher
+    assert type(get_answer_matcher('fuzzy', limit=0.5)) is FuzzyAnswerMatcher
+
+
+def test_stemming_functions():
+    assert fold_text('Ёжик, «Пётр»!').split() == ['ежик', 'петр']
+    assert stem_word('петра') == stem_word('петр')
+    assert get_edit_distance('наполеон', 'наплеон', 1) == 1
+    # distance is not calculated further than max distance
+    assert get_edit_distance('наполеон', 'нплн', 1) > 1
@@ -0,0 +1,83 @@
+import pytest
+
+from question_dumps import ImportReport, deduplicate_records, iter_records_from_dumps, parse_dump, read_dump
+
+DUMP = '''Чемпионат:
+Кубок
+
+Вопрос 1:
+Кто командовал русской армией при Бородино?
+
+Ответ:
+Кутузов.
+
+Вопрос 2:
+Какой город основал Пётр?
+
+Ответ: Санкт-Петербург.
+
+Ответ: Петербург.
+
+Вопрос 3:
+Кто написал "Полтаву"?
+
+Ответ:
+Пушкин.
+
+Комментарий:
+Ответ: Лермонтов не засчитывается.
+
+Вопрос 4:
+Что изобрёл Менделеев?
+
+Ответ:
+Таблицу.
+'''
+
+
+def write_dump(tmp_path, encoding='utf-8', text=DUMP):
+    path = tmp_path / f'dump-{encoding}.txt'
+    path.write_text(text, encoding=encoding)
+    return str(path)
+
+
+def test_ambiguous_records_are_rejected(tmp_path):
+    path = write_dump(tmp_path)
+
+    records, rejected = parse_dump(path)
+
+    assert [record['a'] for _, record in records] == ['Кутузов.', 'Таблицу.']
+    assert rejected == [(path, 15, 'second section "Ответ" of question'),
+                        (path, 24, 'second section "Ответ" of question')]
+
+
+def test_report_counts_only_imported_records(tmp_path):
+    report = ImportReport()
+
+    questions = list(deduplicate_records(iter_records_from_dumps([write_dump(tmp_path)], report, processes=1), report))
+
+    assert len(questions) == report.parsed == 2
+    assert len(report.rejected) == 2
+
+
+@pytest.mark.parametrize('encoding', ['cp1251', 'koi8-r'])
+def test_one_byte_encodings_are_detected(tmp_path, encoding):
+    path = write_dump(tmp_path, encoding)
+
+    assert read_dump(path) == DUMP
+    records, _ = parse_dump(path)
+    assert [record['a'] for _, record in records] == ['Кутузов.', 'Таблицу.']
+
+
+def test_encoding_can_be_set(tmp_path):
+    path = write_dump(tmp_path, 'cp1251', 'Вопрос: Кто?\nОтвет: Я.\n')
+
+    assert parse_dump(path, encoding='cp1251')[0][0][1] == {'q': 'Кто?', 'a': 'Я.'}
+
+
+def test_file_without_questions_is_reported(tmp_path):
+    path = write_dump(tmp_path, text='Чемпионат:\nКубок\n')
+    empty_path = write_dump(tmp_path, 'cp1251', text='')
+
+    assert parse_dump(path) == ([], [(path, 1, 'file without questions')])
+    assert parse_dump(empty_path) == ([], [])
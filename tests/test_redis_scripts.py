@@ -0,0 +1,105 @@
+import os
+import random
+import uuid
+
+import pytest
+import redis
+
+from benchmark import CATEGORIES, FakeRedis, iter_synthetic_questions
+from connections import create_redis
+from question_bank import QuestionBank, create_generation, get_filter_name, normalize_filter_value, publish_generation
+from redis_base_init import load_questions
+
+
+@pytest.fixture
+def real_redis():
+    """Redis from TEST_REDIS_ADDRESS (TEST_REDIS_PORT, TEST_REDIS_PASSWORD), test is skipped without it.
+
+    Test uses only keys with random prefix, they are deleted after test.
+    """
+    address = os.getenv('TEST_REDIS_ADDRESS')
+    if not address:
+        pytest.skip('TEST_REDIS_ADDRESS is not set')
+    redis_db = create_redis(address, os.getenv('TEST_REDIS_PORT'), os.getenv('TEST_REDIS_PASSWORD'),
+                            socket_timeout=1)
+    try:
+        redis_db.ping()
+    except redis.ConnectionError:
+        pytest.skip(f'Redis on {address} is not available')
+
+    prefix = f'test:{uuid.uuid4().hex}'
+    yield redis_db, prefix
+    for key in redis_db.scan_iter(match=f'{prefix}:*'):
+        redis_db.delete(key)
+    redis_db.close()
+
+
+def load_bank(redis_db, prefix, seed=0):
+    generation = create_generation(redis_db, f'{prefix}:Generation')
+    load_questions(redis_db, iter_synthetic_questions(50, seed), f'{prefix}:Questions', generation)
+    publish_generation(redis_db, f'{prefix}:Generation', generation, f'{prefix}:Questions')
+
+
+def run_scenario(redis_db, prefix, scenario):
+    """Run scenario of questions bank with the same random numbers, so Redis and FakeRedis get equal calls.
+
+    :return: tuple, (results of scenario, users hash, schedules hash)
+    """
+    load_bank(redis_db, prefix)
+    question_bank = QuestionBank(redis_db, f'{prefix}:Questions', generation_key_name=f'{prefix}:Generation',
+                                 schedule_hash_name=f'{prefix}:Schedules')
+    question_bank.preload()
+    random.seed(0)
+    results = scenario(question_bank, redis_db, prefix)
+    return results, redis_db.hgetall(f'{prefix}:Users'), redis_db.hgetall(f'{prefix}:Schedules')
+
+
+def assert_equal_in_redis_and_fake(real_redis, scenario):
+    redis_db, prefix = real_redis
+    result = run_scenario(redis_db, prefix, scenario)
+
+    assert result == run_scenario(FakeRedis(), prefix, scenario)
+    return result
+
+
+def test_permutation(real_redis):
+    def scenario(question_bank, redis_db, prefix):
+        # all questions and two questions of the next permutation
+        return [question_bank.get_random_question(member='tg:1') for _ in range(52)]
+
+    results, _, _ = assert_equal_in_redis_and_fake(real_redis, scenario)
+
+    assert sorted(question.question_id for question in results[:50]) == list(range(1, 51))
+
+
+def test_generation_switch(real_redis):
+    def scenario(question_bank, redis_db, prefix):
+        first = question_bank.get_random_question(f'{prefix}:Users', 1, member='vk:1')
+        load_bank(redis_db, prefix, seed=1)
+        question_bank.refresh(force=True)
+        # answer of previous question is read from old generation, schedule is started again
+        second = question_bank.get_random_question(f'{prefix}:Users', 1, (first.generation, first.question_id),
+                                                   member='vk:1')
+        return [first, second]
+
+    (first, second), users, _ = assert_equal_in_redis_and_fake(real_redis, scenario)
+
+    assert second.generation == first.generation + 1
+    assert second.previous_answer == first.answer
+    assert users
+
+
+def test_filter(real_redis):
+    question_filter = get_filter_name(category=normalize_filter_value(CATEGORIES[0]))
+
+    def scenario(question_bank, redis_db, prefix):
+        return [question_bank.get_random_question(f'{prefix}:Users', 1, member='vk:1', question_filter=question_filter)
+                for _ in range(3)]
+
+    results, users, schedules = assert_equal_in_redis_and_fake(real_redis, scenario)
+
+    categories = {int(question_num): question_answer['category']
+                  for question_num, question_answer in iter_synthetic_questions(50)}
+    assert {categories[question.question_id] for question in results} == {CATEGORIES[0]}
+    assert len(schedules) == 1
+    assert list(users.values())[0].endswith(question_filter.encode('utf-8'))
@@ -0,0 +1,90 @@
+import re
+from functools import partial
+
+from prometheus_client import REGISTRY
+
+import tg_bot
+import vk_bot
+from benchmark import FakeVkApi
+from common_functions import get_answer_matcher
+from round_timers import RoundTimerQueue
+from scores import ScoreBoard
+from tg_persistence import RedisPersistence
+from webhooks import VkCallbackEvent
+
+
+def get_question_id(text):
+    return int(re.search(r'№(\d+)', text).group(1))
+
+
+def count_answers(platform, outcome):
+    return REGISTRY.get_sample_value('quiz_bot_answers_total', {'platform': platform, 'outcome': outcome}) or 0
+
+
+def fire_timers(round_timers, reveal_answer):
+    """Do work of RoundTimerWorker for timers which deadline passed."""
+    for member, payload in round_timers.pop_due():
+        reveal_answer(member, payload)
+
+
+def test_tg_answer_to_question_without_timer(redis_db, answers, create_tg_dispatcher, process_tg_update,
+                                            make_tg_update):
+    # question was given before timers were enabled
+    persistence = RedisPersistence(redis_db, flush_interval=60)
+    process = partial(process_tg_update, create_tg_dispatcher(persistence))
+    process(make_tg_update('/start'))
+    process(make_tg_update('Новый вопрос'))
+    question_id = get_question_id(process(make_tg_update('Новый вопрос')))
+    persistence.flush()
+
+    round_timers = RoundTimerQueue(redis_db, 'RoundTimers:tg', round_time=30)
+    dispatcher = create_tg_dispatcher(RedisPersistence(redis_db, flush_interval=60), round_timers=round_timers)
+
+    assert process_tg_update(dispatcher, make_tg_update(answers[question_id])).startswith('Правильно!')
+
+
+def test_tg_new_question_after_timer(redis_db, fake_tg_bot, create_tg_dispatcher, process_tg_update, make_tg_update):
+    round_timers = RoundTimerQueue(redis_db, 'RoundTimers:tg', round_time=0)
+    process = partial(process_tg_update, create_tg_dispatcher(round_timers=round_timers))
+    process(make_tg_update('/start'))
+    process(make_tg_update('Новый вопрос'))
+    first_question_id = get_question_id(process(make_tg_update('Новый вопрос')))
+
+    fire_timers(round_timers, partial(tg_bot.reveal_answer, bot=fake_tg_bot))
+    assert fake_tg_bot.last_messages[1].startswith('Время вышло!')
+
+    # conversation is back in state of question, so button gives question instead of checking of answer
+    assert get_question_id(process(make_tg_update('Новый вопрос'))) != first_question_id
+
+
+def test_vk_give_up_after_timer(redis_db, question_bank):
+    round_timers = RoundTimerQueue(redis_db, 'RoundTimers:vk', round_time=0)
+    users_db = vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank)
+    vk_api = FakeVkApi()
+    run_bot_logic = partial(vk_bot.run_bot_logic, vk_api=vk_api, users_db=users_db,
+                            answer_matcher=get_answer_matcher('words', limit=0.5), score_board=ScoreBoard(redis_db),
+                            round_timers=round_timers)
+    run_bot_logic(VkCallbackEvent({'id': 1, 'from_id': 1, 'text': 'Новый вопрос'}))
+    timeouts, give_ups = count_answers('vk', 'timeout'), count_answers('vk', 'give_up')
+
+    fire_timers(round_timers, partial(vk_bot.reveal_answer, vk_api=vk_api))
+    run_bot_logic(VkCallbackEvent({'id': 2, 'from_id': 1, 'text': 'Сдаться'}))
+
+    assert vk_api.last_messages[1].startswith('Время на ответ вышло')
+    assert count_answers('vk', 'timeout') == timeouts + 1
+    assert count_answers('vk', 'give_up') == give_ups
+
+
+def test_vk_answer_to_question_without_timer(redis_db, question_bank, answers):
+    users_db = vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank)
+    vk_api = FakeVkApi()
+    run_bot_logic = partial(vk_bot.run_bot_logic, vk_api=vk_api, users_db=users_db,
+                            answer_matcher=get_answer_matcher('words', limit=0.5), score_board=ScoreBoard(redis_db))
+    run_bot_logic(VkCallbackEvent({'id': 1, 'from_id': 1, 'text': 'Новый вопрос'}))
+    question_id = get_question_id(vk_api.last_messages[1])
+
+    # timers were enabled after question was given
+    run_bot_logic(VkCallbackEvent({'id': 2, 'from_id': 1, 'text': answers[question_id]}),
+                  round_timers=RoundTimerQueue(redis_db, 'RoundTimers:vk', round_time=30))
+
+    assert vk_api.last_messages[1].startswith('Правильно!')
@@ -0,0 +1,45 @@
+import datetime
+import time
+
+from benchmark import FakeRedis
+from scores import ScoreBoard, get_member
+
+
+def test_day_and_week_keys_roll_over():
+    score_board = ScoreBoard(FakeRedis())
+
+    # the last second of Sunday and the first second of Monday, UTC
+    sunday = score_board.get_keys(datetime.datetime(2024, 3, 10, 23, 59, 59))
+    monday = score_board.get_keys(datetime.datetime(2024, 3, 11, 0, 0, 0))
+
+    assert sunday['global'] == monday['global'] == ('Scores:global', None)
+    assert sunday['day'] == ('Scores:day:20240310', 8 * 24 * 3600)
+    assert monday['day'] == ('Scores:day:20240311', 8 * 24 * 3600)
+    assert sunday['week'] == ('Scores:week:2024-10', 5 * 7 * 24 * 3600)
+    assert monday['week'] == ('Scores:week:2024-11', 5 * 7 * 24 * 3600)
+
+
+def test_week_key_uses_iso_year():
+    score_board = ScoreBoard(FakeRedis())
+
+    # 30 December 2024 is Monday of the first ISO week of 2025
+    assert score_board.get_keys(datetime.datetime(2024, 12, 30))['week'][0] == 'Scores:week:2025-01'
+    assert score_board.get_keys(datetime.datetime(2024, 12, 29))['week'][0] == 'Scores:week:2024-52'
+
+
+def test_points_get_ttl_of_period():
+    redis_db = FakeRedis()
+    score_board = ScoreBoard(redis_db)
+    member = get_member('tg', 1)
+
+    assert score_board.add_points(member) == 1
+    assert score_board.add_points(member, points=2) == 3
+
+    keys = score_board.get_keys()
+    assert score_board.get_scores(member) == {'global': (3, 1), 'day': (3, 1), 'week': (3, 1)}
+    for period, (key, ttl) in keys.items():
+        expires_at = redis_db.expires.get(key.encode('utf-8'))
+        if ttl is None:
+            assert expires_at is None, period
+        else:
+            assert ttl - 1 < expires_at - time.monotonic() <= ttl, period
@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+from sharding import ShardedWorkers, get_shard
+
+
+def test_shard_is_crc32_of_key():
+    assert get_shard(1, 4) == 3
+    assert get_shard('1', 4) == 3
+    assert get_shard(123456789, 4) == 2
+    assert get_shard('tg:42', 4) == 1
+
+
+def test_shard_is_the_same_in_other_process():
+    keys = list(range(100)) + [f'user{key}' for key in range(100)]
+    code = f'from sharding import get_shard; print([get_shard(key, 7) for key in {keys!r}])'
+    shards = set()
+    for hash_seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        shards.add(output.strip())
+
+    assert shards == {str([get_shard(key, 7) for key in keys])}
+
+
+def test_tasks_of_key_are_handled_by_one_worker():
+    results = multiprocessing.get_context('fork').Queue()
+
+    def init_worker(shard):
+        return lambda task: results.put((shard, task))
+
+    workers = ShardedWorkers(init_worker, workers=3)
+    tasks = [(user_id, task_num) for task_num in range(5) for user_id in range(10)]
+    for user_id, task_num in tasks:
+        workers.put(user_id, (user_id, task_num))
+    workers.stop()
+
+    handled = {}
+    for _ in tasks:
+        shard, (user_id, task_num) = results.get(timeout=5)
+        handled.setdefault(user_id, []).append((shard, task_num))
+    for user_id, user_tasks in handled.items():
+        assert user_tasks == [(get_shard(user_id, 3), task_num) for task_num in range(5)]
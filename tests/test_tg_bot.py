@@ -0,0 +1,69 @@
+import re
+from functools import partial
+
+import pytest
+
+import tg_bot
+from common_functions import get_answer_matcher
+from group_games import GroupGame, ReplyCoalescer
+from scores import ScoreBoard
+from tg_persistence import RedisPersistence
+
+
+def get_question_id(text):
+    return int(re.search(r'№(\d+)', text).group(1))
+
+
+@pytest.fixture
+def process(create_tg_dispatcher, process_tg_update):
+    return partial(process_tg_update, create_tg_dispatcher())
+
+
+def test_score_before_question(process, make_tg_update):
+    process(make_tg_update('/start'))
+    process(make_tg_update('Новый вопрос'))
+
+    assert process(make_tg_update('Мой счёт')).startswith('Всего: 0')
+
+    # score doesn't give question, question is given by the next message
+    assert get_question_id(process(make_tg_update('Новый вопрос')))
+
+
+def test_score_while_answering(answers, process, make_tg_update):
+    process(make_tg_update('/start'))
+    process(make_tg_update('Новый вопрос'))
+    question_id = get_question_id(process(make_tg_update('Новый вопрос')))
+
+    assert process(make_tg_update('Мой счёт')).startswith('Всего: 0')
+    assert process(make_tg_update(answers[question_id])).startswith('Правильно!')
+
+
+def test_group_and_private_chats(redis_db, question_bank, answers, fake_tg_bot, create_tg_dispatcher, process_tg_update,
+                                 make_tg_update, wait_for):
+    dispatcher = create_tg_dispatcher(RedisPersistence(redis_db), GroupGame(redis_db, question_bank),
+                                      ReplyCoalescer(interval=0.01))
+    process = partial(process_tg_update, dispatcher)
+
+    # replies to group are sent by coalescer
+    process(make_tg_update('Новый вопрос', user_id=1, chat_id=-10))
+    wait_for(lambda: -10 in fake_tg_bot.last_messages)
+    question_id = get_question_id(fake_tg_bot.last_messages[-10])
+    process(make_tg_update(answers[question_id], user_id=2, chat_id=-10))
+    wait_for(lambda: 'первым' in fake_tg_bot.last_messages[-10])
+
+    # group handler doesn't take messages of private chats
+    assert process(make_tg_update('/start', user_id=2)).startswith('Добро пожаловать')
+
+
+def test_sharded_worker(monkeypatch, redis_db, question_bank, answers, fake_tg_bot, make_tg_update):
+    # only connection to telegram is replaced, dispatcher and persistence of worker are real
+    monkeypatch.setattr(tg_bot, 'Bot', lambda token, base_url=None, request=None: fake_tg_bot)
+    handlers = tg_bot.create_handlers(question_bank, get_answer_matcher('words', limit=0.5), ScoreBoard(redis_db),
+                                      persistent=True)
+    handle_update = tg_bot.init_tg_worker(0, 'token', handlers, create_persistence=partial(RedisPersistence, redis_db))
+
+    for text in ['/start', 'Новый вопрос', 'Новый вопрос']:
+        handle_update(make_tg_update(text))
+    handle_update(make_tg_update(answers[get_question_id(fake_tg_bot.last_messages[1])]))
+
+    assert fake_tg_bot.last_messages[1].startswith('Правильно!')
@@ -0,0 +1,41 @@
+import re
+from collections import defaultdict
+from functools import partial
+
+from tg_persistence import RedisPersistence
+
+
+def get_question_id(text):
+    return int(re.search(r'№(\d+)', text).group(1))
+
+
+def test_backed_dicts_are_accepted_by_dispatcher(redis_db):
+    persistence = RedisPersistence(redis_db)
+
+    assert isinstance(persistence.get_user_data(), defaultdict)
+    assert isinstance(persistence.get_chat_data(), defaultdict)
+    assert persistence.get_user_data()[1] == {}
+    assert persistence.get_conversations('quiz').get((1, 1)) is None
+
+
+def test_quiz_through_dispatcher(redis_db, answers, create_tg_dispatcher, process_tg_update, make_tg_update):
+    persistence = RedisPersistence(redis_db)
+    process = partial(process_tg_update, create_tg_dispatcher(persistence))
+
+    assert process(make_tg_update('/start')).startswith('Добро пожаловать')
+    process(make_tg_update('Новый вопрос'))
+    question_id = get_question_id(process(make_tg_update('Новый вопрос')))
+    assert process(make_tg_update(answers[question_id])).startswith('Правильно!')
+    assert persistence.get_user_data()[1]['answer'] == answers[question_id]
+
+
+def test_state_survives_restart(redis_db, answers, create_tg_dispatcher, process_tg_update, make_tg_update):
+    persistence = RedisPersistence(redis_db)
+    process = partial(process_tg_update, create_tg_dispatcher(persistence))
+    process(make_tg_update('/start'))
+    process(make_tg_update('Новый вопрос'))
+    question_id = get_question_id(process(make_tg_update('Новый вопрос')))
+    persistence.flush()
+
+    process = partial(process_tg_update, create_tg_dispatcher(RedisPersistence(redis_db)))
+    assert process(make_tg_update(answers[question_id])).startswith('Правильно!')
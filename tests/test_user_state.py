@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from benchmark import FakeRedis
+from user_state import decode_user_info, encode_user_info, migrate_users
+
+
+@pytest.mark.parametrize('user_info', [
+    {'got_q': False, 'g': None, 'id': None, 'f': None, 't': False},
+    {'got_q': True, 'g': 3, 'id': 42, 'f': None, 't': False},
+    {'got_q': True, 'g': 3, 'id': 42, 'f': 'category:история|difficulty:2', 't': True},
+])
+def test_round_trip(user_info):
+    encoded_user_info = encode_user_info(user_info)
+
+    assert decode_user_info(encoded_user_info) == user_info
+    # 10 bytes and name of filter
+    assert len(encoded_user_info) == 10 + len((user_info['f'] or '').encode('utf-8'))
+
+
+def test_migration_of_legacy_json():
+    redis_db = FakeRedis()
+    legacy_users = {
+        1: {'got_q': True, 'g': 2, 'id': 7},
+        2: {'got_q': False, 'g': None, 'id': None, 'f': 'category:наука'},
+        # user info before integer ids of questions
+        3: {'got_q': True, 'q': 'Вопрос'},
+    }
+    for user_id, user_info in legacy_users.items():
+        redis_db.hset('UsersHash', user_id, json.dumps(user_info, ensure_ascii=False))
+    binary_user_info = encode_user_info({'got_q': True, 'g': 2, 'id': 8, 'f': None})
+    redis_db.hset('UsersHash', 4, binary_user_info)
+
+    assert migrate_users(redis_db, 'UsersHash', batch_size=2) == 3
+
+    users = {int(user_id): user_info for user_id, user_info in redis_db.hgetall('UsersHash').items()}
+    assert not any(user_info.startswith(b'{') for user_info in users.values())
+    assert users[4] == binary_user_info
+    assert [decode_user_info(users[user_id]) for user_id in (1, 2, 3)] == [
+        {'got_q': True, 'g': 2, 'id': 7, 'f': None, 't': False},
+        {'got_q': False, 'g': None, 'id': None, 'f': 'category:наука', 't': False},
+        {'got_q': False, 'g': None, 'id': None, 'f': None, 't': False},
+    ]
+    # converted users are not converted again
+    assert migrate_users(redis_db, 'UsersHash') == 0
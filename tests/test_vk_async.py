@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+import pytest
+from vk_api.vk_api import VkApiMethod
+
+import vk_async
+from benchmark import FakeVkApi
+from vk_async import ConcurrentEventProcessor, ThreadSafeVkSession, run_async_bot
+from vk_dispatcher import VkMessageDispatcher, create_dispatching_api
+from webhooks import VkCallbackEvent
+
+
+class FakeAsyncVkApi:
+    def __init__(self):
+        self.calls = []
+
+    async def method(self, method, values=None):
+        self.calls.append((method, values))
+        return {'method': method}
+
+
+def test_blocking_api_calls_methods_in_event_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    async_vk_api = FakeAsyncVkApi()
+    try:
+        vk_api = VkApiMethod(ThreadSafeVkSession(async_vk_api, loop))
+        assert vk_api.users.get(user_ids=1) == {'method': 'users.get'}
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    assert async_vk_api.calls == [('users.get', {'user_ids': 1})]
+
+
+def test_restarts_of_runtime_dont_create_dispatchers(monkeypatch):
+    async def fail_listen(self):
+        raise RuntimeError('long poll failed')
+        yield
+
+    monkeypatch.setattr(vk_async.AsyncVkLongPoll, 'listen', fail_listen)
+    dispatcher = VkMessageDispatcher(FakeVkApi())
+    threads_before = threading.active_count()
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            asyncio.run(run_async_bot('token', lambda event, vk_api: None, dispatcher))
+
+    assert threading.active_count() == threads_before
+
+
+def test_runtime_handles_events(monkeypatch, vk_event_handler):
+    fake_vk_api = FakeVkApi()
+
+    async def listen(self):
+        yield VkCallbackEvent({'id': 1, 'from_id': 1, 'text': 'Новый вопрос'})
+        while 1 not in fake_vk_api.last_messages:
+            await asyncio.sleep(0.01)
+        raise RuntimeError('long poll was stopped')
+
+    monkeypatch.setattr(vk_async.AsyncVkLongPoll, 'listen', listen)
+    _, dispatcher = create_dispatching_api(fake_vk_api, rate=100)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(run_async_bot('token', vk_event_handler, dispatcher), timeout=5))
+
+    assert 'Вопрос №' in fake_vk_api.last_messages[1]
+
+
+def test_busy_user_doesnt_block_other_users():
+    release = threading.Event()
+    handled = []
+
+    def handler(event):
+        user_id, _ = event
+        if user_id == 1:
+            release.wait(5)
+        handled.append(event)
+
+    async def submit_events():
+        processor = ConcurrentEventProcessor(handler, max_concurrency=2)
+        for num in range(3):
+            await processor.submit((1, num), 1)
+        await processor.submit((2, 0), 2)
+        while (2, 0) not in handled:
+            await asyncio.sleep(0.01)
+        release.set()
+        while len(handled) < 4:
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(asyncio.wait_for(submit_events(), timeout=3))
+    finally:
+        release.set()
+
+    # events of user 1 wait each other, but not event of user 2
+    assert handled == [(2, 0), (1, 0), (1, 1), (1, 2)]
@@ -0,0 +1,107 @@
+import itertools
+import re
+
+import pytest
+
+import vk_bot
+from benchmark import FakeVkApi, iter_synthetic_questions
+from question_bank import create_generation, publish_generation
+from redis_base_init import load_questions
+from vk_dispatcher import create_dispatching_api
+from webhooks import VkCallbackEvent
+
+CHAT_PEER_ID = vk_bot.CHAT_PEER_ID_START + 1
+
+
+def get_question_id(text):
+    return int(re.search(r'№(\d+)', text).group(1))
+
+
+class FakeVkSession:
+    """Stand-in of vk_api.VkApi with fake API."""
+
+    def __init__(self, vk_api):
+        self.vk_api = vk_api
+
+    def get_api(self):
+        return self.vk_api
+
+
+@pytest.fixture
+def make_event():
+    message_ids = itertools.count(1)
+
+    def make_event(text, user_id=1, peer_id=None):
+        return VkCallbackEvent({'id': next(message_ids), 'from_id': user_id, 'peer_id': peer_id or user_id,
+                                'text': text})
+
+    return make_event
+
+
+def test_private_quiz_through_dispatcher(answers, vk_event_handler, make_event):
+    fake_vk_api = FakeVkApi()
+    vk_api, dispatcher = create_dispatching_api(fake_vk_api, rate=100)
+
+    vk_event_handler(make_event('Новый вопрос'), vk_api)
+    dispatcher.join()
+    question_id = get_question_id(fake_vk_api.last_messages[1])
+    vk_event_handler(make_event(answers[question_id]), vk_api)
+    dispatcher.join()
+
+    assert fake_vk_api.last_messages[1].startswith('Правильно!')
+
+
+def test_conversation_through_dispatcher(answers, vk_event_handler, make_event, wait_for):
+    fake_vk_api = FakeVkApi()
+    vk_api, _ = create_dispatching_api(fake_vk_api, rate=100)
+
+    vk_event_handler(make_event('Новый вопрос', user_id=1, peer_id=CHAT_PEER_ID), vk_api)
+    wait_for(lambda: CHAT_PEER_ID in fake_vk_api.last_messages)
+    question_id = get_question_id(fake_vk_api.last_messages[CHAT_PEER_ID])
+    vk_event_handler(make_event(answers[question_id], user_id=2, peer_id=CHAT_PEER_ID), vk_api)
+
+    wait_for(lambda: 'первым' in fake_vk_api.last_messages[CHAT_PEER_ID])
+
+
+def test_sharded_worker(monkeypatch, vk_event_handler, make_event, wait_for):
+    fake_vk_api = FakeVkApi()
+    # only connection to VK is replaced, worker sends messages by its own dispatcher
+    monkeypatch.setattr(vk_bot.vk, 'VkApi', lambda token: FakeVkSession(fake_vk_api))
+
+    handle = vk_bot.init_vk_worker(0, 'token', vk_event_handler)
+    handle(make_event('Новый вопрос'))
+
+    wait_for(lambda: 1 in fake_vk_api.last_messages)
+    assert get_question_id(fake_vk_api.last_messages[1])
+
+
+
+class RecordingVkApi(FakeVkApi):
+    """Fake VK API which remembers all messages."""
+
+    def __init__(self):
+        super().__init__()
+        self.history = []
+
+    def send(self, **params):
+        self.history.append(params['message'])
+        return super().send(**params)
+
+
+def test_question_of_deleted_generation(redis_db, question_bank, vk_event_handler, make_event):
+    vk_api = RecordingVkApi()
+    vk_event_handler(make_event('Новый вопрос', user_id=1), vk_api)
+    vk_event_handler(make_event('Новый вопрос', user_id=2), vk_api)
+    # bank is reloaded and the old generation is deleted at once
+    generation = create_generation(redis_db, 'QuestionBankGeneration')
+    load_questions(redis_db, iter_synthetic_questions(100), 'QuestionAnswerHash', generation)
+    publish_generation(redis_db, 'QuestionBankGeneration', generation, 'QuestionAnswerHash', old_generation_ttl=0)
+    question_bank.refresh(force=True)
+
+    vk_event_handler(make_event('Ответ', user_id=1), vk_api)
+    assert vk_api.history[-1].startswith('Вопросы викторины обновились')
+
+    vk_event_handler(make_event('Новый вопрос', user_id=2), vk_api)
+    previous_answer_msg, question_msg = vk_api.history[-2:]
+    assert 'Вопросы викторины обновились' in previous_answer_msg and 'None' not in previous_answer_msg
+    assert get_question_id(question_msg)
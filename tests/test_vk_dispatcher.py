@@ -0,0 +1,84 @@
+from functools import partial
+
+from vk_api.vk_api import VkApiMethod
+
+import vk_bot
+from benchmark import FakeVkApi
+from vk_dispatcher import VkMessageDispatcher, create_dispatching_api, merge_messages
+
+CHAT_PEER_ID = vk_bot.CHAT_PEER_ID_START + 1
+
+
+class FakeUsersApi:
+    def get(self, **params):
+        return [{'id': params['user_ids']}]
+
+
+def test_messages_are_sent_by_dispatcher():
+    fake_vk_api = FakeVkApi()
+    fake_vk_api.users = FakeUsersApi()
+    vk_api, dispatcher = create_dispatching_api(fake_vk_api, rate=100)
+
+    assert vk_api.messages.send(user_id=1, message='Привет', random_id=1) is None
+    dispatcher.join()
+    assert fake_vk_api.last_messages == {1: 'Привет'}
+    # other methods are called directly
+    assert vk_api.users.get(user_ids=1) == [{'id': 1}]
+
+
+def test_worker_builds_dispatching_session():
+    def handle_event(event, vk_api):
+        return vk_api
+
+    handler = vk_bot.init_vk_worker(0, 'token', handle_event, rate_limit=1)
+
+    assert isinstance(handler, partial)
+    assert isinstance(handler(None), VkApiMethod)
+
+
+def test_messages_are_merged_only_for_the_same_destination():
+    messages = [
+        {'user_id': 1, 'message': 'Правильно!', 'random_id': 1},
+        {'user_id': 1, 'message': 'Вопрос №1', 'random_id': 2, 'keyboard': 'menu'},
+        {'peer_id': CHAT_PEER_ID, 'message': 'Вопрос №2', 'random_id': 3},
+        {'peer_id': CHAT_PEER_ID + 1, 'message': 'Вопрос №3', 'random_id': 4},
+        {'peer_id': CHAT_PEER_ID + 1, 'message': 'Игрок первым', 'random_id': 5},
+        {'user_id': 2, 'peer_id': CHAT_PEER_ID + 1, 'message': 'Личное', 'random_id': 6},
+    ]
+
+    assert merge_messages(messages) == [
+        {'user_id': 1, 'message': 'Правильно!\n\nВопрос №1', 'random_id': 1, 'keyboard': 'menu'},
+        {'peer_id': CHAT_PEER_ID, 'message': 'Вопрос №2', 'random_id': 3},
+        {'peer_id': CHAT_PEER_ID + 1, 'message': 'Вопрос №3\n\nИгрок первым', 'random_id': 4},
+        {'user_id': 2, 'peer_id': CHAT_PEER_ID + 1, 'message': 'Личное', 'random_id': 6},
+    ]
+
+
+def test_functions_after_failed_message_are_skipped():
+    fake_vk_api = FakeVkApi(failed_destinations=[2])
+    dispatcher = VkMessageDispatcher(fake_vk_api, rate=100)
+    called = []
+
+    # all messages and functions come during one flush interval, so they are sent by one 'execute'
+    dispatcher.send(user_id=1, message='Правильно!', random_id=1)
+    dispatcher.call_after_sent(partial(called.append, 1))
+    dispatcher.send(user_id=2, message='Вопрос №1', random_id=2)
+    dispatcher.call_after_sent(partial(called.append, 2))
+    dispatcher.send(user_id=3, message='Вопрос №2', random_id=3)
+    dispatcher.call_after_sent(partial(called.append, 3))
+    dispatcher.join()
+
+    # VK sends messages after failed one, but events of them can't be marked as handled before failed event
+    assert fake_vk_api.last_messages == {1: 'Правильно!', 3: 'Вопрос №2'}
+    assert called == [1]
+
+
+def test_functions_after_failed_single_message_are_skipped():
+    dispatcher = VkMessageDispatcher(FakeVkApi(failed_destinations=[1]), rate=100)
+    called = []
+
+    dispatcher.send(user_id=1, message='Вопрос №1', random_id=1)
+    dispatcher.call_after_sent(partial(called.append, 1))
+    dispatcher.join()
+
+    assert called == []
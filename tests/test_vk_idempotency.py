@@ -0,0 +1,85 @@
+import pytest
+
+import vk_bot
+from benchmark import FakeVkApi
+from common_functions import get_answer_matcher
+from scores import ScoreBoard
+from vk_dispatcher import create_dispatching_api
+from vk_idempotency import EventDeduplicator, get_random_id
+from webhooks import VkCallbackEvent
+
+
+class FailingVkApi(FakeVkApi):
+    """VK API which fails while :failures: > 0."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def send(self, **params):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('VK is not available')
+        return super().send(**params)
+
+
+@pytest.fixture
+def handle(redis_db, question_bank):
+    users_db = vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank)
+    answer_matcher = get_answer_matcher('words', limit=0.5)
+    score_board = ScoreBoard(redis_db)
+    deduplicator = EventDeduplicator(redis_db)
+
+    def handle(event, vk_api):
+        vk_bot.handle_event(event, vk_api, users_db, answer_matcher, score_board, deduplicator)
+
+    return handle
+
+
+def test_handled_event_is_skipped(handle):
+    vk_api = FakeVkApi()
+    event = VkCallbackEvent({'id': 1, 'from_id': 7, 'text': 'Новый вопрос'})
+
+    handle(event, vk_api)
+    handle(event, vk_api)
+
+    assert vk_api.sent == 1
+
+
+def test_failed_event_is_handled_again(handle, monkeypatch):
+    vk_api = FakeVkApi()
+    event = VkCallbackEvent({'id': 1, 'from_id': 7, 'text': 'Новый вопрос'})
+    monkeypatch.setattr(vk_bot, 'run_bot_logic', lambda *args: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        handle(event, vk_api)
+    monkeypatch.undo()
+
+    handle(event, vk_api)
+
+    assert vk_api.sent == 1
+
+
+def test_event_is_remembered_only_after_replies_were_sent(handle):
+    failing_vk_api = FailingVkApi(failures=1)
+    vk_api, dispatcher = create_dispatching_api(failing_vk_api, rate=100)
+    event = VkCallbackEvent({'id': 1, 'from_id': 7, 'text': 'Новый вопрос'})
+
+    handle(event, vk_api)
+    dispatcher.join()
+    assert failing_vk_api.sent == 0
+
+    # reply was lost, event is received again
+    handle(event, vk_api)
+    dispatcher.join()
+    handle(event, vk_api)
+    dispatcher.join()
+    assert failing_vk_api.sent == 1
+
+
+def test_random_id_of_reply_is_the_same_for_the_same_event():
+    event = VkCallbackEvent({'id': 1, 'from_id': 7, 'text': 'Новый вопрос'})
+    other_event = VkCallbackEvent({'id': 2, 'from_id': 7, 'text': 'Новый вопрос'})
+
+    assert get_random_id(event) == get_random_id(event)
+    assert get_random_id(event) != get_random_id(event, message_num=1)
+    assert get_random_id(event) != get_random_id(other_event)
@@ -0,0 +1,120 @@
+import json
+import re
+import threading
+import urllib.request
+from functools import partial
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import vk_bot
+from benchmark import FakeVkApi
+from common_functions import get_answer_matcher
+from scores import ScoreBoard
+from tg_persistence import RedisPersistence
+from vk_dispatcher import create_dispatching_api
+from webhooks import (PartitionedWorkerPool, TelegramWebhookRoute, VkCallbackRoute, create_request_handler,
+                      handle_route_item)
+
+
+def get_question_id(text):
+    return int(re.search(r'№(\d+)', text).group(1))
+
+
+@pytest.fixture
+def serve():
+    """Start webhook server like run_webhook_server does, function(routes) returns function(path, data)."""
+    servers = []
+
+    def serve(routes):
+        worker_pool = PartitionedWorkerPool(handle_route_item, workers=2)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), create_request_handler(routes, worker_pool))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        def post(path, data):
+            request = urllib.request.Request(f'http://127.0.0.1:{server.server_port}{path}',
+                                             data=json.dumps(data).encode('utf-8'), method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    return response.read().decode('utf-8')
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        return post
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_telegram_webhook(redis_db, answers, fake_tg_bot, create_tg_dispatcher, make_tg_update, serve, wait_for):
+    dispatcher = create_tg_dispatcher(RedisPersistence(redis_db))
+    post = serve({'/telegram/token': TelegramWebhookRoute(fake_tg_bot, dispatcher)})
+
+    for text in ['/start', 'Новый вопрос', 'Новый вопрос']:
+        assert post('/telegram/token', make_tg_update(text)) == 'ok'
+    wait_for(lambda: '№' in fake_tg_bot.last_messages.get(1, ''))
+    post('/telegram/token', make_tg_update(answers[get_question_id(fake_tg_bot.last_messages[1])]))
+
+    wait_for(lambda: fake_tg_bot.last_messages[1].startswith('Правильно!'))
+
+
+def test_vk_webhook(vk_event_handler, serve, wait_for):
+    fake_vk_api = FakeVkApi()
+    vk_api, _ = create_dispatching_api(fake_vk_api, rate=100)
+    post = serve({'/vk': VkCallbackRoute(partial(vk_event_handler, vk_api=vk_api), 'confirmation-code')})
+
+    assert post('/vk', {'type': 'confirmation'}) == 'confirmation-code'
+    assert post('/vk', {'type': 'message_new', 'object': {'id': 1, 'from_id': 1, 'text': 'Новый вопрос'}}) == 'ok'
+
+    wait_for(lambda: 1 in fake_vk_api.last_messages)
+    assert get_question_id(fake_vk_api.last_messages[1])
+
+
+def test_telegram_webhook_servers_share_state(redis_db, answers, fake_tg_bot, create_tg_dispatcher, make_tg_update,
+                                             serve):
+    # changes are written only by servers, background flush is too late for the next update
+    servers = [serve({'/telegram/token': TelegramWebhookRoute(
+        fake_tg_bot, create_tg_dispatcher(RedisPersistence(redis_db, flush_interval=60)))}) for _ in range(2)]
+
+    # updates of one user go to different servers by turns, update is handled before answer
+    for server_num, text in enumerate(['/start', 'Новый вопрос', 'Новый вопрос']):
+        servers[server_num % 2]('/telegram/token', make_tg_update(text))
+    servers[1]('/telegram/token', make_tg_update(answers[get_question_id(fake_tg_bot.last_messages[1])]))
+
+    assert fake_tg_bot.last_messages[1].startswith('Правильно!')
+
+
+def test_vk_webhook_servers_share_state(redis_db, question_bank, answers, serve, wait_for):
+    fake_vk_api = FakeVkApi()
+    vk_api, dispatcher = create_dispatching_api(fake_vk_api, rate=100)
+    servers = []
+    for _ in range(2):
+        # webhook runtime of vk_bot reads user info on every event
+        users_db = vk_bot.VkSessionUsersCondition(redis_db, 'UsersHash', question_bank, cache_ttl=0)
+        event_handler = partial(vk_bot.handle_event, vk_api=vk_api, users_db=users_db,
+                                answer_matcher=get_answer_matcher('words', limit=0.5), score_board=ScoreBoard(redis_db))
+        servers.append(serve({'/vk': VkCallbackRoute(event_handler, 'confirmation-code')}))
+
+    def post(server_num, message_id, text):
+        servers[server_num]('/vk', {'type': 'message_new', 'object': {'id': message_id, 'from_id': 1, 'text': text}})
+        dispatcher.join()
+        return fake_vk_api.last_messages[1]
+
+    post(1, 1, 'Новый вопрос')
+    question_id = get_question_id(post(0, 2, 'Новый вопрос'))
+
+    # the second server has seen the user with the first question
+    assert post(1, 3, answers[question_id]).startswith('Правильно!')
+
+
+def test_failed_update_is_not_acknowledged(serve):
+    def handle_event(event):
+        raise RuntimeError('Redis is not available')
+
+    post = serve({'/vk': VkCallbackRoute(handle_event, 'confirmation-code')})
+
+    # VK repeats event which was not answered with ok
+    assert post('/vk', {'type': 'message_new', 'object': {'id': 1, 'from_id': 1, 'text': 'Новый вопрос'}}) == 500
@@ -1,14 +1,25 @@
-from telegram.ext import ConversationHandler, CommandHandler, Filters, Updater, MessageHandler
-from telegram import ReplyKeyboardMarkup
+from telegram.ext import ConversationHandler, CommandHandler, Dispatcher, Filters, Updater, MessageHandler, TypeHandler
+from telegram.utils.request import Request
+from telegram import Bot, ReplyKeyboardMarkup, TelegramError, Update
 import dotenv
-import redis
 
 import logging
 import os
 from enum import IntEnum, unique
 from functools import partial
 
-from common_functions import is_correct_answer, normalize_answer
+from common_functions import get_answer_matcher
+from connections import Backoff, create_redis, wait_for_redis
+from event_capture import EventRecorder
+from group_games import GroupGame, ReplyCoalescer, handle_group_message
+from metrics import SEND_LATENCY, count_answer, start_metrics_server, track_handler, track_latency
+from question_bank import QuestionBank, handle_filter_command
+from question_cache import QuestionCache
+from round_timers import RoundTimerQueue, RoundTimerWorker
+from scores import ScoreBoard, get_member
+from sharding import ShardedWorkers
+from tg_persistence import RedisPersistence
+from webhooks import TelegramWebhookRoute, run_webhook_server
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +31,18 @@ class Buttons(IntEnum):
     ANSWER = 2
 
 
+def send_message(bot, update, text, reply_markup=None):
+    """Send message to chat of update.
+
+    :param bot: tg bot object
+    :param update: event with update tg object
+    :param text: str, text of message
+    :param reply_markup: keyboard or None
+    """
+    with track_latency(SEND_LATENCY.labels('tg'), 'tg_send'):
+        bot.send_message(chat_id=update.message.chat_id, text=text, reply_markup=reply_markup)
+
+
 def greet_user(bot, update):
     """Just hello message for /start command.
 
@@ -33,20 +56,56 @@ def greet_user(bot, update):
     ]
     reply_markup = ReplyKeyboardMarkup(custom_keyboard)
     msg = 'Добро пожаловать в историческую викторину. Выберите действие!'
-    bot.send_message(chat_id=update.message.chat_id, text=msg, reply_markup=reply_markup)
+    send_message(bot, update, msg, reply_markup=reply_markup)
     logger.debug('"Greeting" message was sent')
 
     return Buttons.MENU
 
 
-def manage_menu_logic(bot, update, user_data):
+def send_score(bot, update, score_board):
+    """Send scores of user.
+
+    :param bot: tg bot object
+    :param update: event with update tg object
+    :param score_board: ScoreBoard object
+    """
+    msg = score_board.get_score_message(get_member('tg', update.message.from_user.id))
+    send_message(bot, update, msg)
+    logger.debug('"Score" message was sent')
+
+
+def choose_filter(bot, update, user_data, question_bank):
+    """Change category or difficulty of questions if message is command.
+
+    :param bot: tg bot object
+    :param update: event with update tg object
+    :param user_data: users data which tg must remember. Dict-like interface
+    :param question_bank: questions DB object
+    :return: bool, True if message was command
+    """
+    filter_command = handle_filter_command(question_bank, update.message.text, user_data.get('question_filter'))
+    if filter_command is None:
+        return False
+
+    user_data['question_filter'], msg = filter_command
+    send_message(bot, update, msg)
+    logger.debug('"Filter" message was sent')
+    return True
+
+
+def manage_menu_logic(bot, update, user_data, score_board, question_bank):
     """Manage menu logic.
 
     :param bot: tg bot object
     :param update: event with update tg object
     :param user_data: users data which tg must remember. Dict-like interface
+    :param score_board: ScoreBoard object
+    :param question_bank: questions DB object
     :return: number of next action for conversation handler
     """
+    if choose_filter(bot, update, user_data, question_bank):
+        return Buttons.MENU
+
     if update.message.text == 'Новый вопрос':
         logger.debug('User pressed new question')
         return Buttons.QUESTION
@@ -55,60 +114,158 @@ def manage_menu_logic(bot, update, user_data):
         logger.debug('User pressed gave up')
         return Buttons.MENU
 
+    if update.message.text == 'Мой счёт':
+        logger.debug('User pressed score')
+        send_score(bot, update, score_board)
+        return Buttons.MENU
+
 
-def give_question(bot, update, user_data, redis_db, redis_set_name, redis_hash_name):
+def give_question(bot, update, user_data, question_bank, score_board, round_timers=None):
     """Send any question.
 
     :param bot: tg bot object
     :param update: event with update tg object
     :param user_data: users data which tg must remember. Dict-like interface
-    :param redis_db: redis database object
-    :param redis_set_name: name of set in Redis
-    :param redis_hash_name: name of hash in redis
+    :param question_bank: questions DB object
+    :param score_board: ScoreBoard object
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
     :return: number of next action for conversation handler
     """
-    question = redis_db.srandmember(redis_set_name, 1)[0].decode('utf-8')
-    bot.send_message(chat_id=update.message.chat_id, text=question)
+    if choose_filter(bot, update, user_data, question_bank):
+        return Buttons.QUESTION
+
+    if update.message.text == 'Мой счёт':
+        # user didn't ask new question yet
+        send_score(bot, update, score_board)
+        return Buttons.QUESTION
+
+    # questions are not repeated for user until all questions were given
+    fetched_question = question_bank.get_random_question(member=get_member('tg', update.message.from_user.id),
+                                                         question_filter=user_data.get('question_filter'))
+    send_message(bot, update, fetched_question.question)
     logger.debug('Question was sent')
 
-    answer = redis_db.hget(redis_hash_name, question).decode('utf-8')
-    user_data['answer'] = answer
+    # question without deadline has no timer, its answer is always checked
+    user_data['round_deadline'] = None
+    if round_timers is not None:
+        # answer is revealed by worker if user doesn't answer in time
+        user_data['round_deadline'] = round_timers.schedule(
+            get_member('tg', update.message.from_user.id),
+            {'chat_id': update.message.chat_id, 'answer': fetched_question.answer})
+
+    user_data['answer'] = fetched_question.answer
     logger.debug('Answer was wrote')
 
     return Buttons.ANSWER
 
 
-def check_answer(bot, update, user_data):
+def check_answer(bot, update, user_data, answer_matcher, score_board, question_bank, round_timers=None):
     """Check user answer.
 
     :param bot: tg bot object
     :param update: event with update tg object
     :param user_data: users data which tg must remember. Dict-like interface
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param question_bank: questions DB object
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
     :return: number of next action for conversation handler
     """
-    answer = user_data['answer']
+    # answer is missing if user data was lost, but state of conversation was kept
+    answer = user_data.get('answer')
 
     user_answer = update.message.text
 
-    # half correct words is OK
-    if is_correct_answer(user_answer, answer, limit=0.5, answer_handler=normalize_answer):
+    if user_answer == 'Мой счёт':
+        # question is still waiting for answer
+        send_score(bot, update, score_board)
+        return Buttons.ANSWER
+
+    if answer is None:
+        msg = 'Ответ на ваш вопрос уже недоступен.\nХотите новый вопрос? Выберите в меню.'
+        send_message(bot, update, msg)
+        logger.debug('"Answer is unavailable" message was sent')
+        return Buttons.QUESTION
+
+    # timer and answer can't both win, answer was already revealed if timer was fired
+    round_deadline = user_data.pop('round_deadline', None)
+    if (round_deadline is not None and round_timers is not None
+            and not round_timers.cancel(get_member('tg', update.message.from_user.id))):
+        if user_answer == 'Новый вопрос':
+            # timer returned user to choice of question, so the message is handled like in state of question
+            return give_question(bot, update, user_data, question_bank, score_board, round_timers)
+        msg = 'Время на ответ вышло, правильный ответ уже отправлен.\nХотите новый вопрос? Выберите в меню.'
+        send_message(bot, update, msg)
+        logger.debug('"Time is over" message was sent')
+        return Buttons.QUESTION
+
+    if answer_matcher.is_correct(user_answer, answer):
+        count_answer('tg', 'correct')
+        score_board.add_points(get_member('tg', update.message.from_user.id))
         msg = 'Правильно! Полный ответ:\n{}\nХотите новый вопрос? Выберите в меню.'.format(user_data['answer'])
-        bot.send_message(chat_id=update.message.chat_id, text=msg)
+        send_message(bot, update, msg)
         logger.debug('"Correct answer" message was sent')
         return Buttons.QUESTION
 
     if update.message.text == 'Сдаться':
+        count_answer('tg', 'give_up')
         msg = 'Жаль... Правильный ответ:\n{}\nХотите новый вопрос? Выберите в меню.'.format(user_data['answer'])
-        bot.send_message(chat_id=update.message.chat_id, text=msg)
+        send_message(bot, update, msg)
         logger.debug('"Gave up" message was sent')
         return Buttons.QUESTION
 
+    count_answer('tg', 'incorrect')
     msg = 'К сожалению нет! Правильный ответ:\n{}\nХотите новый вопрос? Выберите в меню.'.format(user_data['answer'])
-    bot.send_message(chat_id=update.message.chat_id, text=msg)
+    send_message(bot, update, msg)
     logger.debug('"Mistake" message was sent')
     return Buttons.QUESTION
 
 
+def reveal_answer(member, payload, bot):
+    """Send answer to user who didn't answer in time.
+
+    :param member: str, member of user, see scores.get_member
+    :param payload: dict, payload of timer with keys 'chat_id' and 'answer'
+    :param bot: tg bot object
+    """
+    count_answer('tg', 'timeout')
+    msg = 'Время вышло! Правильный ответ:\n{}\nХотите новый вопрос? Выберите в меню.'.format(payload['answer'])
+    with track_latency(SEND_LATENCY.labels('tg'), 'tg_send'):
+        bot.send_message(chat_id=payload['chat_id'], text=msg)
+    logger.debug('"Time is over" message was sent, member=%s', member)
+
+
+def send_chat_message(bot, chat_id, text):
+    """Send message to chat.
+
+    :param bot: tg bot object
+    :param chat_id: int, id of chat
+    :param text: str, text of message
+    """
+    with track_latency(SEND_LATENCY.labels('tg'), 'tg_send'):
+        bot.send_message(chat_id=chat_id, text=text)
+
+
+def play_in_group(bot, update, group_game, answer_matcher, score_board, group_replies):
+    """Logic of bot in group chat, replies are coalesced.
+
+    :param bot: tg bot object
+    :param update: event with update tg object
+    :param group_game: GroupGame object
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param group_replies: ReplyCoalescer object
+    """
+    message = update.message
+    # commands can be addressed to bot: /start@quiz_bot
+    text = message.text.split('@', 1)[0] if message.text.startswith('/') else message.text
+    msg = handle_group_message('tg', group_game, answer_matcher, score_board, message.chat_id,
+                               message.from_user.id, message.from_user.first_name, text)
+    if msg is not None:
+        group_replies.add(get_member('tg', message.chat_id), msg, partial(send_chat_message, bot, message.chat_id))
+        logger.debug('Reply to group was queued, chat_id=%s', message.chat_id)
+
+
 def stop_quiz(bot, update):
     """Action which executes if user stop quiz.
 
@@ -116,55 +273,268 @@ def stop_quiz(bot, update):
     :param update: event with update tg object
     :return: number of next action for conversation handler
     """
-    bot.send_message(chat_id=update.message.chat_id, text='Викторина остановлена.')
+    send_message(bot, update, 'Викторина остановлена.')
     logger.debug('"Stop" message was sent')
 
     return Buttons.MENU
 
 
-if __name__ == '__main__':
-    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s', level=logging.DEBUG)
+def create_conv_handler(question_bank, answer_matcher, score_board, round_timers=None, persistent=False):
+    """Create handler of bot's states in private chats.
+
+    :param question_bank: questions DB object
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
+    :param persistent: bool, states are kept by persistence of dispatcher
+    :return: ConversationHandler
+    """
+    return ConversationHandler(
+        entry_points=[CommandHandler('start', track_handler('tg', greet_user))],
+        states={
+            Buttons.MENU: [
+                MessageHandler(Filters.text,
+                               track_handler('tg', partial(manage_menu_logic, score_board=score_board,
+                                                           question_bank=question_bank)),
+                               pass_user_data=True)],
+            Buttons.QUESTION: [
+                MessageHandler(Filters.text, track_handler('tg', partial(give_question, question_bank=question_bank,
+                                                           score_board=score_board, round_timers=round_timers)),
+                               pass_user_data=True)],
+            Buttons.ANSWER: [
+                MessageHandler(Filters.text,
+                               track_handler('tg', partial(check_answer, answer_matcher=answer_matcher,
+                                                           score_board=score_board, question_bank=question_bank,
+                                                           round_timers=round_timers)),
+                               pass_user_data=True)],
+        },
+        fallbacks=[CommandHandler('stop', track_handler('tg', stop_quiz))],
+        name='quiz',
+        persistent=persistent
+    )
+
+
+def create_group_handler(group_game, answer_matcher, score_board, group_replies):
+    """Create handler of messages of group chats, it should be added before conversation handler.
+
+    :param group_game: GroupGame object
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param group_replies: ReplyCoalescer object
+    :return: MessageHandler
+    """
+    return MessageHandler(
+        Filters.group & Filters.text,
+        track_handler('tg', partial(play_in_group, group_game=group_game, answer_matcher=answer_matcher,
+                                    score_board=score_board, group_replies=group_replies)))
+
+
+def create_handlers(question_bank, answer_matcher, score_board, round_timers=None, persistent=False, group_game=None,
+                    group_replies=None):
+    """Create handlers of updates in order of adding to dispatcher.
+
+    :param question_bank: questions DB object
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
+    :param persistent: bool, states are kept by persistence of dispatcher
+    :param group_game: GroupGame object or None, if bot doesn't play in groups
+    :param group_replies: ReplyCoalescer object, it is required with group_game
+    :return: list of handlers
+    """
+    # handler of bot's states
+    conv_handler = create_conv_handler(question_bank, answer_matcher, score_board, round_timers=round_timers,
+                                       persistent=persistent)
+    if group_game is None:
+        return [conv_handler]
+    # handler of groups is checked first, conversation handler gets only private chats
+    return [create_group_handler(group_game, answer_matcher, score_board, group_replies), conv_handler]
+
+
+def init_tg_worker(shard, tg_bot_token, handlers, base_url=None, request_kwargs=None, create_persistence=None):
+    """Create bot and dispatcher of worker process.
+
+    :param shard: int, number of worker
+    :param tg_bot_token: str, token of bot
+    :param handlers: list of handlers of updates
+    :param base_url: str or None, address of telegram API
+    :param request_kwargs: dict or None, params of connection to telegram
+    :param create_persistence: function or None, factory of persistence of worker
+    :return: function(update_data), handler of dict of update
+    """
+    bot = Bot(tg_bot_token, base_url=base_url, request=Request(**(request_kwargs or {})))
+    persistence = create_persistence() if create_persistence is not None else None
+    dispatcher = Dispatcher(bot, None, workers=0, persistence=persistence)
+    for handler in handlers:
+        dispatcher.add_handler(handler)
+    logger.debug('Dispatcher of worker %s was initialized', shard)
+
+    def handle_update(update_data):
+        dispatcher.process_update(Update.de_json(update_data, bot))
+
+    return handle_update
+
+
+def run_sharded_polling(bot, workers, backoff, timeout=30, recorder=None):
+    """Get updates by long polling and put them to workers.
+
+    Updates of one chat are handled by one worker, so conversation states of chat are kept by one process.
+
+    :param bot: tg bot object
+    :param workers: ShardedWorkers object
+    :param backoff: Backoff object, delays of polling after errors
+    :param timeout: int, seconds of long polling
+    :param recorder: EventRecorder object or None, if updates are not captured
+    """
+    bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout)
+        except TelegramError:
+            delay = backoff.failed()
+            logger.exception('Error in polling, next attempt in %.1f sec', delay)
+            backoff.sleep()
+            continue
+        backoff.reset()
+
+        for update in updates:
+            offset = update.update_id + 1
+            if recorder is not None:
+                recorder.record('tg', update)
+            chat = update.effective_chat
+            workers.put(chat.id if chat is not None else update.update_id, update.to_dict())
+
 
+if __name__ == '__main__':
     dotenv.load_dotenv()
+    # DEBUG logs every step of every update, use INFO under load and watch metrics
+    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s',
+                        level=os.getenv('LOG_LEVEL', default='DEBUG').upper())
+
     tg_bot_token = os.getenv('TG_BOT_TOKEN')
     proxy = os.getenv('PROXY')  # Fill in .env if you are from mother Russia
     redis_db_address = os.getenv('REDIS_DB_ADDRESS')
     redis_db_port = os.getenv('REDIS_DB_PORT')
     redis_db_password = os.getenv('REDIS_DB_PASSWORD')
-    redis_set_of_questions_name = os.getenv('REDIS_SET_OF_QUESTIONS_NAME', default='QuestionAnswerSet')
+    redis_max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', default=50))
+    redis_socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', default=5))
+    redis_health_check_interval = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', default=30))
+    reconnect_max_delay = float(os.getenv('RECONNECT_MAX_DELAY', default=30))
     redis_hash_of_questions_and_answers_name = os.getenv('REDIS_HASH_OF_QUESTIONS_AND_ANSWERS_NAME',
                                                          default='QuestionAnswerHash')
+    redis_generation_key_name = os.getenv('REDIS_QUESTIONS_GENERATION_KEY_NAME', default='QuestionBankGeneration')
+    generation_refresh_interval = float(os.getenv('QUESTIONS_GENERATION_REFRESH_INTERVAL', default=5))
+    redis_hash_question_schedules_name = os.getenv('REDIS_HASH_QUESTION_SCHEDULES_NAME', default='QuestionSchedule')
+    question_cache_enabled = os.getenv('QUESTION_CACHE', default='false').lower() in ('1', 'true', 'yes')
+    questions_snapshot_path = os.getenv('QUESTIONS_SNAPSHOT_PATH')
+    answer_matcher_name = os.getenv('ANSWER_MATCHER', default='words')
+    tg_runtime = os.getenv('TG_RUNTIME', default='polling')
+    tg_webhook_url = os.getenv('TG_WEBHOOK_URL')
+    tg_api_base_url = os.getenv('TG_API_BASE_URL')
+    webhook_host = os.getenv('WEBHOOK_HOST', default='0.0.0.0')
+    webhook_port = int(os.getenv('PORT', default=8080))
+    webhook_workers = int(os.getenv('WEBHOOK_WORKERS', default=4))
+    tg_persistence = os.getenv('TG_PERSISTENCE', default='redis')
+    tg_state_cache_ttl = float(os.getenv('TG_STATE_CACHE_TTL', default=60))
+    scores_top_cache_ttl = float(os.getenv('SCORES_TOP_CACHE_TTL', default=5))
+    metrics_port = int(os.getenv('METRICS_PORT', default=0))
+    round_time = float(os.getenv('ROUND_TIME', default=0))
+    round_timers_poll_interval = float(os.getenv('ROUND_TIMERS_POLL_INTERVAL', default=0.5))
+    worker_processes = int(os.getenv('WORKER_PROCESSES', default=0))
+    worker_queue_size = int(os.getenv('WORKER_QUEUE_SIZE', default=1000))
+    group_games_enabled = os.getenv('GROUP_GAMES', default='false').lower() in ('1', 'true', 'yes')
+    group_replies_interval = float(os.getenv('GROUP_REPLIES_INTERVAL', default=3))
+    events_capture_path = os.getenv('EVENTS_CAPTURE_PATH')
+    events_capture_max_bytes = int(os.getenv('EVENTS_CAPTURE_MAX_BYTES', default=50 * 1024 * 1024))
+    events_capture_backup_count = int(os.getenv('EVENTS_CAPTURE_BACKUP_COUNT', default=3))
     logger.debug('.env was read')
 
-    redis_db = redis.Redis(host=redis_db_address, port=redis_db_port, password=redis_db_password)
+    redis_db = create_redis(redis_db_address, redis_db_port, redis_db_password, max_connections=redis_max_connections,
+                            socket_timeout=redis_socket_timeout, health_check_interval=redis_health_check_interval,
+                            backoff_max_delay=reconnect_max_delay)
+    wait_for_redis(redis_db)
     logger.debug('Got DB connection')
-
-    # handler of bot's states
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', greet_user)],
-        states={
-            Buttons.MENU: [MessageHandler(Filters.text, manage_menu_logic, pass_user_data=True)],
-            Buttons.QUESTION: [
-                MessageHandler(Filters.text, partial(give_question, redis_db=redis_db), pass_user_data=True)],
-            Buttons.ANSWER: [MessageHandler(Filters.text, check_answer, pass_user_data=True)],
-        },
-        fallbacks=[CommandHandler('stop', stop_quiz)]
-    )
-    logger.debug('Conversation handler was initialized')
+    # half correct words is OK
+    answer_matcher = get_answer_matcher(answer_matcher_name, limit=0.5)
+    question_cache = None
+    if question_cache_enabled:
+        # answers are prepared for checking together with loading of questions
+        question_cache = QuestionCache(redis_db, redis_hash_of_questions_and_answers_name,
+                                       snapshot_path=questions_snapshot_path, answer_matcher=answer_matcher)
+    question_bank = QuestionBank(redis_db, redis_hash_of_questions_and_answers_name,
+                                 generation_key_name=redis_generation_key_name,
+                                 refresh_interval=generation_refresh_interval,
+                                 schedule_hash_name=redis_hash_question_schedules_name,
+                                 question_cache=question_cache)
+    # texts of questions are served locally from the first question
+    question_bank.preload()
+    score_board = ScoreBoard(redis_db, top_cache_ttl=scores_top_cache_ttl)
+    round_timers = RoundTimerQueue(redis_db, 'RoundTimers:tg', round_time=round_time) if round_time else None
+    create_persistence = None
+    if tg_persistence == 'redis':
+        create_persistence = partial(RedisPersistence, redis_db, cache_ttl=tg_state_cache_ttl)
+    sharded = bool(worker_processes) and tg_runtime == 'polling'
+    # in sharded mode every worker has its own persistence
+    persistence = create_persistence() if create_persistence is not None and not sharded else None
+
+    group_game = GroupGame(redis_db, question_bank) if group_games_enabled else None
+    # thread of coalescer is started by the first reply, so it is started in worker process
+    group_replies = ReplyCoalescer(interval=group_replies_interval)
+    handlers = create_handlers(question_bank, answer_matcher, score_board, round_timers=round_timers,
+                               persistent=create_persistence is not None, group_game=group_game,
+                               group_replies=group_replies)
+    logger.debug('Handlers were initialized')
 
     request_kwargs = None
     if proxy:
         request_kwargs = {'proxy_url': proxy}
         logger.debug(f'Using proxy - {proxy}')
-    updater = Updater(token=tg_bot_token, request_kwargs=request_kwargs)
+
+    workers = None
+    if sharded:
+        # workers are forked before start of threads
+        init_worker = partial(init_tg_worker, tg_bot_token=tg_bot_token, handlers=handlers,
+                              base_url=tg_api_base_url, request_kwargs=request_kwargs,
+                              create_persistence=create_persistence)
+        workers = ShardedWorkers(init_worker, workers=worker_processes, queue_size=worker_queue_size,
+                                 metrics_port=metrics_port)
+    updater = Updater(token=tg_bot_token, base_url=tg_api_base_url, request_kwargs=request_kwargs,
+                      persistence=persistence)
     logger.debug('Connection with TG was established')
 
-    # add handlers
-    updater.dispatcher.add_handler(conv_handler)
-    logger.debug('Conversation handler was added to updater')
+    recorder = None
+    if events_capture_path:
+        recorder = EventRecorder(events_capture_path, max_bytes=events_capture_max_bytes,
+                                 backup_count=events_capture_backup_count)
+
+    if workers is None:
+        # add handlers
+        for handler in handlers:
+            updater.dispatcher.add_handler(handler)
+        if recorder is not None:
+            # group of recorder is checked before others and doesn't stop handling
+            updater.dispatcher.add_handler(TypeHandler(Update, recorder.record_update), group=-1)
+        logger.debug('Handlers were added to updater')
+
+    if round_timers is not None:
+        RoundTimerWorker(round_timers, partial(reveal_answer, bot=updater.bot),
+                         poll_interval=round_timers_poll_interval)
+
+    if tg_runtime == 'webhook':
+        # path with token is known only for telegram
+        webhook_path = f'/telegram/{tg_bot_token}'
+        if tg_webhook_url:
+            updater.bot.set_webhook(url=f'{tg_webhook_url.rstrip("/")}{webhook_path}')
+            logger.debug('Webhook was set')
+        routes = {webhook_path: TelegramWebhookRoute(updater.bot, updater.dispatcher)}
+        run_webhook_server(routes, host=webhook_host, port=webhook_port, workers=webhook_workers)
 
     # If your error handling consists in writing errors to the log,
     # then you don't need to write a some error handler,
     # telegram updater logger will write them instead you
     # and the application will start working again
+    start_metrics_server(metrics_port)
+    if workers is not None:
+        run_sharded_polling(updater.bot, workers, Backoff(max_delay=reconnect_max_delay), recorder=recorder)
     updater.start_polling()
@@ -0,0 +1,247 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from collections.abc import MutableMapping
+
+from telegram.ext import BasePersistence
+
+logger = logging.getLogger(__name__)
+
+
+class RedisBackedDict(defaultdict):
+    """Dict-like view of redis hash with local cache.
+
+    Values are read from Redis only if they are not in cache or cached value is older than :cache_ttl:.
+    Changes are not written to Redis by this object, persistence writes them by batches.
+    It is defaultdict, because telegram Dispatcher accepts only defaultdict as user_data and chat_data,
+    storage of dict is not used, all methods of mapping work with cache and Redis.
+
+    :param persistence: RedisPersistence object
+    :param hash_name: str, name of hash in redis
+    :param default_factory: function or None, factory of value for unknown key like in defaultdict
+    """
+
+    # methods of dict would read its empty storage, methods of MutableMapping use methods below
+    get = MutableMapping.get
+    keys = MutableMapping.keys
+    items = MutableMapping.items
+    values = MutableMapping.values
+    pop = MutableMapping.pop
+    popitem = MutableMapping.popitem
+    setdefault = MutableMapping.setdefault
+    update = MutableMapping.update
+    clear = MutableMapping.clear
+
+    def __init__(self, persistence, hash_name, default_factory=None):
+        super().__init__(default_factory)
+        self.persistence = persistence
+        self.hash_name = hash_name
+        self.cache = {}
+        self.lock = threading.RLock()
+
+    def load(self, key):
+        """Get value from write queue or from Redis.
+
+        :param key: key of dict
+        :return: value or KeyError if key is unknown
+        """
+        field = json.dumps(key)
+        found, value = self.persistence.get_pending(self.hash_name, field)
+        if not found:
+            encoded_value = self.persistence.redis_db.hget(self.hash_name, field)
+            value = None if encoded_value is None else json.loads(encoded_value)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __getitem__(self, key):
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None and cached[1] > time.monotonic():
+                return cached[0]
+
+            try:
+                value = self.load(key)
+            except KeyError:
+                if self.default_factory is None:
+                    self.cache.pop(key, None)
+                    raise
+                value = self.default_factory()
+
+            self.cache[key] = (value, time.monotonic() + self.persistence.cache_ttl)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.cache[key] = (value, time.monotonic() + self.persistence.cache_ttl)
+        self.persistence.write(self.hash_name, json.dumps(key), value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+        self.persistence.write(self.hash_name, json.dumps(key), None)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        # only cached keys, full hash can be very big
+        with self.lock:
+            return iter(list(self.cache))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.cache)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.hash_name!r})'
+
+    def forget(self, key):
+        """Remove value from cache, it is read from Redis at the next access.
+
+        :param key: key of dict
+        """
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def evict_expired(self):
+        """Remove expired values from cache."""
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, (_, expires_at) in self.cache.items() if expires_at <= now]:
+                del self.cache[key]
+
+
+class RedisPersistence(BasePersistence):
+    """Persistence of telegram conversations and user data in Redis.
+
+    State survives restarts and is shared between processes.
+    Changes are written by background thread by batches (one pipeline per :flush_interval:),
+    values are read through local cache. If one user can be served by several processes at the same time,
+    use small :cache_ttl: or call forget_cached before and flush after every update (webhook runtime does it).
+
+    :param redis_db: object of connection redis db
+    :param prefix: str, prefix of names of hashes in redis
+    :param cache_ttl: float, seconds while value is kept in local cache
+    :param flush_interval: float, seconds between writes of changes to Redis
+    """
+
+    def __init__(self, redis_db, prefix='TgBot', cache_ttl=60, flush_interval=0.5):
+        super().__init__(store_user_data=True, store_chat_data=True)
+        self.redis_db = redis_db
+        self.prefix = prefix
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.user_data = RedisBackedDict(self, f'{prefix}:user_data', default_factory=dict)
+        self.chat_data = RedisBackedDict(self, f'{prefix}:chat_data', default_factory=dict)
+        self.conversations = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        threading.Thread(target=self.run, name='RedisPersistence', daemon=True).start()
+        self.logger.debug('Class params were initialized')
+
+    def write(self, hash_name, field, value):
+        """Add change to write queue.
+
+        :param hash_name: str, name of hash in redis
+        :param field: str, field of hash
+        :param value: value which can be dumped to JSON or None, if field should be deleted
+        """
+        with self.pending_lock:
+            self.pending[(hash_name, field)] = None if value is None else json.dumps(value)
+
+    def get_pending(self, hash_name, field):
+        """Get value which is not written yet.
+
+        :param hash_name: str, name of hash in redis
+        :param field: str, field of hash
+        :return: tuple, (True if value is in write queue, value)
+        """
+        with self.pending_lock:
+            if (hash_name, field) not in self.pending:
+                return False, None
+            encoded_value = self.pending[(hash_name, field)]
+        return True, None if encoded_value is None else json.loads(encoded_value)
+
+    def flush(self):
+        """Write all changes from queue to Redis by one pipeline."""
+        # flushes go one by one, otherwise older batch could be written after newer one
+        with self.flush_lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+
+            pipe = self.redis_db.pipeline(transaction=False)
+            for (hash_name, field), encoded_value in pending.items():
+                if encoded_value is None:
+                    pipe.hdel(hash_name, field)
+                else:
+                    pipe.hset(hash_name, field, encoded_value)
+            try:
+                pipe.execute()
+            except Exception:
+                # changes which were not written are returned to queue if there are no newer changes
+                with self.pending_lock:
+                    for key, encoded_value in pending.items():
+                        self.pending.setdefault(key, encoded_value)
+                raise
+        self.logger.debug('%s changes were written', len(pending))
+
+    def forget_cached(self, user_id=None, chat_id=None):
+        """Remove state of user and chat from cache, it is read from Redis at the next access.
+
+        :param user_id: int or None, id of user
+        :param chat_id: int or None, id of chat
+        """
+        if user_id is not None:
+            self.user_data.forget(user_id)
+        if chat_id is not None:
+            self.chat_data.forget(chat_id)
+        if user_id is not None and chat_id is not None:
+            # key of conversation of ConversationHandler with per_chat and per_user
+            for conversations in self.conversations.values():
+                conversations.forget((chat_id, user_id))
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception('Changes were not written')
+            for backed_dict in [self.user_data, self.chat_data, *self.conversations.values()]:
+                backed_dict.evict_expired()
+
+    def get_user_data(self):
+        return self.user_data
+
+    def get_chat_data(self):
+        return self.chat_data
+
+    def get_conversations(self, name):
+        if name not in self.conversations:
+            self.conversations[name] = RedisBackedDict(self, f'{self.prefix}:conversations:{name}')
+        return self.conversations[name]
+
+    def update_user_data(self, user_id, data):
+        self.user_data[user_id] = data
+
+    def update_chat_data(self, chat_id, data):
+        self.chat_data[chat_id] = data
+
+    def update_conversation(self, name, key, new_state):
+        conversations = self.get_conversations(name)
+        if new_state is None:
+            del conversations[key]
+        else:
+            conversations[key] = new_state
+
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import struct
+
+import dotenv
+
+from connections import create_redis, wait_for_redis
+
+logger = logging.getLogger(__name__)
+
+USER_STATE_VERSION = 1
+# version 2 is version 1 with name of filter of questions after packed fields
+USER_STATE_WITH_FILTER_VERSION = 2
+# version, flags, generation, question id. The same format is used by Lua script in question_bank
+USER_STATE_FORMAT = struct.Struct('>BBII')
+GOT_QUESTION_FLAG = 1
+# timer of answer was started for question of user
+ROUND_TIMER_FLAG = 2
+
+# KEYS[1] - hash of users, ARGV[1] - user id, ARGV[2] - old value, ARGV[3] - new value
+# value is replaced only if it wasn't changed by bot after reading
+REPLACE_IF_EQUAL_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def encode_user_info(user_info):
+    """Pack user info to 10 bytes: version, flags, generation of questions bank and id of question.
+
+    Name of filter of questions is added after 10 bytes if user chose it.
+
+    :param user_info: dict, user info with keys 'got_q', 'g', 'id' and optional 'f' and 't'
+    :return: bytes
+    """
+    flags = GOT_QUESTION_FLAG if user_info['got_q'] else 0
+    if user_info.get('t'):
+        flags |= ROUND_TIMER_FLAG
+    question_filter = user_info.get('f')
+    if question_filter:
+        return USER_STATE_FORMAT.pack(USER_STATE_WITH_FILTER_VERSION, flags, user_info['g'] or 0,
+                                      user_info['id'] or 0) + question_filter.encode('utf-8')
+    return USER_STATE_FORMAT.pack(USER_STATE_VERSION, flags, user_info['g'] or 0, user_info['id'] or 0)
+
+
+def decode_user_info(encoded_user_info):
+    """Unpack user info, old JSON format is supported too.
+
+    :param encoded_user_info: bytes, user info from Redis
+    :return: dict, user info with keys 'got_q', 'g', 'id', 'f', 't'
+    """
+    if encoded_user_info.startswith(b'{'):
+        user_info = json.loads(encoded_user_info.decode('utf-8'))
+        if 'id' not in user_info:
+            # user info before integer ids of questions, question can't be found
+            return {'got_q': False, 'g': None, 'id': None, 'f': None, 't': False}
+        user_info.setdefault('f', None)
+        user_info.setdefault('t', False)
+        return user_info
+
+    version, flags, generation, question_id = USER_STATE_FORMAT.unpack_from(encoded_user_info)
+    if version not in (USER_STATE_VERSION, USER_STATE_WITH_FILTER_VERSION):
+        raise ValueError(f'Unknown version of user info: {version}')
+
+    question_filter = None
+    if version == USER_STATE_WITH_FILTER_VERSION:
+        question_filter = encoded_user_info[USER_STATE_FORMAT.size:].decode('utf-8')
+
+    got_question = bool(flags & GOT_QUESTION_FLAG)
+    return {
+        'got_q': got_question,
+        'g': generation if got_question else None,
+        'id': question_id if got_question else None,
+        'f': question_filter,
+        't': got_question and bool(flags & ROUND_TIMER_FLAG),
+    }
+
+
+def migrate_users(redis_db, name_of_hash, batch_size=1000):
+    """Convert all JSON user info in hash to binary format.
+
+    Bots can work during converting, user info which was changed after reading is not replaced.
+
+    :param redis_db: redis database object
+    :param name_of_hash: str, name of hash of users in redis
+    :param batch_size: int, count of users which are converted by one pipeline
+    :return: int, count of converted users
+    """
+    replace_if_equal = redis_db.register_script(REPLACE_IF_EQUAL_SCRIPT)
+    converted = 0
+    pipe = redis_db.pipeline(transaction=False)
+    queued = 0
+
+    for user_id, encoded_user_info in redis_db.hscan_iter(name_of_hash, count=batch_size):
+        if not encoded_user_info.startswith(b'{'):
+            continue
+
+        new_encoded_user_info = encode_user_info(decode_user_info(encoded_user_info))
+        replace_if_equal(keys=[name_of_hash], args=[user_id, encoded_user_info, new_encoded_user_info], client=pipe)
+        queued += 1
+
+        if queued == batch_size:
+            converted += sum(pipe.execute())
+            queued = 0
+            logger.debug(f'{converted} users were converted')
+
+    converted += sum(pipe.execute())
+    return converted
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s', level=logging.DEBUG)
+
+    dotenv.load_dotenv()
+    redis_db_address = os.getenv('REDIS_DB_ADDRESS')
+    redis_db_port = os.getenv('REDIS_DB_PORT')
+    redis_db_password = os.getenv('REDIS_DB_PASSWORD')
+    redis_max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', default=50))
+    redis_socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', default=5))
+    redis_health_check_interval = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', default=30))
+    reconnect_max_delay = float(os.getenv('RECONNECT_MAX_DELAY', default=30))
+    redis_hash_users_info_name = os.getenv('REDIS_HASH_USERS_INFO_NAME', default='UsersHash')
+    redis_batch_size = int(os.getenv('REDIS_BATCH_SIZE', default=1000))
+    logger.debug('.env was read')
+
+    redis_db = create_redis(redis_db_address, redis_db_port, redis_db_password, max_connections=redis_max_connections,
+                            socket_timeout=redis_socket_timeout, health_check_interval=redis_health_check_interval,
+                            backoff_max_delay=reconnect_max_delay)
+    wait_for_redis(redis_db)
+    converted = migrate_users(redis_db, redis_hash_users_info_name, batch_size=redis_batch_size)
+    logger.debug(f'{converted} users were converted')
+    redis_db.close()
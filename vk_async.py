@@ -0,0 +1,232 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from vk_api.longpoll import Event, VkLongpollMode
+from vk_api.vk_api import VkApiMethod
+
+from connections import Backoff
+from vk_dispatcher import DispatchingVkApi
+
+logger = logging.getLogger(__name__)
+
+VK_API_URL = 'https://api.vk.com/method/'
+VK_API_VERSION = '5.92'
+
+
+class VkAsyncApiError(Exception):
+    """Error which VK API returned."""
+
+    def __init__(self, method, error):
+        self.method = method
+        self.error = error
+        self.code = error.get('error_code')
+        super().__init__(f'[{self.code}] {error.get("error_msg")} (method={method})')
+
+
+class AsyncVkApi:
+    """Non-blocking client of VK API.
+
+    :param http_session: aiohttp.ClientSession
+    :param token: str, VK app token
+    :param api_version: str, version of VK API
+    """
+
+    def __init__(self, http_session, token, api_version=VK_API_VERSION):
+        self.http_session = http_session
+        self.token = token
+        self.api_version = api_version
+
+    async def method(self, method, values=None):
+        """Call method of VK API.
+
+        :param method: str, name of method, for example 'messages.send'
+        :param values: dict or None, params of method
+        :return: response of method
+        """
+        params = dict(values or {})
+        params['access_token'] = self.token
+        params['v'] = self.api_version
+
+        async with self.http_session.post(VK_API_URL + method, data=params) as response:
+            response_data = await response.json()
+
+        if 'error' in response_data:
+            raise VkAsyncApiError(method, response_data['error'])
+        return response_data['response']
+
+
+class ThreadSafeVkSession:
+    """Blocking facade of AsyncVkApi for handlers which are executed in threads.
+
+    Requests are executed in event loop, so thread waits only for its own request.
+
+    Usage:
+        vk_api = VkApiMethod(ThreadSafeVkSession(async_vk_api, loop))
+        vk_api.messages.send(...)
+
+    :param async_vk_api: AsyncVkApi object
+    :param loop: event loop where async_vk_api works
+    """
+
+    def __init__(self, async_vk_api, loop):
+        self.async_vk_api = async_vk_api
+        self.loop = loop
+
+    def method(self, method, values=None):
+        future = asyncio.run_coroutine_threadsafe(self.async_vk_api.method(method, values), self.loop)
+        return future.result()
+
+
+class AsyncVkLongPoll:
+    """Non-blocking VK long poll.
+
+    :param async_vk_api: AsyncVkApi object
+    :param wait: int, seconds of waiting of events by one request
+    :param mode: int, flags of long poll mode
+    :param backoff: Backoff object or None, delays between attempts after network errors
+    """
+
+    def __init__(self, async_vk_api, wait=25, mode=sum(VkLongpollMode), backoff=None):
+        self.async_vk_api = async_vk_api
+        self.wait = wait
+        self.mode = mode
+        self.backoff = backoff or Backoff()
+        self.url = None
+        self.key = None
+        self.ts = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def update_longpoll_server(self, update_ts=True):
+        """Get new long poll server and key.
+
+        :param update_ts: bool, get new ts too
+        """
+        response = await self.async_vk_api.method('messages.getLongPollServer', {'lp_version': '3'})
+        self.key = response['key']
+        self.url = f'https://{response["server"]}'
+        if update_ts:
+            self.ts = response['ts']
+        self.logger.debug('Got long poll server')
+
+    async def check(self):
+        """Get new events from long poll server.
+
+        :return: list of Event
+        """
+        params = {'act': 'a_check', 'key': self.key, 'ts': self.ts, 'wait': self.wait, 'mode': self.mode,
+                  'version': 3}
+        timeout = aiohttp.ClientTimeout(total=self.wait + 10)
+        async with self.async_vk_api.http_session.get(self.url, params=params, timeout=timeout) as response:
+            response_data = await response.json(content_type=None)
+
+        failed = response_data.get('failed')
+        if failed is None:
+            self.ts = response_data['ts']
+            return [Event(raw_event) for raw_event in response_data['updates']]
+
+        if failed == 1:
+            self.ts = response_data['ts']
+        elif failed == 2:
+            await self.update_longpoll_server(update_ts=False)
+        else:
+            await self.update_longpoll_server()
+        return []
+
+    async def listen(self):
+        """Listen long poll server.
+
+        Network errors and errors of VK API are retried with backoff, session is not recreated.
+
+        :return: async generator of Event
+        """
+        while True:
+            try:
+                if self.url is None:
+                    await self.update_longpoll_server()
+                events = await self.check()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, VkAsyncApiError):
+                delay = self.backoff.failed()
+                self.logger.exception('Long poll request failed, next attempt in %.1f sec', delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self.backoff.reset()
+            for event in events:
+                yield event
+
+
+class ConcurrentEventProcessor:
+    """Executor of blocking handlers of events with limited concurrency.
+
+    Events of one user are handled one by one in order of receiving,
+    events of different users are handled concurrently. Event takes slot of handler only when previous events
+    of its user are handled, so events of busy user don't take slots of other users.
+
+    :param handler: function(event), blocking handler of event
+    :param max_concurrency: int, max count of events which are handled at the same time
+    :param max_pending: int, max count of events which are handled or waiting at the same time
+    """
+
+    def __init__(self, handler, max_concurrency=16, max_pending=1000):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.pending = asyncio.Semaphore(max_pending)
+        self.user_locks = {}
+        self.user_pending = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def submit(self, event, user_id):
+        """Start handling of event. Waits if :max_pending: events are already handled or waiting.
+
+        :param event: event object
+        :param user_id: id of user, events with the same id are handled in order
+        """
+        await self.pending.acquire()
+        if user_id not in self.user_locks:
+            self.user_locks[user_id] = asyncio.Lock()
+            self.user_pending[user_id] = 0
+        self.user_pending[user_id] += 1
+        asyncio.ensure_future(self.handle(event, user_id))
+
+    async def handle(self, event, user_id):
+        loop = asyncio.get_event_loop()
+        try:
+            # lock is fair, so events of user are handled in order of submitting
+            async with self.user_locks[user_id]:
+                async with self.slots:
+                    await loop.run_in_executor(self.executor, self.handler, event)
+        except Exception:
+            self.logger.exception('Error in handling of event, user_id=%s', user_id)
+        finally:
+            self.user_pending[user_id] -= 1
+            if not self.user_pending[user_id]:
+                del self.user_pending[user_id]
+                del self.user_locks[user_id]
+            self.pending.release()
+
+
+async def run_async_bot(vk_app_token, handle_event, dispatcher, max_concurrency=16, backoff_max_delay=30):
+    """Listen VK long poll and handle events concurrently.
+
+    :param vk_app_token: str, VK app token
+    :param handle_event: function(event, vk_api), blocking handler of event
+    :param dispatcher: VkMessageDispatcher object, messages are sent by it, it is shared by restarts of runtime
+    :param max_concurrency: int, max count of events which are handled at the same time
+    :param backoff_max_delay: float, max seconds between attempts of long poll requests after errors
+    """
+    loop = asyncio.get_event_loop()
+    async with aiohttp.ClientSession() as http_session:
+        async_vk_api = AsyncVkApi(http_session, vk_app_token)
+        blocking_vk_api = VkApiMethod(ThreadSafeVkSession(async_vk_api, loop))
+        vk_api = DispatchingVkApi(blocking_vk_api, dispatcher)
+        longpoll = AsyncVkLongPoll(async_vk_api, backoff=Backoff(max_delay=backoff_max_delay))
+        processor = ConcurrentEventProcessor(lambda event: handle_event(event, vk_api), max_concurrency)
+        logger.debug('Async VK long poll was initialized')
+
+        async for event in longpoll.listen():
+            if getattr(event, 'to_me', False):
+                # events of one conversation are handled in order, peer_id of private chat is user_id
+                await processor.submit(event, getattr(event, 'peer_id', event.user_id))
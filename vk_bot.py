@@ -1,70 +1,149 @@
-import random
+import asyncio
 import logging
 import os
-import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
 
 import dotenv
 import vk_api as vk
 from vk_api.longpoll import VkLongPoll, VkEventType
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
-import redis
 
-from common_functions import is_correct_answer, normalize_answer
+from common_functions import get_answer_matcher
+from connections import Backoff, create_redis, wait_for_redis
+from event_capture import EventRecorder
+from group_games import GroupGame, ReplyCoalescer, handle_group_message
+from metrics import SEND_LATENCY, count_answer, start_metrics_server, track_event, track_latency
+from question_bank import QuestionBank, handle_filter_command
+from question_cache import QuestionCache
+from round_timers import RoundTimerQueue, RoundTimerWorker
+from scores import ScoreBoard, get_member
+from sharding import ShardedWorkers
+from user_state import decode_user_info, encode_user_info
+from vk_async import run_async_bot
+from vk_dispatcher import call_after_sent, create_dispatching_api
+from vk_idempotency import EventDeduplicator, get_random_id
+from webhooks import VkCallbackRoute, run_webhook_server
 
 logger = logging.getLogger(__name__)
 
+# peer_id of conversations starts from this number
+CHAT_PEER_ID_START = 2000000000
+# messages of buttons in conversations start with mention of community: "[club1|Bot] Новый вопрос"
+MENTION_RE = re.compile(r'^\[club\d+\|[^\]]*\][,\s]*')
+
 
 class VkSessionUsersCondition:
-    """User DB in Redis.
+    """User DB in Redis with local cache.
 
     Usage:
         For queries economy purpose
         1. ALWAYS get user_info
         2. Do other operations
+        3. Save user, all changes are written by one query
+
+    Cache keeps not more than :cache_size: users (least recently used are removed)
+    and user info is reread from Redis if it is older than :cache_ttl:.
 
     :param redis_db: object of connection redis db
     :param name_of_hash: str, name of your hash in redis
+    :param question_bank: questions DB object
+    :param cache_size: int, max count of users in cache
+    :param cache_ttl: float, seconds while user info is kept in cache
     """
 
-    def __init__(self, redis_db, name_of_hash):
+    def __init__(self, redis_db, name_of_hash, question_bank, cache_size=10000, cache_ttl=30):
         # Template of info about new user
-        self.new_user_template = json.dumps({
+        self.new_user_template = {
             'got_q': False,  # Is user got question
-            'q': '',  # text of question
-            'a': ''  # text of answer
-        })
+            'g': None,  # generation of questions bank
+            'id': None,  # id of question
+            'f': None,  # filter of questions, see question_bank.get_filter_name
+            't': False  # Is timer of answer started for question
+        }
         self.redis_db = redis_db
         self.name_of_hash = name_of_hash
+        self.question_bank = question_bank
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # user_id -> [user_info, time of expiration, is changed]
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.debug('Class params were initialized')
 
+    def cache_user(self, user_id, user_info, dirty):
+        """Put user info to cache.
+
+        :param user_id: id of user in VK
+        :param user_info: dict, user info
+        :param dirty: bool, True if user info should be written to Redis
+        """
+        with self.cache_lock:
+            cached = self.cache.get(user_id)
+            if cached is not None:
+                dirty = dirty or cached[2]
+            self.cache[user_id] = [user_info, time.monotonic() + self.cache_ttl, dirty]
+            self.cache.move_to_end(user_id)
+
+            while len(self.cache) > self.cache_size:
+                evicted_user_id, (evicted_user_info, _, evicted_dirty) = self.cache.popitem(last=False)
+                if evicted_dirty:
+                    self.redis_db.hset(self.name_of_hash, evicted_user_id, encode_user_info(evicted_user_info))
+
     def add_or_update_user(self, user_id, user_info=None):
         """Add new user or update existing user if he got answer.
 
+        User is changed only in cache, use save_user to write changes.
+
         :param user_id: id of user in VK
         :param user_info: dict or None, if don't need template
         """
         if user_info is None:
-            self.redis_db.hset(self.name_of_hash, user_id, self.new_user_template)
-            self.logger.debug(f'User created, user_id={user_id}')
+            self.cache_user(user_id, dict(self.new_user_template), dirty=True)
+            self.logger.debug('User created, user_id=%s', user_id)
             return
 
-        dumped_user_info = json.dumps(user_info)
-        self.redis_db.hset(self.name_of_hash, user_id, dumped_user_info)
-        self.logger.debug(f'User updated, user_id={user_id}')
+        self.cache_user(user_id, user_info, dirty=True)
+        self.logger.debug('User updated, user_id=%s', user_id)
         return
 
+    def save_user(self, user_id):
+        """Write user info to Redis if it was changed.
+
+        :param user_id: id of user in VK
+        """
+        with self.cache_lock:
+            cached = self.cache.get(user_id)
+            if cached is None or not cached[2]:
+                return
+            cached[2] = False
+            user_info = cached[0]
+
+        self.redis_db.hset(self.name_of_hash, user_id, encode_user_info(user_info))
+        self.logger.debug('User saved, user_id=%s', user_id)
+
     def get_user_info(self, user_id):
-        """Get user info by user_id, convert to JSON if user in db.
+        """Get user info by user_id from cache or from Redis.
 
         :param user_id: id of user in VK
-        :return: bool, True if user found
+        :return: dict or None, None if user is new
         """
-        user_info = self.redis_db.hget(self.name_of_hash, user_id)
+        with self.cache_lock:
+            cached = self.cache.get(user_id)
+            if cached is not None and (cached[2] or cached[1] > time.monotonic()):
+                self.cache.move_to_end(user_id)
+                return cached[0]
 
-        if user_info is not None:
-            user_info = json.loads(user_info).decode('utf-8')
+        user_info = self.redis_db.hget(self.name_of_hash, user_id)
+        if user_info is None:
+            return None
 
+        user_info = decode_user_info(user_info)
+        self.cache_user(user_id, user_info, dirty=False)
         return user_info
 
     def is_user_got_question(self, user_id, user_info):
@@ -95,28 +174,59 @@ class VkSessionUsersCondition:
             return None
 
         if user_info['got_q']:
-            answer = user_info['a']
-            self.add_or_update_user(user_id)
+            answer = self.question_bank.get_answer(user_info['g'], user_info['id'])
+            # chosen filter of questions is kept
+            self.add_or_update_user(user_id, dict(self.new_user_template, f=user_info['f']))
             return answer
         return None
 
-    def add_answer_to_user(self, user_id, user_info, question, answer):
-        """Update user with new answer.
+    def set_user_filter(self, user_id, question_filter):
+        """Change filter of questions of user.
+
+        User is changed only in cache, use save_user to write changes.
 
         :param user_id: id of user in VK
-        :param user_info: dict or None, if don't need template
-        :param question: str, user question
-        :param answer: str, correct answer
+        :param question_filter: str or None, name of filter, see question_bank.get_filter_name
         """
+        user_info = self.get_user_info(user_id) or self.new_user_template
+        self.add_or_update_user(user_id, dict(user_info, f=question_filter))
 
-        if user_info is None:
-            self.add_or_update_user(user_id)
+    def mark_round_timer(self, user_id):
+        """Remember that timer of answer was started for question of user.
+
+        User is changed only in cache, use save_user to write changes.
+
+        :param user_id: id of user in VK
+        """
+        self.add_or_update_user(user_id, dict(self.get_user_info(user_id), t=True))
+
+    def add_random_question_to_user(self, user_id, user_info):
+        """Get random question and update user with it by one query.
+
+        If user got question early, answer of previous question is got by the same query.
+        User info is written to Redis by the same query too, so user is not changed in cache.
 
-        user_info['got_q'] = True
-        user_info['q'] = question
-        user_info['a'] = answer
-        self.add_or_update_user(user_id, user_info)
-        self.logger.debug(f'User got answer and updated, user_id={user_id}')
+        :param user_id: id of user in VK
+        :param user_info: dict or None, if user is new
+        :return: FetchedQuestion
+        """
+        previous_question = None
+        question_filter = None
+        if user_info is not None:
+            question_filter = user_info['f']
+            if user_info['got_q']:
+                previous_question = (user_info['g'], user_info['id'])
+
+        fetched_question = self.question_bank.get_random_question(self.name_of_hash, user_id, previous_question,
+                                                                  member=get_member('vk', user_id),
+                                                                  question_filter=question_filter)
+        new_user_info = {'got_q': True, 'g': fetched_question.generation, 'id': fetched_question.question_id,
+                         'f': question_filter, 't': False}
+        with self.cache_lock:
+            self.cache[user_id] = [new_user_info, time.monotonic() + self.cache_ttl, False]
+            self.cache.move_to_end(user_id)
+        self.logger.debug('User got answer and updated, user_id=%s', user_id)
+        return fetched_question
 
 
 def init_keyboard():
@@ -136,6 +246,23 @@ def init_keyboard():
     return keyboard
 
 
+def send_message(event, vk_api, msg, message_num=0):
+    """Send message with keyboard to user.
+
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param msg: str, text of message
+    :param message_num: int, number of message which is sent for event, see get_random_id
+    """
+    with track_latency(SEND_LATENCY.labels('vk'), 'vk_send'):
+        vk_api.messages.send(
+            user_id=event.user_id,
+            message=msg,
+            random_id=get_random_id(event, message_num),
+            keyboard=init_keyboard().get_keyboard()
+        )
+
+
 def give_up(event, vk_api, **kwargs):
     """Button give up logic.
 
@@ -147,24 +274,18 @@ def give_up(event, vk_api, **kwargs):
     answer = kwargs['answer']
     msg = kwargs['msg']
 
+    if answer is None and kwargs.get('got_question'):
+        return send_questions_reloaded_msg(event, vk_api, msg=msg)
+
     if answer is None:
         msg += 'Еще не получили вопрос, а уже сдаетесь? Попробуйте сыграть в викторину.\n'
         msg += 'Нажмите на кнопку "Новый вопрос".'
-        vk_api.messages.send(
-            user_id=event.user_id,
-            message=msg,
-            random_id=random.randint(1, 1000),
-            keyboard=init_keyboard().get_keyboard()
-        )
+        send_message(event, vk_api, msg)
         return 'give up without question'
 
+    count_answer('vk', 'give_up')
     msg = f'Жаль, правильный ответ:\n{answer}'
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message=msg,
-        random_id=random.randint(1, 1000),
-        keyboard=init_keyboard().get_keyboard()
-    )
+    send_message(event, vk_api, msg)
     return 'give up'
 
 
@@ -178,22 +299,16 @@ def new_question_old_user(event, vk_api, **kwargs):
     """
     msg = kwargs['msg']
     answer = kwargs['answer']
-    new_q = kwargs['q']
-
-    msg += f'А как же предыдущий вопрос?\nПравильный ответ:\n{answer}'
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message=msg,
-        random_id=random.randint(1, 1000),
-        keyboard=init_keyboard().get_keyboard()
-    )
+    new_q = kwargs['new_q']
+
+    if answer is None:
+        # generation of previous question was already deleted
+        msg += 'Вопросы викторины обновились, ответ на предыдущий вопрос уже недоступен.'
+    else:
+        msg += f'А как же предыдущий вопрос?\nПравильный ответ:\n{answer}'
+    send_message(event, vk_api, msg)
     msg = f'Ваш новый вопрос:\n{new_q}'
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message=msg,
-        random_id=random.randint(1, 1000),
-        keyboard=init_keyboard().get_keyboard()
-    )
+    send_message(event, vk_api, msg, message_num=1)
     return "new question for old user without answer previous"
 
 
@@ -206,15 +321,10 @@ def new_question_new_user(event, vk_api, **kwargs):
     :return: str, type of answer
     """
     msg = kwargs['msg']
-    new_q = kwargs['q']
+    new_q = kwargs['new_q']
 
     msg += new_q
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message=msg,
-        random_id=random.randint(1, 1000),
-        keyboard=init_keyboard().get_keyboard()
-    )
+    send_message(event, vk_api, msg)
     return 'new question for new user'
 
 
@@ -227,23 +337,88 @@ def check_answer(event, vk_api, **kwargs):
     :return: str, type of answer
     """
     correct_answer = kwargs['correct_answer']
+    answer_matcher = kwargs['answer_matcher']
+    score_board = kwargs['score_board']
 
-    if is_correct_answer(event.text, correct_answer, limit=0.5, answer_handler=normalize_answer):
+    if answer_matcher.is_correct(event.text, correct_answer):
+        count_answer('vk', 'correct')
+        score_board.add_points(get_member('vk', event.user_id))
         msg = f'Правильно! Полный ответ:\n{correct_answer}\nХотите новый вопрос? Выберите в меню.'
         type_of_answer = 'correct answer'
     else:
+        count_answer('vk', 'incorrect')
         msg = f'К сожалению нет! Полный ответ:\n{correct_answer}\nХотите новый вопрос? Выберите в меню.'
         type_of_answer = 'incorrect answer'
 
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message=msg,
-        random_id=random.randint(1, 1000),
-        keyboard=init_keyboard().get_keyboard()
-    )
+    send_message(event, vk_api, msg)
     return type_of_answer
 
 
+def send_score(event, vk_api, **kwargs):
+    """Send scores of user.
+
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param kwargs: dict, named args
+    :return: str, type of answer
+    """
+    score_board = kwargs['score_board']
+    msg = kwargs['msg']
+
+    msg += score_board.get_score_message(get_member('vk', event.user_id))
+    send_message(event, vk_api, msg)
+    return 'score'
+
+
+def send_filter_msg(event, vk_api, **kwargs):
+    """Send answer to command of choosing of category or difficulty.
+
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param kwargs: dict, named args
+    :return: str, type of answer
+    """
+    msg = kwargs['msg']
+
+    msg += kwargs['filter_msg']
+    send_message(event, vk_api, msg)
+    return 'filter'
+
+
+def send_time_is_over_msg(event, vk_api, **kwargs):
+    """Send message to user who answered after end of round.
+
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param kwargs: dict, named args
+    :return: str, type of answer
+    """
+    msg = kwargs['msg']
+
+    msg += 'Время на ответ вышло, правильный ответ уже отправлен.\nХотите новый вопрос? Выберите в меню.'
+    send_message(event, vk_api, msg)
+    return 'time is over'
+
+
+def reveal_answer(member, payload, vk_api):
+    """Send answer to user who didn't answer in time.
+
+    :param member: str, member of user, see scores.get_member
+    :param payload: dict, payload of timer with keys 'user_id' and 'answer'
+    :param vk_api: authorized session in vk
+    """
+    count_answer('vk', 'timeout')
+    msg = f'Время вышло! Правильный ответ:\n{payload["answer"]}\nХотите новый вопрос? Выберите в меню.'
+    with track_latency(SEND_LATENCY.labels('vk'), 'vk_send'):
+        vk_api.messages.send(
+            user_id=payload['user_id'],
+            message=msg,
+            random_id=get_random_id(),
+            keyboard=init_keyboard().get_keyboard()
+        )
+    logger.debug('"Time is over" message was sent, member=%s', member)
+
+
 def send_new_question_msg(event, vk_api, **kwargs):
     """Send recommendation to press button 'new question'.
 
@@ -255,22 +430,65 @@ def send_new_question_msg(event, vk_api, **kwargs):
     msg = kwargs['msg']
 
     msg += 'Нажмите на кнопку "Новый вопрос" для получения вопроса.'
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message=msg,
-        random_id=random.randint(1, 1000),
-        keyboard=init_keyboard().get_keyboard()
-    )
+    send_message(event, vk_api, msg)
     return 'press new question'
 
 
-def run_bot_logic(event, vk_api, redis_db, users_db, redis_set_name, redis_hash_name):
+def send_questions_reloaded_msg(event, vk_api, **kwargs):
+    """Send message that question of user can't be checked, because questions bank was reloaded.
+
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param kwargs: dict, named args
+    :return: str, type of answer
+    """
+    msg = kwargs['msg']
+
+    msg += 'Вопросы викторины обновились, ответ на ваш вопрос уже недоступен.\n'
+    msg += 'Нажмите на кнопку "Новый вопрос" для получения вопроса.'
+    send_message(event, vk_api, msg)
+    return 'questions were reloaded'
+
+
+def start_round(event, fetched_question, users_db, round_timers=None):
+    """Start timer of answer, answer is revealed by worker if user doesn't answer in time.
+
+    :param event: event which discribe message
+    :param fetched_question: FetchedQuestion which was sent to user
+    :param users_db: custom DB of users condition
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
+    """
+    if round_timers is None:
+        return
+    round_timers.schedule(get_member('vk', event.user_id),
+                          {'user_id': event.user_id, 'answer': fetched_question.answer})
+    users_db.mark_round_timer(event.user_id)
+
+
+def is_time_over(event, user_info, round_timers=None):
+    """Stop timer of question of user and check if it was already fired.
+
+    Timer and answer can't both win, answer was already revealed if timer was fired.
+
+    :param event: event which discribe message
+    :param user_info: dict or None, user info which was read before changes of event
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
+    :return: bool, True if time of answer is over, False if timer was stopped or wasn't started for question
+    """
+    if round_timers is None or user_info is None or not user_info['got_q'] or not user_info['t']:
+        return False
+    return not round_timers.cancel(get_member('vk', event.user_id))
+
+
+def run_bot_logic(event, vk_api, users_db, answer_matcher, score_board, round_timers=None):
     """Logic of bot.
 
     :param event: event which discribe message
     :param vk_api: authorized session in vk
-    :param redis_db: redis DB with questions
     :param users_db: custom DB of users condition
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
     """
     first_time = False
     got_question = True
@@ -279,86 +497,322 @@ def run_bot_logic(event, vk_api, redis_db, users_db, redis_set_name, redis_hash_
     if not (event.type == VkEventType.MESSAGE_NEW and event.to_me):
         return
 
-    logger.debug(f'Starting work. user_id={event.user_id}')
-    # in start we will get future question and answer if didn't get early
-    user_info = users_db.get_user_info(event.user_id)
-    if user_info is None:
-        users_db.add_or_update_user(event.user_id)
-        first_time = True
-        msg += 'Рады приветствовать вас в нашей викторине!\n'
-        logger.debug('User play first time.')
-
-    if not users_db.is_user_got_question(event.user_id, user_info):
-        got_question = False
-        logger.debug('User didn\'t get question.')
-
-    if event.text == "Сдаться":
-        logger.debug('User gave up')
-        answer = users_db.get_user_correct_answer(event.user_id, user_info)
-        type_of_answer = give_up(event, vk_api, answer=answer, msg=msg)
-        logger.debug(f'"{type_of_answer}" message was sent')
-        return
-    elif event.text == "Новый вопрос":
-        logger.debug('User is getting new question')
+    logger.debug('Starting work. user_id=%s', event.user_id)
+    try:
+        # in start we will get future question and answer if didn't get early
+        user_info = users_db.get_user_info(event.user_id)
+        if user_info is None:
+            users_db.add_or_update_user(event.user_id)
+            first_time = True
+            msg += 'Рады приветствовать вас в нашей викторине!\n'
+            logger.debug('User play first time.')
+
+        if not users_db.is_user_got_question(event.user_id, user_info):
+            got_question = False
+            logger.debug('User didn\'t get question.')
+
+        filter_command = handle_filter_command(users_db.question_bank, event.text, user_info and user_info['f'])
+        if filter_command is not None:
+            logger.debug('User is choosing filter of questions')
+            question_filter, filter_msg = filter_command
+            users_db.set_user_filter(event.user_id, question_filter)
+            type_of_answer = send_filter_msg(event, vk_api, filter_msg=filter_msg, msg=msg)
+            logger.debug('"%s" message was sent', type_of_answer)
+            return
 
-        # user isn't playing first time. But he pressed "new question" instead answer to question
-        if got_question and not first_time:
+        if event.text == "Сдаться":
+            logger.debug('User gave up')
+            if is_time_over(event, user_info, round_timers):
+                # answer was already revealed and counted by timer
+                users_db.get_user_correct_answer(event.user_id, user_info)
+                type_of_answer = send_time_is_over_msg(event, vk_api, msg=msg)
+                logger.debug('"%s" message was sent', type_of_answer)
+                return
             answer = users_db.get_user_correct_answer(event.user_id, user_info)
-            new_q = redis_db.srandmember(redis_set_name, 1)[0].decode('utf-8')
-            new_answer = redis_db.hget(redis_hash_name, new_q).decode('utf-8')
-            users_db.add_answer_to_user(event.user_id, user_info, new_q, new_answer)
-            type_of_answer = new_question_old_user(event, vk_api, answer=answer, new_q=new_q, msg=msg)
-            logger.debug(f'"{type_of_answer}" message was sent')
+            type_of_answer = give_up(event, vk_api, answer=answer, got_question=got_question, msg=msg)
+            logger.debug('"%s" message was sent', type_of_answer)
             return
-
-        # user is playing first time
-        new_q = redis_db.srandmember(redis_set_name, 1)[0].decode('utf-8')
-        new_answer = redis_db.hget(redis_hash_name, new_q).decode('utf-8')
-        users_db.add_answer_to_user(event.user_id, user_info, new_q, new_answer)
-        type_of_answer = new_question_new_user(event, vk_api, new_q=new_q, msg=msg)
-        logger.debug(f'"{type_of_answer}" message was sent')
-        return
-    else:
-        # user got question and he is trying answer
-        if got_question:
-            correct_answer = users_db.get_user_correct_answer(event.user_id, user_info)
-            type_of_answer = check_answer(event, vk_api, correct_answer=correct_answer)
-            logger.debug(f'"{type_of_answer}" message was sent')
+        elif event.text == "Новый вопрос":
+            logger.debug('User is getting new question')
+
+            # user isn't playing first time. But he pressed "new question" instead answer to question
+            if got_question and not first_time:
+                # user info will be rewritten with new question, so don't reset it
+                fetched_question = users_db.add_random_question_to_user(event.user_id, user_info)
+                type_of_answer = new_question_old_user(event, vk_api, answer=fetched_question.previous_answer,
+                                                       new_q=fetched_question.question, msg=msg)
+                logger.debug('"%s" message was sent', type_of_answer)
+                start_round(event, fetched_question, users_db, round_timers)
+                return
+
+            # user is playing first time
+            fetched_question = users_db.add_random_question_to_user(event.user_id, user_info)
+            type_of_answer = new_question_new_user(event, vk_api, new_q=fetched_question.question, msg=msg)
+            logger.debug('"%s" message was sent', type_of_answer)
+            start_round(event, fetched_question, users_db, round_timers)
+            return
+        elif event.text == "Мой счёт":
+            # question of user isn't changed, he can answer after
+            logger.debug('User is getting score')
+            type_of_answer = send_score(event, vk_api, score_board=score_board, msg=msg)
+            logger.debug('"%s" message was sent', type_of_answer)
+            return
+        else:
+            # user got question and he is trying answer
+            correct_answer = None
+            if is_time_over(event, user_info, round_timers):
+                users_db.get_user_correct_answer(event.user_id, user_info)
+                type_of_answer = send_time_is_over_msg(event, vk_api, msg=msg)
+                logger.debug('"%s" message was sent', type_of_answer)
+                return
+
+            if got_question:
+                # answer is None if generation of user question was already deleted
+                correct_answer = users_db.get_user_correct_answer(event.user_id, user_info)
+
+            if correct_answer is not None:
+                type_of_answer = check_answer(event, vk_api, correct_answer=correct_answer,
+                                              answer_matcher=answer_matcher, score_board=score_board)
+                logger.debug('"%s" message was sent', type_of_answer)
+                return
+
+            if got_question:
+                type_of_answer = send_questions_reloaded_msg(event, vk_api, msg=msg)
+                logger.debug('"%s" message was sent', type_of_answer)
+                return
+
+            # user didn't get question and bot must get recommendation to press 'new question' button
+            type_of_answer = send_new_question_msg(event, vk_api, msg=msg)
+            logger.debug('"%s" message was sent', type_of_answer)
             return
 
-        # user didn't get question and bot must get recommendation to press 'new question' button
-        type_of_answer = send_new_question_msg(event, vk_api, msg=msg)
-        logger.debug(f'"{type_of_answer}" message was sent')
-        return
+    finally:
+        # all changes of user are written by one query
+        users_db.save_user(event.user_id)
 
 
-if __name__ == "__main__":
-    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s', level=logging.DEBUG)
+def send_chat_message(vk_api, peer_id, msg):
+    """Send message to conversation.
+
+    :param vk_api: authorized session in vk
+    :param peer_id: int, id of conversation
+    :param msg: str, text of message
+    """
+    with track_latency(SEND_LATENCY.labels('vk'), 'vk_send'):
+        vk_api.messages.send(peer_id=peer_id, message=msg, random_id=get_random_id())
+
+
+def play_in_group(event, vk_api, group_game, answer_matcher, score_board, group_replies):
+    """Logic of bot in conversation, replies are coalesced.
 
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param group_game: GroupGame object
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param group_replies: ReplyCoalescer object
+    """
+    text = MENTION_RE.sub('', event.text)
+    msg = handle_group_message('vk', group_game, answer_matcher, score_board, event.peer_id, event.user_id,
+                               f'[id{event.user_id}|Игрок]', text)
+    if msg is not None:
+        group_replies.add(get_member('vk', event.peer_id), msg, partial(send_chat_message, vk_api, event.peer_id))
+        logger.debug('Reply to conversation was queued, peer_id=%s', event.peer_id)
+
+
+def handle_event(event, vk_api, users_db, answer_matcher, score_board, deduplicator=None, round_timers=None,
+                 group_game=None, group_replies=None):
+    """Run logic of bot if event wasn't handled early.
+
+    :param event: event which discribe message
+    :param vk_api: authorized session in vk
+    :param users_db: custom DB of users condition
+    :param answer_matcher: answer matcher object, see common_functions
+    :param score_board: ScoreBoard object
+    :param deduplicator: EventDeduplicator object or None, if events are not checked
+    :param round_timers: RoundTimerQueue object or None, if time of answer is not limited
+    :param group_game: GroupGame object or None, if bot doesn't play in conversations
+    :param group_replies: ReplyCoalescer object, it is required with group_game
+    """
+    with track_event('vk'):
+        if deduplicator is not None and not deduplicator.is_new(event):
+            return
+        if group_game is not None and getattr(event, 'peer_id', 0) > CHAT_PEER_ID_START:
+            play_in_group(event, vk_api, group_game, answer_matcher, score_board, group_replies)
+        else:
+            run_bot_logic(event, vk_api, users_db, answer_matcher, score_board, round_timers)
+        if deduplicator is not None:
+            # event which failed or whose replies were lost by restart is not remembered and is handled again
+            call_after_sent(vk_api, partial(deduplicator.mark_handled, event))
+
+
+def init_vk_worker(shard, vk_app_token, event_handler, rate_limit=20):
+    """Create VK API of worker process, every worker sends messages by its own dispatcher.
+
+    :param shard: int, number of worker
+    :param vk_app_token: str, token of VK group
+    :param event_handler: function(event, vk_api), handler of events
+    :param rate_limit: float, max count of API calls per second of worker
+    :return: function(event)
+    """
+    vk_session = vk.VkApi(token=vk_app_token)
+    vk_api, _ = create_dispatching_api(vk_session.get_api(), rate=rate_limit)
+    logger.debug('Got VK API connection of worker %s', shard)
+    return partial(event_handler, vk_api=vk_api)
+
+
+if __name__ == "__main__":
     dotenv.load_dotenv()
+    # DEBUG logs every step of every event, use INFO under load and watch metrics
+    logging.basicConfig(format='%(asctime)s  %(name)s  %(levelname)s  %(message)s',
+                        level=os.getenv('LOG_LEVEL', default='DEBUG').upper())
+
     vk_app_token = os.getenv('VK_APP_TOKEN')
     redis_db_address = os.getenv('REDIS_DB_ADDRESS')
     redis_db_port = os.getenv('REDIS_DB_PORT')
     redis_db_password = os.getenv('REDIS_DB_PASSWORD')
-    redis_set_of_questions_name = os.getenv('REDIS_SET_OF_QUESTIONS_NAME', default='QuestionAnswerSet')
+    redis_max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', default=50))
+    redis_socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', default=5))
+    redis_health_check_interval = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', default=30))
+    reconnect_max_delay = float(os.getenv('RECONNECT_MAX_DELAY', default=30))
     redis_hash_of_questions_and_answers_name = os.getenv('REDIS_HASH_OF_QUESTIONS_AND_ANSWERS_NAME',
                                                          default='QuestionAnswerHash')
     redis_hash_users_info_name = os.getenv('REDIS_HASH_USERS_INFO_NAME', default='UsersHash')
+    redis_generation_key_name = os.getenv('REDIS_QUESTIONS_GENERATION_KEY_NAME', default='QuestionBankGeneration')
+    generation_refresh_interval = float(os.getenv('QUESTIONS_GENERATION_REFRESH_INTERVAL', default=5))
+    redis_hash_question_schedules_name = os.getenv('REDIS_HASH_QUESTION_SCHEDULES_NAME', default='QuestionSchedule')
+    question_cache_enabled = os.getenv('QUESTION_CACHE', default='false').lower() in ('1', 'true', 'yes')
+    questions_snapshot_path = os.getenv('QUESTIONS_SNAPSHOT_PATH')
+    answer_matcher_name = os.getenv('ANSWER_MATCHER', default='words')
+    vk_runtime = os.getenv('VK_RUNTIME', default='sync')
+    vk_max_concurrency = int(os.getenv('VK_MAX_CONCURRENCY', default=16))
+    vk_api_rate_limit = float(os.getenv('VK_API_RATE_LIMIT', default=20))
+    handled_events_ttl = int(os.getenv('VK_HANDLED_EVENTS_TTL', default=600))
+    users_cache_size = int(os.getenv('VK_USERS_CACHE_SIZE', default=10000))
+    users_cache_ttl = float(os.getenv('VK_USERS_CACHE_TTL', default=30))
+    vk_callback_confirmation = os.getenv('VK_CALLBACK_CONFIRMATION')
+    vk_callback_secret = os.getenv('VK_CALLBACK_SECRET')
+    webhook_host = os.getenv('WEBHOOK_HOST', default='0.0.0.0')
+    webhook_port = int(os.getenv('PORT', default=8080))
+    webhook_workers = int(os.getenv('WEBHOOK_WORKERS', default=4))
+    scores_top_cache_ttl = float(os.getenv('SCORES_TOP_CACHE_TTL', default=5))
+    metrics_port = int(os.getenv('METRICS_PORT', default=0))
+    round_time = float(os.getenv('ROUND_TIME', default=0))
+    round_timers_poll_interval = float(os.getenv('ROUND_TIMERS_POLL_INTERVAL', default=0.5))
+    worker_processes = int(os.getenv('WORKER_PROCESSES', default=0))
+    worker_queue_size = int(os.getenv('WORKER_QUEUE_SIZE', default=1000))
+    group_games_enabled = os.getenv('GROUP_GAMES', default='false').lower() in ('1', 'true', 'yes')
+    group_replies_interval = float(os.getenv('GROUP_REPLIES_INTERVAL', default=3))
+    events_capture_path = os.getenv('EVENTS_CAPTURE_PATH')
+    events_capture_max_bytes = int(os.getenv('EVENTS_CAPTURE_MAX_BYTES', default=50 * 1024 * 1024))
+    events_capture_backup_count = int(os.getenv('EVENTS_CAPTURE_BACKUP_COUNT', default=3))
     logger.debug('.env was read')
 
-    redis_db = redis.Redis(host=redis_db_address, port=redis_db_port, password=redis_db_password)
+    redis_db = create_redis(redis_db_address, redis_db_port, redis_db_password, max_connections=redis_max_connections,
+                            socket_timeout=redis_socket_timeout, health_check_interval=redis_health_check_interval,
+                            backoff_max_delay=reconnect_max_delay)
+    wait_for_redis(redis_db)
     logger.debug('Got DB connection')
-    users_db = VkSessionUsersCondition(redis_db, redis_hash_users_info_name)
+    # half correct words is OK
+    answer_matcher = get_answer_matcher(answer_matcher_name, limit=0.5)
+    question_cache = None
+    if question_cache_enabled:
+        # answers are prepared for checking together with loading of questions
+        question_cache = QuestionCache(redis_db, redis_hash_of_questions_and_answers_name,
+                                       snapshot_path=questions_snapshot_path, answer_matcher=answer_matcher)
+    question_bank = QuestionBank(redis_db, redis_hash_of_questions_and_answers_name,
+                                 generation_key_name=redis_generation_key_name,
+                                 refresh_interval=generation_refresh_interval,
+                                 schedule_hash_name=redis_hash_question_schedules_name,
+                                 question_cache=question_cache)
+    # texts of questions are served locally from the first question
+    question_bank.preload()
+    if vk_runtime == 'webhook':
+        # any of several webhook servers can get the next event of user, so user info is read on every event
+        users_cache_ttl = 0
+    users_db = VkSessionUsersCondition(redis_db, redis_hash_users_info_name, question_bank,
+                                       cache_size=users_cache_size, cache_ttl=users_cache_ttl)
+    deduplicator = EventDeduplicator(redis_db, ttl=handled_events_ttl) if handled_events_ttl else None
+    score_board = ScoreBoard(redis_db, top_cache_ttl=scores_top_cache_ttl)
+    round_timers = RoundTimerQueue(redis_db, 'RoundTimers:vk', round_time=round_time) if round_time else None
+    group_game = GroupGame(redis_db, question_bank) if group_games_enabled else None
+    # thread of coalescer is started by the first reply, so it is started in worker process
+    group_replies = ReplyCoalescer(interval=group_replies_interval)
+    recorder = None
+    if events_capture_path:
+        recorder = EventRecorder(events_capture_path, max_bytes=events_capture_max_bytes,
+                                 backup_count=events_capture_backup_count)
+
+    workers = None
+    if worker_processes and vk_runtime == 'sync':
+        # workers are forked before start of threads, events of one user are handled by one worker
+        event_handler = partial(handle_event, users_db=users_db, answer_matcher=answer_matcher,
+                                score_board=score_board, deduplicator=deduplicator, round_timers=round_timers,
+                                group_game=group_game, group_replies=group_replies)
+        init_worker = partial(init_vk_worker, vk_app_token=vk_app_token, event_handler=event_handler,
+                              rate_limit=vk_api_rate_limit / worker_processes)
+        workers = ShardedWorkers(init_worker, workers=worker_processes, queue_size=worker_queue_size,
+                                 metrics_port=metrics_port)
+
+    if vk_runtime != 'webhook':
+        # webhook server serves metrics itself
+        start_metrics_server(metrics_port)
+
+    vk_session = vk.VkApi(token=vk_app_token)
+    logger.debug('Got VK API connection')
+    vk_api, dispatcher = create_dispatching_api(vk_session.get_api(), rate=vk_api_rate_limit)
+
+    if round_timers is not None:
+        # answers of timers are sent by threaded dispatcher in all runtimes
+        RoundTimerWorker(round_timers, partial(reveal_answer, vk_api=vk_api), poll_interval=round_timers_poll_interval)
+
+    # long poll is restarted after errors not more often than backoff allows
+    longpoll_backoff = Backoff(max_delay=reconnect_max_delay)
+
+    while vk_runtime == 'async':
+        try:
+            event_handler = partial(handle_event, users_db=users_db, answer_matcher=answer_matcher,
+                                    score_board=score_board, deduplicator=deduplicator, round_timers=round_timers,
+                                    group_game=group_game, group_replies=group_replies)
+            if recorder is not None:
+                event_handler = recorder.wrap('vk', event_handler)
+            # dispatcher doesn't depend on event loop, so one dispatcher thread serves all restarts
+            asyncio.run(run_async_bot(vk_app_token, event_handler, dispatcher, max_concurrency=vk_max_concurrency,
+                                      backoff_max_delay=reconnect_max_delay))
+        except Exception:
+            delay = longpoll_backoff.failed()
+            logger.exception('Critical error in async runtime, restart in %.1f sec', delay)
+            longpoll_backoff.sleep()
+
+    if vk_runtime == 'webhook':
+        event_handler = partial(handle_event, vk_api=vk_api, users_db=users_db, answer_matcher=answer_matcher,
+                                score_board=score_board, deduplicator=deduplicator, round_timers=round_timers,
+                                group_game=group_game, group_replies=group_replies)
+        if recorder is not None:
+            event_handler = recorder.wrap('vk', event_handler)
+        routes = {'/vk': VkCallbackRoute(event_handler, vk_callback_confirmation, vk_callback_secret)}
+        run_webhook_server(routes, host=webhook_host, port=webhook_port, workers=webhook_workers)
 
     while True:
         try:
-            vk_session = vk.VkApi(token=vk_app_token)
-            logger.debug('Got VK API connection')
-            vk_api = vk_session.get_api()
             longpoll = VkLongPoll(vk_session)
             for event in longpoll.listen():
-                if event.type == VkEventType.MESSAGE_NEW and event.to_me:
-                    run_bot_logic(event, vk_api, redis_db, users_db, redis_set_of_questions_name,
-                                  redis_hash_of_questions_and_answers_name)
+                longpoll_backoff.reset()
+                if not (event.type == VkEventType.MESSAGE_NEW and event.to_me):
+                    continue
+                if recorder is not None:
+                    recorder.record('vk', event)
+                if workers is not None:
+                    # events of conversation are handled by one worker, replies to it are coalesced there
+                    workers.put(event.peer_id, event)
+                    continue
+                try:
+                    handle_event(event, vk_api, users_db, answer_matcher, score_board, deduplicator, round_timers,
+                                 group_game, group_replies)
+                except Exception:
+                    # error of one event doesn't restart long poll
+                    logger.exception('Error in handling of event, user_id=%s', event.user_id)
         except Exception:
-            logger.exception('Critical error in ')
+            delay = longpoll_backoff.failed()
+            logger.exception('Critical error in long poll, restart in %.1f sec', delay)
+            longpoll_backoff.sleep()
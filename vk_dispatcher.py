@@ -0,0 +1,265 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from vk_api.vk_api import VkApiMethod
+
+from metrics import SEND_LATENCY, track_latency
+
+logger = logging.getLogger(__name__)
+
+# VK executes not more than 25 API calls in one 'execute' request
+EXECUTE_MAX_CALLS = 25
+
+
+class TokenBucket:
+    """Thread-safe rate limiter.
+
+    :param rate: float, count of tokens which are added per second
+    :param capacity: int, max count of tokens, size of burst
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(int(rate), 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, wait if there are no tokens."""
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+def get_destination(message):
+    """Get destination of message, user or conversation.
+
+    :param message: dict, params of messages.send
+    :return: tuple, (user_id, peer_id) or None if message has no destination
+    """
+    destination = (message.get('user_id'), message.get('peer_id'))
+    return None if destination == (None, None) else destination
+
+
+def merge_messages(messages):
+    """Merge messages which go to the same user or conversation one after another.
+
+    Merged message has text of all messages, keyboard of last message and random_id of first message.
+
+    :param messages: list of dicts, params of messages.send
+    :return: list of dicts, params of messages.send
+    """
+    merged_messages = []
+    for message in messages:
+        previous_message = merged_messages[-1] if merged_messages else None
+        destination = get_destination(message)
+        if previous_message is not None and destination is not None \
+                and get_destination(previous_message) == destination \
+                and 'message' in previous_message and 'message' in message:
+            previous_message['message'] = f'{previous_message["message"]}\n\n{message["message"]}'
+            if 'keyboard' in message:
+                previous_message['keyboard'] = message['keyboard']
+            continue
+        merged_messages.append(dict(message))
+    return merged_messages
+
+
+def execute_code(vk_api, code):
+    """Call 'execute' method and get errors of calls too.
+
+    :param vk_api: authorized session in vk
+    :param code: str, VKScript code
+    :return: tuple, (list of results of calls, False for failed call; list of dicts, execute_errors)
+    """
+    # execute_errors are returned only by raw response of session of API object
+    vk_session = getattr(vk_api, '_vk', None)
+    if vk_session is None:
+        return vk_api.execute(code=code), []
+    response = vk_session.method('execute', {'code': code}, raw=True)
+    return response['response'], response.get('execute_errors', [])
+
+
+def get_execute_code(messages):
+    """Get VKScript code which sends all messages by one request.
+
+    :param messages: list of dicts, params of messages.send
+    :return: str, code for 'execute' method
+    """
+    calls = ','.join(f'API.messages.send({json.dumps(message, ensure_ascii=False)})' for message in messages)
+    return f'return [{calls}];'
+
+
+class VkMessageDispatcher:
+    """Queue of outbound messages of VK bot.
+
+    Messages are sent from background thread. Messages which come at the same time are grouped:
+    messages to the same user are merged, and up to 25 messages are sent by one 'execute' request.
+    Requests are limited by token bucket, so VK API limit of requests per second is not exceeded.
+    Functions can be queued between messages (see call_after_sent), they are called after all messages
+    which were queued before them were sent. If one of messages wasn't sent, functions after it are not called.
+
+    :param vk_api: authorized session in vk
+    :param rate: float, max count of requests to VK API per second
+    :param flush_interval: float, seconds of waiting of other messages for grouping
+    """
+
+    def __init__(self, vk_api, rate=20, flush_interval=0.05):
+        self.vk_api = vk_api
+        self.rate_limiter = TokenBucket(rate)
+        self.flush_interval = flush_interval
+        self.messages = queue.Queue()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.worker = threading.Thread(target=self.run, name='VkMessageDispatcher', daemon=True)
+        self.worker.start()
+        self.logger.debug('Class params were initialized')
+
+    def send(self, **params):
+        """Add message to queue.
+
+        :param params: params of messages.send
+        """
+        self.messages.put(params)
+
+    def call_after_sent(self, callback):
+        """Call function after all queued messages are sent, function is not called if they were not sent.
+
+        :param callback: function()
+        """
+        self.messages.put(callback)
+
+    def get_batch(self):
+        """Wait first message and collect messages which come during :flush_interval:.
+
+        :return: list of dicts, params of messages.send
+        """
+        batch = [self.messages.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < EXECUTE_MAX_CALLS:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.messages.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def send_batch(self, batch):
+        """Send messages by one request, then call functions of batch.
+
+        :param batch: list of dicts (params of messages.send) and functions
+        """
+        messages = merge_messages([message for message in batch if isinstance(message, dict)])
+        # count of first messages which were sent, error of single message is raised by messages.send
+        sent = len(messages)
+        if messages:
+            self.rate_limiter.acquire()
+            with track_latency(SEND_LATENCY.labels('vk_api'), 'vk_api'):
+                if len(messages) == 1:
+                    self.vk_api.messages.send(**messages[0])
+                else:
+                    results, execute_errors = execute_code(self.vk_api, get_execute_code(messages))
+                    failed = [message_num for message_num, result in enumerate(results) if result is False]
+                    if failed or execute_errors:
+                        # VK continues execution after failed call, if failed call is unknown, all are suspected
+                        sent = min(failed) if failed else 0
+                        self.logger.warning('Messages were not sent, failed=%s, errors=%s', failed, execute_errors)
+            self.logger.debug('%s messages were sent by one request', sent)
+
+        for position, callback in enumerate(batch):
+            if not callable(callback):
+                continue
+            # messages before function are merged in the same way as all messages of batch
+            if len(merge_messages([message for message in batch[:position] if isinstance(message, dict)])) > sent:
+                self.logger.warning('Function after sending of messages was skipped, message before it failed')
+                continue
+            try:
+                callback()
+            except Exception:
+                self.logger.exception('Function after sending of messages failed')
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            try:
+                self.send_batch(batch)
+            except Exception:
+                self.logger.exception('%s messages were not sent', len(batch))
+            finally:
+                for _ in batch:
+                    self.messages.task_done()
+
+    def join(self):
+        """Wait until all messages from queue are sent."""
+        self.messages.join()
+
+
+class DispatchingVkSession:
+    """VK session which sends messages through dispatcher, other methods are called directly.
+
+    Usage:
+        vk_api = DispatchingVkApi(vk_api, dispatcher)
+        vk_api.messages.send(...)
+
+    :param vk_api: authorized session in vk
+    :param dispatcher: VkMessageDispatcher object
+    """
+
+    def __init__(self, vk_api, dispatcher):
+        self.vk_api = vk_api
+        self.dispatcher = dispatcher
+
+    def method(self, method, values=None):
+        if method == 'messages.send':
+            self.dispatcher.send(**(values or {}))
+            return None
+
+        vk_method = self.vk_api
+        for name in method.split('.'):
+            vk_method = getattr(vk_method, name)
+        return vk_method(**(values or {}))
+
+
+class DispatchingVkApi(VkApiMethod):
+    """VK API object (vk_api.messages.send(...)) which sends messages through dispatcher.
+
+    :param vk_api: authorized session in vk
+    :param dispatcher: VkMessageDispatcher object
+    """
+
+    def __init__(self, vk_api, dispatcher):
+        super().__init__(DispatchingVkSession(vk_api, dispatcher))
+        self.dispatcher = dispatcher
+
+
+def create_dispatching_api(vk_api, rate=20):
+    """Create VK API which sends messages through new dispatcher.
+
+    :param vk_api: authorized session in vk
+    :param rate: float, max count of requests to VK API per second
+    :return: tuple, (DispatchingVkApi, VkMessageDispatcher)
+    """
+    dispatcher = VkMessageDispatcher(vk_api, rate=rate)
+    return DispatchingVkApi(vk_api, dispatcher), dispatcher
+
+
+def call_after_sent(vk_api, callback):
+    """Call function after messages which were sent by vk_api are delivered to VK.
+
+    :param vk_api: VK API object
+    :param callback: function(), it is called at once if vk_api sends messages without dispatcher
+    """
+    if isinstance(vk_api, DispatchingVkApi):
+        vk_api.dispatcher.call_after_sent(callback)
+    else:
+        callback()
@@ -0,0 +1,88 @@
+import hashlib
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# random_id of VK messages is signed int32
+MAX_RANDOM_ID = 2 ** 31 - 1
+
+# ids of messages without event grow from current time, so they don't repeat after restart
+fallback_random_ids = itertools.count(time.time_ns() // 1000)
+
+
+def get_event_key(event):
+    """Get id of event which is the same when the same event is received again.
+
+    :param event: event which discribe message
+    :return: str or None, None if event has no id
+    """
+    message_id = getattr(event, 'message_id', None)
+    if message_id is None:
+        return None
+    return f'{event.user_id}:{message_id}'
+
+
+def get_random_id(event=None, message_num=0):
+    """Get random_id for messages.send.
+
+    random_id of answer is hash of event id and number of answer message,
+    so message which is sent again for the same event gets the same random_id and VK doesn't duplicate it.
+    Messages without event get growing ids.
+
+    :param event: event which discribe message or None
+    :param message_num: int, number of message which is sent for event
+    :return: int, random_id
+    """
+    event_key = get_event_key(event) if event is not None else None
+    if event_key is None:
+        return next(fallback_random_ids) % MAX_RANDOM_ID + 1
+
+    digest = hashlib.blake2b(f'{event_key}:{message_num}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % MAX_RANDOM_ID + 1
+
+
+class EventDeduplicator:
+    """Registry of handled events in Redis.
+
+    Event is handled only one time even if it is received again after reconnect or restart.
+    Event is remembered only after it was handled and its replies were sent (see mark_handled),
+    so event which was lost by error or by restart of bot is handled again when it is received again.
+    The same event which is received while it is handled can be handled twice,
+    replies of it have the same random_id, so VK doesn't send them twice.
+
+    :param redis_db: object of connection redis db
+    :param key_prefix: str, prefix of keys of handled events
+    :param ttl: int, seconds while event is remembered
+    """
+
+    def __init__(self, redis_db, key_prefix='VkHandledEvents', ttl=600):
+        self.redis_db = redis_db
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def is_new(self, event):
+        """Check that event wasn't handled early.
+
+        :param event: event which discribe message
+        :return: bool, True if event is new or has no id
+        """
+        event_key = get_event_key(event)
+        if event_key is None:
+            return True
+
+        if self.redis_db.exists(f'{self.key_prefix}:{event_key}'):
+            self.logger.debug('Event was already handled, event_key=%s', event_key)
+            return False
+        return True
+
+    def mark_handled(self, event):
+        """Remember that event was handled.
+
+        :param event: event which discribe message
+        """
+        event_key = get_event_key(event)
+        if event_key is not None:
+            self.redis_db.set(f'{self.key_prefix}:{event_key}', 1, ex=self.ttl)
@@ -0,0 +1,253 @@
+import json
+import logging
+import queue
+import threading
+import zlib
+from concurrent.futures import Future, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+from vk_api.longpoll import VkEventType
+
+from metrics import METRICS_PATH, get_metrics
+from tg_persistence import RedisPersistence
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionedWorkerPool:
+    """Pool of worker threads.
+
+    Items with the same key are handled by the same worker one by one in order of submitting,
+    items with different keys are handled in parallel.
+
+    :param handler: function(item), handler of item
+    :param workers: int, count of worker threads
+    :param queue_size: int, max count of waiting items of one worker
+    """
+
+    def __init__(self, handler, workers=4, queue_size=1000):
+        self.handler = handler
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.logger = logging.getLogger(self.__class__.__name__)
+        for worker_num, worker_queue in enumerate(self.queues):
+            threading.Thread(target=self.run, args=(worker_queue,), name=f'Worker-{worker_num}', daemon=True).start()
+        self.logger.debug(f'{workers} workers were started')
+
+    def submit(self, key, item):
+        """Add item to queue of worker.
+
+        :param key: str or int, key of partition, for example user id
+        :param item: any object for handler
+        :return: bool, False if queue of worker is full
+        """
+        worker_queue = self.queues[zlib.crc32(str(key).encode('utf-8')) % len(self.queues)]
+        try:
+            worker_queue.put_nowait(item)
+        except queue.Full:
+            self.logger.warning('Queue of worker is full, key=%s', key)
+            return False
+        return True
+
+    def run(self, worker_queue):
+        while True:
+            item = worker_queue.get()
+            try:
+                self.handler(item)
+            except Exception:
+                self.logger.exception('Error in handling of item')
+            finally:
+                worker_queue.task_done()
+
+
+class TelegramWebhookRoute:
+    """Webhook of telegram bot.
+
+    If dispatcher has RedisPersistence, state of user is read from Redis before every update
+    and changes are written to Redis before answer to telegram, so any server can handle the next update.
+
+    :param bot: tg bot object
+    :param dispatcher: dispatcher of tg updater with handlers
+    """
+
+    def __init__(self, bot, dispatcher):
+        self.bot = bot
+        self.dispatcher = dispatcher
+
+    def parse(self, body):
+        """Parse request from telegram.
+
+        :param body: bytes, body of request
+        :return: tuple, (status, text of response, key of partition, item or None)
+        """
+        data = json.loads(body)
+        message = data.get('message') or data.get('edited_message') or {}
+        key = message.get('chat', {}).get('id', data.get('update_id'))
+        return 200, 'ok', key, data
+
+    def handle(self, data):
+        update = Update.de_json(data, self.bot)
+        persistence = self.dispatcher.persistence
+        if not isinstance(persistence, RedisPersistence):
+            self.dispatcher.process_update(update)
+            return
+
+        user_id = update.effective_user.id if update.effective_user else None
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        persistence.forget_cached(user_id, chat_id)
+        self.dispatcher.process_update(update)
+        persistence.flush()
+
+
+class VkCallbackEvent:
+    """Event of VK Callback API with interface of long poll event.
+
+    :param message: dict, object of message_new event
+    """
+
+    def __init__(self, message):
+        self.type = VkEventType.MESSAGE_NEW
+        self.to_me = True
+        self.from_me = False
+        self.user_id = message['from_id']
+        self.peer_id = message.get('peer_id', self.user_id)
+        self.message_id = message.get('id') or None
+        self.text = message.get('text', '')
+
+
+class VkCallbackRoute:
+    """Webhook of VK bot (Callback API).
+
+    :param handle_event: function(event), handler of event
+    :param confirmation: str, string which VK waits for confirmation of server
+    :param secret: str or None, secret key of Callback API
+    """
+
+    def __init__(self, handle_event, confirmation, secret=None):
+        self.handle_event = handle_event
+        self.confirmation = confirmation
+        self.secret = secret
+
+    def parse(self, body):
+        """Parse request from VK.
+
+        :param body: bytes, body of request
+        :return: tuple, (status, text of response, key of partition, item or None)
+        """
+        data = json.loads(body)
+        if self.secret and data.get('secret') != self.secret:
+            return 403, 'wrong secret', None, None
+
+        if data.get('type') == 'confirmation':
+            return 200, self.confirmation, None, None
+
+        if data.get('type') != 'message_new':
+            return 200, 'ok', None, None
+
+        # since VK API 5.103 message is wrapped in object
+        message = data['object'].get('message', data['object'])
+        event = VkCallbackEvent(message)
+        # messages of one conversation are handled in order
+        return 200, 'ok', event.peer_id, event
+
+    def handle(self, event):
+        self.handle_event(event)
+
+
+def create_request_handler(routes, worker_pool, handle_timeout=10):
+    """Create class of handler of HTTP requests.
+
+    Answer is sent after item is handled, so telegram and VK repeat update which failed.
+
+    :param routes: dict, path -> route object (TelegramWebhookRoute or VkCallbackRoute)
+    :param worker_pool: PartitionedWorkerPool object
+    :param handle_timeout: float, max seconds of waiting for handling of item
+    :return: class of request handler
+    """
+
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != METRICS_PATH:
+                self.send_text(404, 'not found')
+                return
+
+            body, content_type = get_metrics()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            route = routes.get(self.path)
+            if route is None:
+                self.send_text(404, 'not found')
+                return
+
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                status, response_text, key, item = route.parse(body)
+            except (ValueError, KeyError):
+                logger.exception('Wrong request, path=%s', self.path)
+                self.send_text(400, 'bad request')
+                return
+
+            if item is None:
+                self.send_text(status, response_text)
+                return
+
+            result = Future()
+            if not worker_pool.submit(key, (route, item, result)):
+                self.send_text(503, 'busy')
+                return
+            try:
+                result.result(timeout=handle_timeout)
+            except TimeoutError:
+                # item is still in queue of worker, repeated update would be handled twice
+                logger.warning('Item was not handled in %s sec, path=%s', handle_timeout, self.path)
+            except Exception:
+                self.send_text(500, 'error')
+                return
+            self.send_text(status, response_text)
+
+        def send_text(self, status, text):
+            encoded_text = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(encoded_text)))
+            self.end_headers()
+            self.wfile.write(encoded_text)
+
+        def log_message(self, format, *args):
+            logger.debug('%s %s', self.address_string(), format % args)
+
+    return WebhookRequestHandler
+
+
+def handle_route_item(route_item):
+    route, item, result = route_item
+    try:
+        route.handle(item)
+    except Exception as e:
+        result.set_exception(e)
+        raise
+    result.set_result(None)
+
+
+def run_webhook_server(routes, host='0.0.0.0', port=8080, workers=4, handle_timeout=10):
+    """Start HTTP server which receives updates and handles them by pool of workers.
+
+    Update is answered after its changes of state are written to Redis and routes read state from Redis
+    on every update, so several servers can work behind load balancer without routing of users.
+    Metrics of bot are available on GET /metrics of the same server.
+
+    :param routes: dict, path -> route object (TelegramWebhookRoute or VkCallbackRoute)
+    :param host: str, host of server
+    :param port: int, port of server
+    :param workers: int, count of worker threads
+    :param handle_timeout: float, max seconds of waiting for handling of update before answer
+    """
+    worker_pool = PartitionedWorkerPool(handle_route_item, workers=workers)
+    server = ThreadingHTTPServer((host, port), create_request_handler(routes, worker_pool, handle_timeout))
+    logger.debug(f'Webhook server was started on {host}:{port}, paths={list(routes)}')
+    server.serve_forever()